@@ -18,6 +18,7 @@ from __future__ import annotations
 import asyncio
 import json
 import logging
+import re
 from datetime import datetime
 from typing import Annotated, Any, Dict, List, Optional, TypedDict
 
@@ -28,8 +29,10 @@ load_dotenv()
 from google import genai
 from google.genai import types
 
-from database.chroma import get_chroma_collection
+from api.services.content_refs import content_id_of, content_scope
+from database.chroma import active_index, get_chroma_collection, get_collection
 from database.mongo import get_db
+from core.embedding_cache import embedding_cache
 from core.llm_router import (
     call_gemini_with_fallback,
     router_key_manager,
@@ -59,6 +62,7 @@ class AgentState(TypedDict):
     user_id: str
     file_id: Optional[str]
     scope_classroom_id: Optional[str]
+    page_range: Optional[tuple[int, int]]  # Explicit page filter from the request
     
     # ── Enrichment (Populated by entry_node) ──
     user_profile: Optional[Any]
@@ -71,6 +75,7 @@ class AgentState(TypedDict):
     
     # ── Retrieval (Populated by embed/retriever/web) ──
     query_embedding: Optional[List[float]]
+    vector_collection: Optional[str]  # Collection matching query_embedding's model
     retrieved_chunks: List[Any]
     used_sources: List[Any]
     web_search_results: List[Any]
@@ -87,11 +92,16 @@ class AgentState(TypedDict):
 
 logger = logging.getLogger(__name__)
 
-EMBED_MODEL = "models/gemini-embedding-001"
 # RELEVANCE_THRESHOLD: minimum cosine similarity to treat a chunk as relevant.
 # Chunks below this score are silently dropped and never shown to the user.
 RELEVANCE_THRESHOLD = 0.35
 
+# "page 12", "pages 40-60", "pp. 40–60", "pages 40 to 60"
+_PAGE_RANGE_RE = re.compile(
+    r"\b(?:pages?|pp?\.)\s*(\d{1,5})(?:\s*(?:-|–|—|to|through)\s*(\d{1,5}))?",
+    re.IGNORECASE,
+)
+
 
 def _get_embed_client() -> genai.Client:
     """Get a healthy client from the CHAT pool for embeddings."""
@@ -343,20 +353,37 @@ async def fast_reject_node(state: dict) -> dict:
 # ══════════════════════════════════════════════════════════════════════
 
 async def embed_node(state: dict) -> dict:
-    """Generate query embedding for RAG and WEB_SEARCH paths."""
+    """
+    Generate query embedding for RAG and WEB_SEARCH paths. The index version is
+    read once, so retrieval searches the collection this model's vectors live in
+    even if a corpus migration switches collections in between.
+    """
     logger.info("[embed_node] Embedding query...")
-    client = _get_embed_client()
+    index = active_index()
+    embed_model = index["embed_model"]
 
     try:
+        cached = await embedding_cache.get_many(embed_model, "RETRIEVAL_QUERY", [state["query"]])
+        if cached[0] is not None:
+            logger.info("[embed_node] Embedding cache HIT")
+            return {
+                "query_embedding": cached[0],
+                "vector_collection": index["collection"],
+                "processing_status": "embedded",
+            }
+
+        client = _get_embed_client()
         embed_result = await client.aio.models.embed_content(
-            model=EMBED_MODEL,
+            model=embed_model,
             contents=state["query"],
             config={"task_type": "RETRIEVAL_QUERY"},
         )
         query_embedding = list(embed_result.embeddings[0].values)
         logger.info("[embed_node] %d-dim embedding generated", len(query_embedding))
+        await embedding_cache.put_many(embed_model, "RETRIEVAL_QUERY", [state["query"]], [query_embedding])
         return {
             "query_embedding": query_embedding,
+            "vector_collection": index["collection"],
             "processing_status": "embedded",
         }
     except Exception as e:
@@ -372,7 +399,7 @@ async def _fetch_recent_files_metadata(classroom_id: str, limit: int = 5) -> Lis
     db = get_db()
     cursor = (
         db.file_metadata.find(
-            {"classroom_id": classroom_id, "processing.status": "completed"},
+            {"classroom_id": classroom_id, "processing.status": {"$in": ["completed", "partially_ready"]}},
             {"file_id": 1, "original_name": 1, "uploaded_at": 1, "file_type": 1, "_id": 0}
         )
         .sort("uploaded_at", -1)
@@ -391,6 +418,27 @@ async def _fetch_recent_files_metadata(classroom_id: str, limit: int = 5) -> Lis
 # Also fetches recent metadata for temporal queries.
 # ══════════════════════════════════════════════════════════════════════
 
+def _page_range(state: dict) -> Optional[tuple[int, int]]:
+    """The page range to search: the request's explicit one, else one named in the query."""
+    if state.get("page_range"):
+        first, last = state["page_range"]
+    elif match := _PAGE_RANGE_RE.search(state["query"]):
+        first, last = int(match.group(1)), int(match.group(2) or match.group(1))
+    else:
+        return None
+    return min(first, last), max(first, last)
+
+
+def _page_filter(first: int, last: int) -> dict:
+    """Chunks whose page span (page_number..page_end) overlaps first..last."""
+    return {"$or": [
+        # Starts inside the range (also matches chunks indexed before page_end existed)
+        {"$and": [{"page_number": {"$gte": first}}, {"page_number": {"$lte": last}}]},
+        # Starts before the range and runs into it
+        {"$and": [{"page_number": {"$lt": first}}, {"page_end": {"$gte": first}}]},
+    ]}
+
+
 async def retriever_vector_node(state: dict) -> dict:
     """
     Query ChromaDB for top 8 chunks. Filter by RELEVANCE_THRESHOLD.
@@ -401,7 +449,9 @@ async def retriever_vector_node(state: dict) -> dict:
     scope: RouterOutput = state["router_output"]
     profile: UserProfile = state["user_profile"]
     query_text = state["query"].lower()
-    collection = get_chroma_collection()
+    collection = (
+        get_collection(state["vector_collection"]) if state.get("vector_collection") else get_chroma_collection()
+    )
     reasoning_msg = "Searching course materials..."
     recent_files = []
 
@@ -422,19 +472,26 @@ async def retriever_vector_node(state: dict) -> dict:
         }
 
     # ── Build where filter ────────────────────────────────────────
+    # Vectors live under their content's file_id, which classrooms may share
+    # (api/services/content_refs.py): classrooms → content ids → Chroma filter
     file_id = state.get("file_id")
     if file_id:
-        where_filter = {"file_id": {"$eq": file_id}}
+        file_doc = await get_db().file_metadata.find_one(
+            {"file_id": file_id}, {"_id": 0, "file_id": 1, "content_id": 1, "original_name": 1},
+        )
+        content_id = content_id_of(file_doc) if file_doc else file_id
+        file_names = {content_id: file_doc["original_name"]} if file_doc else {}
+        where_filter = {"file_id": {"$eq": content_id}}
         reasoning_msg = "Searching within specific file..."
     else:
         # Priority: router scope → session scope → all enrolled
         target_cls = scope.scope_classroom_id or state.get("scope_classroom_id")
 
         if target_cls and target_cls in profile.enrolled_classroom_ids:
-            where_filter = {"classroom_id": {"$eq": target_cls}}
+            file_names = await content_scope([target_cls])
             reasoning_msg = f"Searching in your classroom materials..."
         elif profile.enrolled_classroom_ids:
-            where_filter = {"classroom_id": {"$in": profile.enrolled_classroom_ids}}
+            file_names = await content_scope(profile.enrolled_classroom_ids)
             reasoning_msg = f"Searching across {len(profile.enrolled_classroom_ids)} classrooms..."
         else:
             logger.warning("[retriever_node] No enrolled classrooms for user")
@@ -445,31 +502,48 @@ async def retriever_vector_node(state: dict) -> dict:
                 "processing_status": "generating",
                 "reasoning": state.get("reasoning", []) + ["No enrolled classrooms found."],
             }
+        # Chroma rejects an empty $in; a classroom without files matches nothing
+        where_filter = {"file_id": {"$in": list(file_names) or [""]}}
+
+    # ── Page range: narrows the search to chunks whose page span overlaps it ──
+    page_range = _page_range(state)
+    if page_range:
+        reasoning_msg += f" (pages {page_range[0]}–{page_range[1]})"
 
-    logger.info("[retriever_node] filter=%s", where_filter)
+    def _with_pages(where: dict) -> dict:
+        return {"$and": [where, _page_filter(*page_range)]} if page_range else where
+
+    logger.info("[retriever_node] filter=%s", _with_pages(where_filter))
 
     # ── Query ChromaDB ────────────────────────────────────────────
-    try:
-        results = await asyncio.to_thread(
+    def _empty(res: dict) -> bool:
+        return not res.get("documents") or not res["documents"][0]
+
+    async def _query(where: dict) -> dict:
+        return await asyncio.to_thread(
             collection.query,
             query_embeddings=[state["query_embedding"]],
             n_results=8,
-            where=where_filter,
+            where=where,
             include=["documents", "metadatas", "distances"],
         )
 
+    try:
+        results = await _query(_with_pages(where_filter))
+
+        # Fallback: no indexed chunk in those pages (e.g. video, or pages not indexed yet)
+        if _empty(results) and page_range:
+            logger.info("[retriever_node] Nothing in pages %d–%d — searching all pages", *page_range)
+            reasoning_msg += " — nothing indexed there, searched all pages"
+            page_range = None
+            results = await _query(where_filter)
+
         # Fallback: if scoped search yielded 0, expand to all enrolled
-        if (not results.get("documents") or not results["documents"][0]) \
-                and scope.scope_classroom_id and profile.enrolled_classroom_ids:
+        if _empty(results) and scope.scope_classroom_id and profile.enrolled_classroom_ids:
             logger.info("[retriever_node] Scoped search empty — expanding to all classrooms")
-            where_filter = {"classroom_id": {"$in": profile.enrolled_classroom_ids}}
-            results = await asyncio.to_thread(
-                collection.query,
-                query_embeddings=[state["query_embedding"]],
-                n_results=8,
-                where=where_filter,
-                include=["documents", "metadatas", "distances"],
-            )
+            file_names = await content_scope(profile.enrolled_classroom_ids)
+            where_filter = {"file_id": {"$in": list(file_names) or [""]}}
+            results = await _query(where_filter)
     except Exception as e:
         logger.error("[retriever_node] ChromaDB query failed: %s", e)
         return {
@@ -499,9 +573,11 @@ async def retriever_vector_node(state: dict) -> dict:
 
         chunk = RetrievedChunk(
             text=doc,
-            source_file=meta.get("file_name", "Unknown"),
+            # This classroom's name for shared content, not the first uploader's
+            source_file=file_names.get(meta.get("file_id")) or meta.get("file_name", "Unknown"),
             file_type=meta.get("file_type", "unknown"),
             page_number=meta.get("page_number"),
+            page_end=meta.get("page_end"),
             timestamp_start=meta.get("timestamp_start"),
             timestamp_end=meta.get("timestamp_end"),
             subject=meta.get("subject"),
@@ -512,6 +588,7 @@ async def retriever_vector_node(state: dict) -> dict:
             "file_name": chunk.source_file,
             "file_type": chunk.file_type,
             "page_number": chunk.page_number,
+            "page_end": chunk.page_end,
             "timestamp_start": chunk.timestamp_start,
             "timestamp_end": chunk.timestamp_end,
             "relevance_score": score,
@@ -714,7 +791,10 @@ def _build_synthesis_prompt(state: dict) -> str:
             if c.file_type == "video" and c.timestamp_start:
                 cite = f"[{c.source_file} | {c.timestamp_start}-{c.timestamp_end}]"
             elif c.file_type == "pdf" and c.page_number:
-                cite = f"[{c.source_file} | Page {c.page_number}]"
+                if c.page_end and c.page_end > c.page_number:
+                    cite = f"[{c.source_file} | Pages {c.page_number}-{c.page_end}]"
+                else:
+                    cite = f"[{c.source_file} | Page {c.page_number}]"
             else:
                 cite = f"[{c.source_file}]"
             context += f"\nSOURCE {i} {cite}:\n{c.text}\n" + "─" * 50 + "\n"
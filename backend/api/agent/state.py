@@ -7,7 +7,7 @@ Every node reads from and writes to this TypedDict.
 FLOW:
   entry_node        → user_profile, chat_history, classroom_context
   router_node       → router_output
-  embed_node        → query_embedding  (only on RAG/WEB path)
+  embed_node        → query_embedding, vector_collection  (only on RAG/WEB path)
   retriever_node    → retrieved_chunks, used_sources, no_chunks_found
   web_search_node   → web_search_results
   fast_reject_node  → fast_reject_response
@@ -48,7 +48,8 @@ class RetrievedChunk:
     text: str
     source_file: str  # e.g. "ML_Lecture_Unit3.pdf"
     file_type: str    # "pdf", "video", "audio", "image"
-    page_number: Optional[int] = None
+    page_number: Optional[int] = None  # First page of the chunk's span
+    page_end: Optional[int] = None     # Last page of the span (== page_number for one page)
     timestamp_start: Optional[str] = None
     timestamp_end: Optional[str] = None
     subject: Optional[str] = None
@@ -85,6 +86,7 @@ GraphState = dict[str, Any]
 # session_id:           str
 # user_id:              str
 # scope_classroom_id:   Optional[str]   — active classroom for this chat
+# page_range:           Optional[tuple[int, int]] — explicit page filter (else parsed from query)
 #
 # --- entry_node outputs ---
 # user_profile:         UserProfile
@@ -97,6 +99,7 @@ GraphState = dict[str, Any]
 #
 # --- embed_node outputs (only on RAG/WEB path) ---
 # query_embedding:      list[float]
+# vector_collection:    str             — the collection built with the same model
 #
 # --- retriever_node outputs ---
 # retrieved_chunks:     list[RetrievedChunk]
@@ -3,7 +3,6 @@
 from __future__ import annotations
 
 import logging
-import os
 from datetime import datetime, timezone
 from uuid import uuid4
 
@@ -11,7 +10,7 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from pydantic import BaseModel, Field
 
 from api.dependencies import get_current_user
-from database.chroma import get_chroma_collection
+from api.services.content_refs import delete_file_record
 from database.mongo import get_db
 from core.websocket import manager
 
@@ -173,23 +172,8 @@ async def delete_announcement(
         file_meta = await db.file_metadata.find_one({"file_id": file_id})
 
         if file_meta:
-            # 1. Delete physical file
-            storage_path = file_meta.get("storage_path")
-            if storage_path and os.path.exists(storage_path):
-                try:
-                    os.remove(storage_path)
-                except Exception as e:
-                    logger.warning("[delete_announcement] Could not delete file %s: %s", storage_path, e)
-
-            # 2. Delete ChromaDB vectors
-            try:
-                collection = get_chroma_collection()
-                collection.delete(where={"file_id": file_id})
-            except Exception as e:
-                logger.warning("[delete_announcement] Could not delete vectors for %s: %s", file_id, e)
-
-            # 3. Delete file metadata
-            await db.file_metadata.delete_one({"file_id": file_id})
+            # File, vectors and artifacts go only if no other classroom shares the content
+            await delete_file_record(file_meta)
 
     await db.announcements.delete_one({"announcement_id": announcement_id})
     await manager.publish_update(ann["classroom_id"], {"type": "announcement_updated"})
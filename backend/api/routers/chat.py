@@ -44,6 +44,9 @@ class CreateSessionBody(BaseModel):
 class ChatMessageBody(BaseModel):
     query: str = Field(..., min_length=1, max_length=2000)  # Prevent 10MB query blobs
     scope_classroom_id: Optional[str] = None
+    # Restrict retrieval to chunks overlapping these pages ("chapter 3, pages 40–60")
+    page_start: Optional[int] = Field(None, ge=1)
+    page_end: Optional[int] = Field(None, ge=1)
 
 
 class RenameSessionBody(BaseModel):
@@ -65,7 +68,7 @@ async def create_session(
         file_doc = await db.file_metadata.find_one({"file_id": body.file_id})
         if not file_doc:
             raise HTTPException(status.HTTP_404_NOT_FOUND, f"File {body.file_id} not found")
-        if file_doc.get("processing", {}).get("status") != "completed":
+        if file_doc.get("processing", {}).get("status") not in ("completed", "partially_ready"):
             raise HTTPException(status.HTTP_400_BAD_REQUEST, f"File {body.file_id} is not yet processed")
 
     now = datetime.now(timezone.utc)
@@ -164,6 +167,9 @@ async def chat_message(
         raise HTTPException(status.HTTP_403_FORBIDDEN, "You do not own this session")
 
     query = body.query
+    page_range = None
+    if body.page_start or body.page_end:
+        page_range = (body.page_start or body.page_end, body.page_end or body.page_start)
 
     async def event_stream():
         # ── Initial state passed to the graph ──────────────────────
@@ -173,6 +179,7 @@ async def chat_message(
             "user_id": user_id,
             "file_id": session.get("file_id"),
             "scope_classroom_id": body.scope_classroom_id or session.get("classroom_id"),
+            "page_range": page_range,
             # These will be populated by nodes:
             "user_profile": None,
             "classroom_context": None,
@@ -180,6 +187,7 @@ async def chat_message(
             "router_output": None,
             "reasoning": [],
             "query_embedding": None,
+            "vector_collection": None,
             "retrieved_chunks": [],
             "used_sources": [],
             "no_chunks_found": False,
@@ -194,6 +202,7 @@ async def chat_message(
         cache_key_data = (
             f"{initial_state['scope_classroom_id'] or 'global'}"
             f":{session.get('file_id') or 'none'}"
+            f":{'{}-{}'.format(*page_range) if page_range else 'all'}"
             f":{query.strip().lower()}"
         )
         cache_key = f"chat_cache:{hashlib.sha256(cache_key_data.encode()).hexdigest()}"
@@ -1,7 +1,6 @@
 """Classroom router – create, list, join, detail, delete."""
 
 import logging
-import os
 import string
 import secrets
 from datetime import datetime, timezone
@@ -260,29 +259,16 @@ async def delete_classroom(
         raise HTTPException(status_code=403, detail="Only the classroom creator can delete it")
 
     # ── Cascade 1: Files (disk + ChromaDB vectors + MongoDB metadata) ──
+    # Content shared with other classrooms stays until its last record goes
     try:
-        from database.chroma import get_chroma_collection
-        collection = get_chroma_collection()
+        from api.services.content_refs import delete_file_record
 
         files_cursor = db.file_metadata.find({"classroom_id": classroom_id})
         files = await files_cursor.to_list(length=1000)
 
         for f in files:
-            # Delete physical file from disk
-            storage_path = f.get("storage_path")
-            if storage_path and os.path.exists(storage_path):
-                try:
-                    os.remove(storage_path)
-                except Exception as e:
-                    logger.warning("[delete_classroom] Could not delete file %s: %s", storage_path, e)
-
-            # Delete ChromaDB vectors for this file
-            try:
-                collection.delete(where={"file_id": f["file_id"]})
-            except Exception as e:
-                logger.warning("[delete_classroom] Could not delete Chroma vectors for %s: %s", f["file_id"], e)
-
-        await db.file_metadata.delete_many({"classroom_id": classroom_id})
+            await delete_file_record(f)
+
         logger.info("[delete_classroom] Deleted %d files for classroom %s", len(files), classroom_id)
     except Exception as e:
         logger.error("[delete_classroom] File cascade error: %s", e)
@@ -1,13 +1,26 @@
-"""Superadmin router – provision teachers, list users."""
+"""Superadmin router – provision teachers, list users, ingestion stats."""
 
 from uuid import uuid4
 
 from fastapi import APIRouter, Depends, HTTPException, Query, status
 
 from api.dependencies import require_role
+from api.services import corpus_migration
+from api.services.corpus_migration import MigrationConflict, MigrationNotFound
+from api.services.ingestion_estimate import budget_status
+from api.services.ingestion_queue import queue_stats
+from api.services.leases import list_in_flight, sweep_expired_leases
+from core.embedding_cache import embedding_cache
 from core.security import hash_password
+from database.chroma import active_index, building_index
 from database.mongo import get_db
-from models.schemas import ProvisionTeacherBody, RoleEnum, UserResponse
+from models.schemas import (
+    CorpusMigrationBody,
+    IngestionBudgetBody,
+    ProvisionTeacherBody,
+    RoleEnum,
+    UserResponse,
+)
 
 router = APIRouter(prefix="/api/superadmin", tags=["Superadmin"])
 
@@ -92,3 +105,143 @@ async def delete_user(
 
     await db.users.delete_one({"user_id": user_id})
     return {"message": "User deleted", "user_id": user_id}
+
+
+# ── GET /api/superadmin/embedding-cache ─────────────────────────────
+
+@router.get("/embedding-cache", status_code=status.HTTP_200_OK)
+async def embedding_cache_stats(
+    current_user: dict = Depends(require_role("superadmin")),
+):
+    """Embedding cache size and hit rate (hits = Gemini embeddings saved). Superadmin only."""
+    try:
+        return await embedding_cache.stats()
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Embedding cache unavailable: {e}")
+
+
+# ── GET /api/superadmin/ingestion/jobs ──────────────────────────────
+
+@router.get("/ingestion/jobs", status_code=status.HTTP_200_OK)
+async def list_ingestion_jobs(
+    current_user: dict = Depends(require_role("superadmin")),
+):
+    """In-flight ingestion jobs with stage, elapsed time and lease heartbeats. Superadmin only."""
+    jobs = await list_in_flight()
+    return {"jobs": jobs, "total": len(jobs), "stalled": sum(j["stalled"] for j in jobs)}
+
+
+# ── POST /api/superadmin/ingestion/sweep ────────────────────────────
+
+@router.post("/ingestion/sweep", status_code=status.HTTP_200_OK)
+async def sweep_ingestion_jobs(
+    current_user: dict = Depends(require_role("superadmin")),
+):
+    """Requeue or fail jobs whose worker lease expired now, without waiting for the sweeper."""
+    return await sweep_expired_leases()
+
+
+# ── GET /api/superadmin/ingestion/queues ────────────────────────────
+
+@router.get("/ingestion/queues", status_code=status.HTTP_200_OK)
+async def get_ingestion_queues(
+    current_user: dict = Depends(require_role("superadmin")),
+):
+    """Waiting files per priority and classroom, their queue wait times, and Celery queue depths."""
+    return await queue_stats()
+
+
+# ── PUT /api/superadmin/ingestion/budgets/{classroom_id} ────────────
+
+@router.put("/ingestion/budgets/{classroom_id}", status_code=status.HTTP_200_OK)
+async def set_ingestion_budget(
+    classroom_id: str,
+    body: IngestionBudgetBody,
+    current_user: dict = Depends(require_role("superadmin")),
+):
+    """Override a classroom's daily ingestion budget; an empty body restores the defaults."""
+    override = body.model_dump(exclude_none=True)
+    update = {"$set": {"ingestion_budget": override}} if override else {"$unset": {"ingestion_budget": ""}}
+    result = await get_db().classrooms.update_one({"classroom_id": classroom_id}, update)
+    if not result.matched_count:
+        raise HTTPException(status_code=404, detail="Classroom not found")
+    return await budget_status(classroom_id)
+
+
+# ── Corpus migrations (api/services/corpus_migration.py) ────────────
+
+async def _migration_call(action, *args, **kwargs) -> dict:
+    try:
+        return await action(*args, **kwargs)
+    except MigrationNotFound:
+        raise HTTPException(status_code=404, detail="Migration not found")
+    except MigrationConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@router.get("/ingestion/migrations", status_code=status.HTTP_200_OK)
+async def list_corpus_migrations(
+    current_user: dict = Depends(require_role("superadmin")),
+):
+    """The index version serving queries, the one being built, and recent migrations."""
+    return {
+        "active": active_index(),
+        "building": building_index(),
+        "migrations": await corpus_migration.list_migrations(),
+    }
+
+
+@router.post("/ingestion/migrations", status_code=status.HTTP_202_ACCEPTED)
+async def start_corpus_migration(
+    body: CorpusMigrationBody,
+    current_user: dict = Depends(require_role("superadmin")),
+):
+    """Re-chunk / re-embed every file into a new collection; queries switch over when it is complete."""
+    return await _migration_call(
+        corpus_migration.start_migration,
+        embed_model=body.embed_model, chunk_tokens=body.chunk_tokens, started_by=current_user["user_id"],
+    )
+
+
+@router.get("/ingestion/migrations/{migration_id}", status_code=status.HTTP_200_OK)
+async def get_corpus_migration(
+    migration_id: str,
+    current_user: dict = Depends(require_role("superadmin")),
+):
+    """Progress, throughput and time-to-switch estimate of one migration."""
+    return await _migration_call(corpus_migration.get_migration, migration_id)
+
+
+@router.post("/ingestion/migrations/{migration_id}/pause", status_code=status.HTTP_200_OK)
+async def pause_corpus_migration(
+    migration_id: str,
+    current_user: dict = Depends(require_role("superadmin")),
+):
+    return await _migration_call(corpus_migration.pause_migration, migration_id)
+
+
+@router.post("/ingestion/migrations/{migration_id}/resume", status_code=status.HTTP_200_OK)
+async def resume_corpus_migration(
+    migration_id: str,
+    current_user: dict = Depends(require_role("superadmin")),
+):
+    """Continue a paused or failed migration from where it stopped."""
+    return await _migration_call(corpus_migration.resume_migration, migration_id)
+
+
+@router.post("/ingestion/migrations/{migration_id}/cancel", status_code=status.HTTP_200_OK)
+async def cancel_corpus_migration(
+    migration_id: str,
+    current_user: dict = Depends(require_role("superadmin")),
+):
+    """Abandon a migration that has not switched yet and drop its collection."""
+    return await _migration_call(corpus_migration.cancel_migration, migration_id)
+
+
+@router.delete("/ingestion/migrations/{migration_id}/source", status_code=status.HTTP_200_OK)
+async def drop_corpus_migration_source(
+    migration_id: str,
+    current_user: dict = Depends(require_role("superadmin")),
+):
+    """Delete the collection a completed migration replaced."""
+    return await _migration_call(corpus_migration.drop_source, migration_id)
@@ -1,10 +1,25 @@
-"""Upload router – multi-modal file upload with streaming SHA-256 dedup."""
-
+"""
+Upload router – multi-modal file upload with streaming SHA-256 dedup.
+
+Every new file is estimated (pages, chunks, Gemini calls, wall time, queue ETA)
+and booked against its classroom's daily ingestion budget before it is stored
+or queued — 429 when it does not fit (services/ingestion_estimate.py).
+POST /api/upload/estimate does the same as a dry run.
+
+Large files use hash-first, resumable uploads:
+  POST /api/upload/init                 sha256 + size → exists / retriggered / shared / upload_id
+  PUT  /api/upload/{upload_id}?offset=  append one chunk (raw body); resend after a drop
+  GET  /api/upload/{upload_id}          bytes received so far (where to resume)
+  POST /api/upload/{upload_id}/complete verify the hash, store, queue ingestion
+"""
+
+import asyncio
 import hashlib
+import json
 import logging
 import os
 import shutil
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from uuid import uuid4
 
@@ -16,12 +31,29 @@ from fastapi import (
     Form,
     HTTPException,
     Query,
+    Request,
     UploadFile,
     status,
 )
-from fastapi.responses import FileResponse
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 
 from api.dependencies import get_current_user, require_classroom_member
+from api.services.content_refs import content_id_of, find_owner, new_reference
+from api.services.ingestion_estimate import (
+    BudgetExceeded,
+    budget_status,
+    charge,
+    estimate_ingestion,
+    queue_wait,
+    refund,
+    require_budget_left,
+)
+from api.services.ingestion_queue import enqueue, enqueue_many
+from api.services.leases import has_expired_lease
 from database.mongo import get_db
 
 router = APIRouter(prefix="/api/upload", tags=["Upload"])
@@ -43,9 +75,18 @@ STUDENT_ALLOWED = PDF_MIMES + IMAGE_MIMES
 
 CHUNK_SIZE = 8192
 MAX_FILE_SIZE = 15 * 1024 * 1024  # 15 MB hard limit
+MAX_BATCH_FILES = 50              # Files per POST /api/upload/files request
+
+# Resumable uploads: the size limit only bounds disk use, not request size
+MAX_RESUMABLE_FILE_SIZE = int(os.getenv("MAX_RESUMABLE_UPLOAD_MB", "500")) * 1024 * 1024
+UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024      # Largest body accepted per chunk PUT
+UPLOAD_SESSION_TTL = timedelta(hours=24)  # Unfinished uploads are purged after this
+UPLOAD_CHUNK_LOCK = timedelta(minutes=2)  # A chunk writer that vanished frees the session after this
 
 _STATIC_DIRS = {"pdf": "pdfs", "image": "images", "video": "videos"}
 
+_batch_tasks: set[asyncio.Task] = set()   # Strong refs: batches outlive a disconnected client
+
 
 def _mime_to_file_type(mime: str) -> str:
     if mime in PDF_MIMES:
@@ -62,45 +103,12 @@ def _build_playback_url(file_doc: dict) -> str:
     folder = _STATIC_DIRS.get(ft, "pdfs")
     original = file_doc.get("original_name", "file.bin")
     ext = Path(original).suffix or ".bin"
-    return f"/static/{folder}/{file_doc['file_id']}{ext}"
-
+    return f"/static/{folder}/{content_id_of(file_doc)}{ext}"  # Shared files point at one blob
 
-# ── POST /api/upload/file ────────────────────────────────────────────
 
-@router.post("/file", status_code=status.HTTP_202_ACCEPTED)
-async def upload_file(
-    file: UploadFile = File(...),
-    classroom_id: str = Form(..., min_length=1),
-    doc_type: str = Form(None),
-    current_user: dict = Depends(get_current_user),
-):
-    role = current_user.get("role")
-    mime = file.content_type or ""
-
-    # ① Permission gate — only teachers and superadmins can upload
-    if role not in ("teacher", "superadmin"):
-        raise HTTPException(status_code=403, detail="Only teachers can upload files")
-
-    if mime not in ALL_ALLOWED:
-        raise HTTPException(status_code=415, detail="Unsupported file type")
-
-    # ② Validate classroom membership
-    db = get_db()
-    classroom = await db.classrooms.find_one({"classroom_id": classroom_id})
-    if not classroom:
-        raise HTTPException(status_code=404, detail="Classroom not found")
-
-    member_ids = [m["user_id"] for m in classroom.get("members", [])]
-    if role != "superadmin" and current_user["user_id"] not in member_ids:
-        raise HTTPException(status_code=403, detail="You must be a member of this classroom to upload")
-
-    # ③ Determine file type + extension
-    file_type = _mime_to_file_type(mime)
-    ext = Path(file.filename or "file").suffix or ".bin"
-
-    # ④ SHA-256 streaming hash + save to temp
-    temp_name = f"{uuid4().hex}{ext}"
-    temp_path = TEMP_DIR / temp_name
+async def _stage_upload(file: UploadFile, ext: str) -> tuple[Path, str, int]:
+    """Stream an upload to TEMP_DIR, hashing as it goes. Returns (temp_path, sha256, size)."""
+    temp_path = TEMP_DIR / f"{uuid4().hex}{ext}"
     hasher = hashlib.sha256()
     file_size = 0
 
@@ -116,61 +124,105 @@ async def upload_file(
                 if file_size > MAX_FILE_SIZE:
                     raise HTTPException(
                         status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-                        detail=f"File too large. Maximum is {MAX_FILE_SIZE // (1024*1024)} MB.",
+                        detail=f"File too large. Maximum is {MAX_FILE_SIZE // (1024*1024)} MB "
+                               f"per request — use /api/upload/init for larger files.",
                     )
     except HTTPException:
         # Clean up partial temp file then re-raise
-        if temp_path.exists():
-            temp_path.unlink()
+        temp_path.unlink(missing_ok=True)
         raise
 
-    sha256_hash = hasher.hexdigest()
+    return temp_path, hasher.hexdigest(), file_size
 
-    # ⑤ Dedup check
-    existing = await db.file_metadata.find_one({"sha256_hash": sha256_hash})
-    if existing:
-        temp_path.unlink(missing_ok=True)
-        status_str = existing.get("processing", {}).get("status", "unknown")
-
-        # Re-trigger ingestion if previously failed
-        if status_str == "failed":
-            logger.info("[upload] Re-triggering failed ingestion for: %s", existing["file_id"])
-            from api.services.ingestion import process_file_task
-            await db.file_metadata.update_one(
-                {"file_id": existing["file_id"]},
-                {"$set": {"processing.status": "pending", "processing.error": None}},
-            )
-            process_file_task.delay(existing["file_id"])
-            return {
-                "file_id": existing["file_id"],
-                "message": "File already exists but ingestion had failed. Re-triggering now.",
-                "status": "pending",
-            }
 
+def _needs_retrigger(processing: dict) -> bool:
+    """Failed (possibly after indexing part of the file) or its worker died (expired lease)."""
+    return (
+        processing.get("status") == "failed"
+        or (processing.get("status") == "partially_ready" and processing.get("error"))
+        or has_expired_lease(processing)
+    )
+
+
+async def _retrigger(owner_ids: list[str], classroom_id: str, priority: str) -> None:
+    """Re-queue failed content; the records sharing it show pending again too."""
+    logger.info("[upload] Re-triggering failed ingestion for: %s", owner_ids)
+    await get_db().file_metadata.update_many(
+        {"$or": [{"file_id": {"$in": owner_ids}}, {"content_id": {"$in": owner_ids}}]},
+        {"$set": {"processing.status": "pending", "processing.error": None}},
+    )
+    await enqueue_many(owner_ids, classroom_id, priority)
+
+
+async def _load_owner(doc: dict) -> dict:
+    """The record whose ingestion state backs `doc` (itself unless it is a shared reference)."""
+    content_id = content_id_of(doc)
+    if content_id == doc["file_id"]:
+        return doc
+    return await get_db().file_metadata.find_one({"file_id": content_id}) or doc
+
+
+async def _existing_file_response(existing: dict, bulk: bool) -> dict:
+    """Response for a file this classroom already has; re-triggers failed ingestion."""
+    owner = await _load_owner(existing)
+
+    # Re-trigger ingestion if previously failed or its worker died
+    if _needs_retrigger(owner.get("processing", {})):
+        await _retrigger([owner["file_id"]], existing["classroom_id"], "bulk" if bulk else "interactive")
         return {
+            "result": "retriggered",
             "file_id": existing["file_id"],
-            "message": "File already exists",
-            "status": status_str,
+            "message": "File already exists but ingestion had failed. Re-triggering now.",
+            "status": "pending",
         }
 
-    # ⑥ Move to permanent storage
-    file_id = f"file_{uuid4().hex}"
-    permanent_dir = UPLOAD_DIR / f"{file_type}s"
-    permanent_dir.mkdir(parents=True, exist_ok=True)
-    permanent_path = permanent_dir / f"{file_id}{ext}"
+    return {
+        "result": "exists",
+        "file_id": existing["file_id"],
+        "message": "File already exists",
+        "status": existing.get("processing", {}).get("status", "unknown"),
+    }
 
+
+async def _share_existing(
+    owner: dict, classroom_id: str, original_name: str, doc_type: str | None, user_id: str, bulk: bool,
+) -> dict:
+    """Add this classroom's record for content another classroom uploaded — nothing is re-processed."""
+    db = get_db()
+    doc = new_reference(owner, f"file_{uuid4().hex}", classroom_id, original_name, doc_type, user_id)
     try:
-        shutil.move(str(temp_path), str(permanent_path))
-    except Exception as e:
-        temp_path.unlink(missing_ok=True)
-        raise HTTPException(status_code=500, detail=f"Failed to save file: {e}")
+        await db.file_metadata.insert_one(doc)
+    except DuplicateKeyError:
+        # A concurrent request just added the same file to this classroom
+        existing = await db.file_metadata.find_one(
+            {"sha256_hash": owner["sha256_hash"], "classroom_id": classroom_id},
+        )
+        return await _existing_file_response(existing, bulk)
+
+    status_str = doc["processing"]["status"]
+    if _needs_retrigger(owner.get("processing", {})):
+        await _retrigger([owner["file_id"]], classroom_id, "bulk" if bulk else "interactive")
+        status_str = "pending"
+    logger.info("[upload] %s shares content of %s", doc["file_id"], owner["file_id"])
+    return {
+        "result": "shared",
+        "file_id": doc["file_id"],
+        "original_name": original_name,
+        "file_type": doc["file_type"],
+        "status": status_str,
+        "message": "Already uploaded to another classroom — shared without re-processing.",
+    }
 
-    # ⑦ Save metadata to MongoDB (using timezone-aware datetime)
-    now = datetime.now(timezone.utc)
-    doc = {
+
+def _new_file_doc(
+    file_id: str, original_name: str, storage_path: Path, mime: str, file_type: str,
+    file_size: int, sha256_hash: str, classroom_id: str, doc_type: str | None, user_id: str,
+    estimate: dict | None = None,
+) -> dict:
+    return {
         "file_id": file_id,
-        "original_name": file.filename,
-        "storage_path": str(permanent_path),
+        "original_name": original_name,
+        "storage_path": str(storage_path),
         "mime_type": mime,
         "file_type": file_type,
         "file_size_bytes": file_size,
@@ -183,22 +235,128 @@ async def upload_file(
             "chunk_count": 0,
             "page_count": None,
             "error": None,
+            "estimate": estimate,
         },
-        "uploaded_by": current_user["user_id"],
-        "uploaded_at": now,  # ← timezone-aware (was naive datetime.utcnow())
+        "uploaded_by": user_id,
+        "uploaded_at": datetime.now(timezone.utc),
     }
 
+
+def _store_permanent(temp_path: Path, file_type: str, file_id: str, ext: str) -> Path:
+    """Move a staged upload into UPLOAD_DIR; the temp file is removed either way."""
+    permanent_dir = UPLOAD_DIR / f"{file_type}s"
+    permanent_dir.mkdir(parents=True, exist_ok=True)
+    permanent_path = permanent_dir / f"{file_id}{ext}"
+    try:
+        shutil.move(str(temp_path), str(permanent_path))
+    except Exception:
+        temp_path.unlink(missing_ok=True)
+        raise
+    return permanent_path
+
+
+async def _preflight(
+    path: Path | str, file_type: str, size: int, classroom_id: str, priority: str,
+    processing: dict | None = None,
+) -> dict:
+    """Estimate ingesting a file and book it against the classroom's daily budget (429 if over)."""
+    estimate = await estimate_ingestion(str(path), file_type, size, priority, processing)
+    try:
+        await charge(classroom_id, estimate)
+    except BudgetExceeded as e:
+        logger.info("[upload] Budget exceeded for classroom=%s: %s", classroom_id, e.detail["budget"]["used"])
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=jsonable_encoder(e.detail))
+    return estimate
+
+
+def _estimate_view(estimate: dict) -> dict:
+    return {k: v for k, v in estimate.items() if k != "estimated_at"}
+
+
+async def _check_upload_access(classroom_id: str, current_user: dict) -> None:
+    if current_user.get("role") not in ("teacher", "superadmin"):
+        raise HTTPException(status_code=403, detail="Only teachers can upload files")
+
+    classroom = await get_db().classrooms.find_one({"classroom_id": classroom_id})
+    if not classroom:
+        raise HTTPException(status_code=404, detail="Classroom not found")
+
+    member_ids = [m["user_id"] for m in classroom.get("members", [])]
+    if current_user["role"] != "superadmin" and current_user["user_id"] not in member_ids:
+        raise HTTPException(status_code=403, detail="You must be a member of this classroom to upload")
+
+
+# ── POST /api/upload/file ────────────────────────────────────────────
+
+@router.post("/file", status_code=status.HTTP_202_ACCEPTED)
+async def upload_file(
+    file: UploadFile = File(...),
+    classroom_id: str = Form(..., min_length=1),
+    doc_type: str = Form(None),
+    bulk: bool = Form(False),           # Backfill upload: queued behind interactive files
+    current_user: dict = Depends(get_current_user),
+):
+    mime = file.content_type or ""
+
+    # ①② Permission gate (teachers and superadmins) + classroom membership
+    await _check_upload_access(classroom_id, current_user)
+
+    if mime not in ALL_ALLOWED:
+        raise HTTPException(status_code=415, detail="Unsupported file type")
+    db = get_db()
+
+    # ③ Determine file type + extension
+    file_type = _mime_to_file_type(mime)
+    ext = Path(file.filename or "file").suffix or ".bin"
+
+    # ④ SHA-256 streaming hash + save to temp
+    temp_path, sha256_hash, file_size = await _stage_upload(file, ext)
+
+    # ⑤ Dedup — this classroom's copy, else content another classroom already uploaded
+    existing = await db.file_metadata.find_one({"sha256_hash": sha256_hash, "classroom_id": classroom_id})
+    if existing:
+        temp_path.unlink(missing_ok=True)
+        return await _existing_file_response(existing, bulk)
+    owner = await find_owner(sha256_hash)
+    if owner:
+        temp_path.unlink(missing_ok=True)
+        return await _share_existing(
+            owner, classroom_id, file.filename, doc_type, current_user["user_id"], bulk,
+        )
+
+    # ⑥ Estimate + book against the classroom's daily ingestion budget
+    priority = "bulk" if bulk else "interactive"
+    try:
+        estimate = await _preflight(temp_path, file_type, file_size, classroom_id, priority)
+    except HTTPException:
+        temp_path.unlink(missing_ok=True)
+        raise
+
+    # ⑦ Move to permanent storage
+    file_id = f"file_{uuid4().hex}"
+    try:
+        permanent_path = _store_permanent(temp_path, file_type, file_id, ext)
+    except Exception as e:
+        await refund(classroom_id, estimate)
+        raise HTTPException(status_code=500, detail=f"Failed to save file: {e}")
+
+    # ⑧ Save metadata to MongoDB (using timezone-aware datetime)
+    doc = _new_file_doc(
+        file_id, file.filename, permanent_path, mime, file_type, file_size, sha256_hash,
+        classroom_id, doc_type, current_user["user_id"], estimate,
+    )
+
     try:
         await db.file_metadata.insert_one(doc)
     except Exception as e:
         # Rollback: remove the physical file if metadata write fails
         if permanent_path.exists():
             permanent_path.unlink()
+        await refund(classroom_id, estimate)
         raise HTTPException(status_code=500, detail=f"Failed to save file metadata: {e}")
 
-    # ⑧ Trigger background ingestion
-    from api.services.ingestion import process_file_task
-    process_file_task.delay(file_id)
+    # ⑨ Queue background ingestion (priority + per-classroom fair share)
+    await enqueue(file_id, classroom_id, priority=priority)
 
     return {
         "file_id": file_id,
@@ -206,9 +364,536 @@ async def upload_file(
         "file_type": file_type,
         "status": "pending",
         "message": "Uploaded. Processing in background.",
+        "estimate": _estimate_view(estimate),
+    }
+
+
+# ── POST /api/upload/files ───────────────────────────────────────────
+
+@router.post("/files", status_code=status.HTTP_202_ACCEPTED)
+async def upload_files(
+    files: list[UploadFile] = File(...),
+    classroom_id: str = Form(..., min_length=1),
+    doc_type: str = Form(None),
+    bulk: bool = Form(True),            # Batches are backfills unless the caller says otherwise
+    current_user: dict = Depends(get_current_user),
+):
+    """
+    Upload many files in one request.
+
+    All hashes are deduped with one $in query, new metadata is written with one
+    insert_many and ingestion is queued as one batch. The response is an SSE
+    stream: one `file` event per file as its outcome is known, then `done`.
+    """
+    await _check_upload_access(classroom_id, current_user)
+    if len(files) > MAX_BATCH_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_FILES} files per batch")
+
+    # Stage every file now — the request's upload spools close once we return
+    staged, rejected = [], []
+    for index, file in enumerate(files):
+        mime = file.content_type or ""
+        result = {"index": index, "original_name": file.filename}
+        if mime not in ALL_ALLOWED:
+            rejected.append({**result, "status": "rejected", "message": "Unsupported file type"})
+            continue
+        ext = Path(file.filename or "file").suffix or ".bin"
+        try:
+            temp_path, sha256_hash, file_size = await _stage_upload(file, ext)
+        except HTTPException as e:
+            rejected.append({**result, "status": "rejected", "message": e.detail})
+            continue
+        staged.append({
+            **result, "mime": mime, "ext": ext,
+            "temp_path": temp_path, "sha256": sha256_hash, "size": file_size,
+        })
+
+    # The batch runs as its own task so a client disconnect can't stop it halfway
+    events: asyncio.Queue = asyncio.Queue()
+    batch = asyncio.create_task(_ingest_batch(
+        staged, rejected, classroom_id, doc_type, current_user["user_id"],
+        "bulk" if bulk else "interactive", events.put_nowait,
+    ))
+    _batch_tasks.add(batch)
+    batch.add_done_callback(_batch_tasks.discard)
+
+    async def event_stream():
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            yield f"data: {json.dumps(event, default=str)}\n\n"
+        await batch
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+
+async def _ingest_batch(
+    staged: list[dict], rejected: list[dict], classroom_id: str, doc_type: str | None,
+    user_id: str, priority: str, emit,
+) -> None:
+    """Dedup, store and queue a staged batch, emitting {"t", "d"} events (None ends the stream)."""
+    db = get_db()
+    counts = {
+        "uploaded": 0, "shared": 0, "duplicate": 0, "retriggered": 0, "rejected": len(rejected), "error": 0,
+    }
+
+    def _file_event(result: dict) -> None:
+        emit({"t": "file", "d": result})
+
+    try:
+        for result in rejected:
+            _file_event(result)
+
+        # ⑤ Dedup — one query for the whole batch, across classrooms
+        hashes = list({item["sha256"] for item in staged})
+        here, owners = {}, {}
+        async for doc in db.file_metadata.find({"sha256_hash": {"$in": hashes}}, {"_id": 0}):
+            if doc["classroom_id"] == classroom_id:
+                here[doc["sha256_hash"]] = doc
+            if content_id_of(doc) == doc["file_id"]:
+                owners[doc["sha256_hash"]] = doc
+
+        new_docs, new_items, batch_seen = [], [], {}
+        retrigger: list[str] = []                 # Owner file_ids whose ingestion failed
+        for item in staged:
+            result = {"index": item["index"], "original_name": item["original_name"]}
+            dup = here.get(item["sha256"])
+            owner = owners.get(item["sha256"])
+            if dup or item["sha256"] in batch_seen:
+                item["temp_path"].unlink(missing_ok=True)
+                if not dup:
+                    _file_event({**result, "file_id": batch_seen[item["sha256"]], "status": "pending",
+                                 "message": "Duplicate of another file in this batch"})
+                    counts["duplicate"] += 1
+                elif _needs_retrigger((owner or dup).get("processing", {})):
+                    if content_id_of(dup) not in retrigger:
+                        retrigger.append(content_id_of(dup))
+                    _file_event({**result, "file_id": dup["file_id"], "status": "pending",
+                                 "message": "File already exists but ingestion had failed. Re-triggering now."})
+                    counts["retriggered"] += 1
+                else:
+                    _file_event({**result, "file_id": dup["file_id"],
+                                 "status": dup.get("processing", {}).get("status", "unknown"),
+                                 "message": "File already exists"})
+                    counts["duplicate"] += 1
+                continue
+
+            if owner:
+                # Another classroom uploaded this content: nothing to store or ingest
+                item["temp_path"].unlink(missing_ok=True)
+                doc = new_reference(
+                    owner, f"file_{uuid4().hex}", classroom_id, item["original_name"], doc_type, user_id,
+                )
+                if _needs_retrigger(owner.get("processing", {})) and owner["file_id"] not in retrigger:
+                    retrigger.append(owner["file_id"])
+            else:
+                # ⑥ Estimate + book against the daily budget — files that do not fit are rejected
+                file_type = _mime_to_file_type(item["mime"])
+                try:
+                    estimate = await _preflight(item["temp_path"], file_type, item["size"], classroom_id, priority)
+                except HTTPException as e:
+                    item["temp_path"].unlink(missing_ok=True)
+                    _file_event({**result, "status": "rejected", "message": e.detail["message"]})
+                    counts["rejected"] += 1
+                    continue
+
+                # ⑦ Move to permanent storage
+                file_id = f"file_{uuid4().hex}"
+                try:
+                    permanent_path = _store_permanent(item["temp_path"], file_type, file_id, item["ext"])
+                except Exception as e:
+                    await refund(classroom_id, estimate)
+                    _file_event({**result, "status": "error", "message": f"Failed to save file: {e}"})
+                    counts["error"] += 1
+                    continue
+                doc = _new_file_doc(
+                    file_id, item["original_name"], permanent_path, item["mime"], file_type,
+                    item["size"], item["sha256"], classroom_id, doc_type, user_id, estimate,
+                )
+            batch_seen[item["sha256"]] = doc["file_id"]
+            new_docs.append(doc)
+            new_items.append(result)
+
+        # ⑧ Save metadata — one insert_many; failed rows lose their stored file and their charge
+        failed: dict[int, str] = {}
+        if new_docs:
+            try:
+                await db.file_metadata.insert_many(new_docs, ordered=False)
+            except BulkWriteError as e:
+                failed = {err["index"]: err.get("errmsg", "write failed") for err in e.details["writeErrors"]}
+            except Exception as e:
+                failed = {n: str(e) for n in range(len(new_docs))}
+
+        uploaded = []
+        for n, (doc, result) in enumerate(zip(new_docs, new_items)):
+            shared = "content_id" in doc
+            if n in failed:
+                if not shared:
+                    Path(doc["storage_path"]).unlink(missing_ok=True)
+                    await refund(classroom_id, doc["processing"]["estimate"])
+                _file_event({**result, "status": "error",
+                             "message": f"Failed to save file metadata: {failed[n]}"})
+                counts["error"] += 1
+            elif shared:
+                _file_event({**result, "file_id": doc["file_id"], "file_type": doc["file_type"],
+                             "status": "pending" if doc["content_id"] in retrigger else doc["processing"]["status"],
+                             "message": "Already uploaded to another classroom — shared without re-processing."})
+                counts["shared"] += 1
+            else:
+                uploaded.append(doc["file_id"])
+                _file_event({**result, "file_id": doc["file_id"], "file_type": doc["file_type"],
+                             "status": "pending", "message": "Uploaded. Processing in background.",
+                             "estimate": _estimate_view(doc["processing"]["estimate"])})
+                counts["uploaded"] += 1
+
+        # ⑨ Queue ingestion as one batch
+        await enqueue_many(uploaded, classroom_id, priority)
+        if retrigger:
+            await _retrigger(retrigger, classroom_id, priority)
+
+        logger.info("[upload] Batch of %d for classroom=%s: %s",
+                    len(staged) + len(rejected), classroom_id, counts)
+        emit({"t": "done", "d": counts})
+    except Exception as exc:
+        logger.exception("[upload] Batch upload failed: %s", exc)
+        for item in staged:
+            item["temp_path"].unlink(missing_ok=True)
+        emit({"t": "error", "d": f"Batch upload failed: {str(exc)[:200]}"})
+    finally:
+        emit(None)
+
+
+# ── POST /api/upload/estimate ────────────────────────────────────────
+
+@router.post("/estimate")
+async def estimate_upload(
+    file: UploadFile = File(...),
+    classroom_id: str = Form(..., min_length=1),
+    bulk: bool = Form(False),
+    current_user: dict = Depends(get_current_user),
+):
+    """
+    Dry run of the pre-flight check: what ingesting this file would cost, when
+    it would be ready, and whether it fits today's budget. Nothing is stored or charged.
+    """
+    await _check_upload_access(classroom_id, current_user)
+    mime = file.content_type or ""
+    if mime not in ALL_ALLOWED:
+        raise HTTPException(status_code=415, detail="Unsupported file type")
+
+    ext = Path(file.filename or "file").suffix or ".bin"
+    temp_path, _, file_size = await _stage_upload(file, ext)
+    try:
+        estimate = await estimate_ingestion(
+            str(temp_path), _mime_to_file_type(mime), file_size, "bulk" if bulk else "interactive",
+        )
+    finally:
+        temp_path.unlink(missing_ok=True)
+
+    budget = await budget_status(classroom_id)
+    fits = all(left is None or estimate[f] <= left for f, left in budget["remaining"].items())
+    return {"estimate": _estimate_view(estimate), "budget": budget, "fits_budget": fits}
+
+
+# ── GET /api/upload/budget ───────────────────────────────────────────
+
+@router.get("/budget")
+async def get_upload_budget(
+    classroom_id: str = Query(..., min_length=1),
+    current_user: dict = Depends(get_current_user),
+):
+    """Today's ingestion budget for a classroom: limits, booked usage, what is left."""
+    await _check_upload_access(classroom_id, current_user)
+    return await budget_status(classroom_id)
+
+
+# ── POST /api/upload/init ────────────────────────────────────────────
+
+class UploadInitBody(BaseModel):
+    classroom_id: str = Field(..., min_length=1)
+    sha256: str = Field(..., pattern=r"^[0-9a-f]{64}$")
+    size: int = Field(..., gt=0)
+    filename: str = Field(..., min_length=1, max_length=255)
+    mime_type: str
+    doc_type: str | None = None
+    bulk: bool = False
+
+
+@router.post("/init")
+async def init_upload(
+    body: UploadInitBody,
+    current_user: dict = Depends(get_current_user),
+):
+    """
+    Hash-first negotiation. A file the server already has costs this one round
+    trip (result "exists", "retriggered", or "shared" when another classroom
+    uploaded it); otherwise result "upload" returns an upload_id — the same one
+    again for an unfinished upload of this file.
+    """
+    await _check_upload_access(body.classroom_id, current_user)
+    if body.mime_type not in ALL_ALLOWED:
+        raise HTTPException(status_code=415, detail="Unsupported file type")
+    if body.size > MAX_RESUMABLE_FILE_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"File too large. Maximum is {MAX_RESUMABLE_FILE_SIZE // (1024*1024)} MB.",
+        )
+
+    db = get_db()
+    existing = await db.file_metadata.find_one({"sha256_hash": body.sha256, "classroom_id": body.classroom_id})
+    if existing:
+        return await _existing_file_response(existing, body.bulk)
+    owner = await find_owner(body.sha256)
+    if owner:
+        return await _share_existing(
+            owner, body.classroom_id, body.filename, body.doc_type, current_user["user_id"], body.bulk,
+        )
+
+    # Don't let a large upload start when the classroom's budget is already spent
+    try:
+        await require_budget_left(body.classroom_id)
+    except BudgetExceeded as e:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=jsonable_encoder(e.detail))
+
+    await _purge_expired_uploads()
+    now = datetime.now(timezone.utc)
+    session = await db.upload_sessions.find_one_and_update(
+        {
+            "sha256": body.sha256,
+            "size": body.size,
+            "classroom_id": body.classroom_id,
+            "uploaded_by": current_user["user_id"],
+        },
+        {"$set": {"expires_at": now + UPLOAD_SESSION_TTL}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if not session:
+        upload_id = f"upl_{uuid4().hex}"
+        temp_path = TEMP_DIR / f"{upload_id}.part"
+        TEMP_DIR.mkdir(parents=True, exist_ok=True)
+        temp_path.touch()
+        session = {
+            "upload_id": upload_id,
+            "sha256": body.sha256,
+            "size": body.size,
+            "received": 0,
+            "original_name": body.filename,
+            "mime_type": body.mime_type,
+            "classroom_id": body.classroom_id,
+            "doc_type": body.doc_type,
+            "priority": "bulk" if body.bulk else "interactive",
+            "temp_path": str(temp_path),
+            "uploaded_by": current_user["user_id"],
+            "locked_until": now,
+            "created_at": now,
+            "expires_at": now + UPLOAD_SESSION_TTL,
+        }
+        await db.upload_sessions.insert_one(session)
+
+    return {"result": "upload", **_session_view(session)}
+
+
+def _session_view(session: dict) -> dict:
+    return {
+        "upload_id": session["upload_id"],
+        "received": session["received"],
+        "size": session["size"],
+        "chunk_size": UPLOAD_CHUNK_BYTES,
+        "expires_at": session["expires_at"].isoformat(),
+    }
+
+
+async def _get_session(upload_id: str, current_user: dict) -> dict:
+    session = await get_db().upload_sessions.find_one(
+        {"upload_id": upload_id, "uploaded_by": current_user["user_id"]},
+    )
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload not found or expired")
+    return session
+
+
+async def _purge_expired_uploads() -> None:
+    """Drop unfinished uploads past UPLOAD_SESSION_TTL, with their partial files."""
+    db = get_db()
+    expired = await db.upload_sessions.find(
+        {"expires_at": {"$lt": datetime.now(timezone.utc)}},
+        {"upload_id": 1, "temp_path": 1},
+    ).to_list(length=None)
+    for session in expired:
+        Path(session["temp_path"]).unlink(missing_ok=True)
+    if expired:
+        await db.upload_sessions.delete_many({"upload_id": {"$in": [s["upload_id"] for s in expired]}})
+
+
+# ── GET /api/upload/{upload_id} ──────────────────────────────────────
+
+@router.get("/{upload_id}")
+async def get_upload(
+    upload_id: str,
+    current_user: dict = Depends(get_current_user),
+):
+    """Bytes received so far — where a dropped upload resumes."""
+    return _session_view(await _get_session(upload_id, current_user))
+
+
+# ── PUT /api/upload/{upload_id} ──────────────────────────────────────
+
+@router.put("/{upload_id}")
+async def upload_chunk(
+    upload_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0, description="Byte offset of this chunk; must equal bytes received"),
+    current_user: dict = Depends(get_current_user),
+):
+    """Append one chunk (raw request body, at most chunk_size bytes) at `offset`."""
+    db = get_db()
+    session = await _get_session(upload_id, current_user)
+    if offset != session["received"]:
+        raise HTTPException(
+            status_code=409,
+            detail={"message": "Offset does not match bytes received", "received": session["received"]},
+        )
+
+    # Claim the session so two requests for the same offset can't interleave their bytes
+    now = datetime.now(timezone.utc)
+    claimed = await db.upload_sessions.find_one_and_update(
+        {"upload_id": upload_id, "received": offset, "locked_until": {"$lt": now}},
+        {"$set": {"locked_until": now + UPLOAD_CHUNK_LOCK}},
+    )
+    if not claimed:
+        raise HTTPException(status_code=409, detail="Another chunk of this upload is in progress")
+
+    received = offset
+    try:
+        received = await _append_chunk(Path(session["temp_path"]), offset, request, session["size"])
+    finally:
+        now = datetime.now(timezone.utc)
+        await db.upload_sessions.update_one(
+            {"upload_id": upload_id},
+            {"$set": {"received": received, "locked_until": now, "expires_at": now + UPLOAD_SESSION_TTL}},
+        )
+
+    return {"upload_id": upload_id, "received": received, "size": session["size"]}
+
+
+async def _append_chunk(temp_path: Path, offset: int, request: Request, size: int) -> int:
+    """Write the request body at `offset`; on any failure the file is cut back to `offset`."""
+    written = 0
+    async with aiofiles.open(temp_path, "r+b") as part:
+        # Bytes past `offset` are from a chunk whose request died before it was recorded
+        await part.truncate(offset)
+        await part.seek(offset)
+        try:
+            async for data in request.stream():
+                written += len(data)
+                if written > UPLOAD_CHUNK_BYTES or offset + written > size:
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        detail=f"Chunk exceeds {UPLOAD_CHUNK_BYTES} bytes or the declared file size",
+                    )
+                await part.write(data)
+        except BaseException:
+            await part.truncate(offset)
+            raise
+    return offset + written
+
+
+# ── POST /api/upload/{upload_id}/complete ───────────────────────────
+
+@router.post("/{upload_id}/complete", status_code=status.HTTP_202_ACCEPTED)
+async def complete_upload(
+    upload_id: str,
+    current_user: dict = Depends(get_current_user),
+):
+    """Verify the assembled file against its declared sha256, store it and queue ingestion."""
+    db = get_db()
+    session = await _get_session(upload_id, current_user)
+    if session["received"] != session["size"]:
+        raise HTTPException(
+            status_code=409,
+            detail={"message": "Upload is incomplete", "received": session["received"]},
+        )
+    # Only one request gets to finish the upload
+    if not await db.upload_sessions.find_one_and_delete({"upload_id": upload_id, "received": session["size"]}):
+        raise HTTPException(status_code=404, detail="Upload not found or expired")
+
+    temp_path = Path(session["temp_path"])
+    sha256_hash = await asyncio.to_thread(_sha256_file, temp_path)
+    if sha256_hash != session["sha256"]:
+        temp_path.unlink(missing_ok=True)
+        raise HTTPException(status_code=422, detail="Uploaded bytes do not match the declared sha256 — start again")
+
+    bulk = session["priority"] == "bulk"
+    existing = await db.file_metadata.find_one({"sha256_hash": sha256_hash, "classroom_id": session["classroom_id"]})
+    if existing:  # Someone else finished the same file first
+        temp_path.unlink(missing_ok=True)
+        return await _existing_file_response(existing, bulk)
+    owner = await find_owner(sha256_hash)
+    if owner:
+        temp_path.unlink(missing_ok=True)
+        return await _share_existing(
+            owner, session["classroom_id"], session["original_name"], session["doc_type"],
+            session["uploaded_by"], bulk,
+        )
+
+    file_type = _mime_to_file_type(session["mime_type"])
+    try:
+        estimate = await _preflight(
+            temp_path, file_type, session["size"], session["classroom_id"], session["priority"],
+        )
+    except HTTPException:
+        # Keep the verified bytes: /complete succeeds once the budget allows
+        await db.upload_sessions.insert_one(session)
+        raise
+
+    file_id = f"file_{uuid4().hex}"
+    ext = Path(session["original_name"]).suffix or ".bin"
+    try:
+        permanent_path = _store_permanent(temp_path, file_type, file_id, ext)
+    except Exception as e:
+        await refund(session["classroom_id"], estimate)
+        raise HTTPException(status_code=500, detail=f"Failed to save file: {e}")
+
+    doc = _new_file_doc(
+        file_id, session["original_name"], permanent_path, session["mime_type"], file_type,
+        session["size"], sha256_hash, session["classroom_id"], session["doc_type"], session["uploaded_by"],
+        estimate,
+    )
+    try:
+        await db.file_metadata.insert_one(doc)
+    except Exception as e:
+        permanent_path.unlink(missing_ok=True)
+        await refund(session["classroom_id"], estimate)
+        raise HTTPException(status_code=500, detail=f"Failed to save file metadata: {e}")
+
+    await enqueue(file_id, session["classroom_id"], priority=session["priority"])
+
+    return {
+        "file_id": file_id,
+        "original_name": session["original_name"],
+        "file_type": file_type,
+        "status": "pending",
+        "message": "Uploaded. Processing in background.",
+        "estimate": _estimate_view(estimate),
     }
 
 
+def _sha256_file(path: Path) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
 # ── GET /api/files ───────────────────────────────────────────────────
 
 @files_router.get("")
@@ -284,6 +969,46 @@ async def get_file(
     return doc
 
 
+# ── GET /api/files/{file_id}/estimate ───────────────────────────────
+
+@files_router.get("/{file_id}/estimate")
+async def get_file_estimate(
+    file_id: str,
+    current_user: dict = Depends(get_current_user),
+):
+    """
+    The pre-flight estimate recorded for a file, with a fresh queue ETA while it
+    is still waiting and the actual figures once it has completed.
+    """
+    db = get_db()
+    doc = await db.file_metadata.find_one({"file_id": file_id})
+    if not doc:
+        raise HTTPException(status_code=404, detail="File not found")
+    if current_user["role"] != "superadmin":
+        await require_classroom_member(doc.get("classroom_id", ""), current_user["user_id"])
+
+    processing = (await _load_owner(doc)).get("processing", {})
+    if not processing.get("estimate"):
+        raise HTTPException(status_code=404, detail="No estimate recorded for this file")
+
+    result = {
+        "file_id": file_id,
+        "status": processing.get("status"),
+        "estimate": _estimate_view(processing["estimate"]),
+    }
+    if processing.get("queued"):
+        # Counts every waiting file of its priority, so an upper bound
+        result["queue_wait_s"] = round(await queue_wait(processing.get("priority", "interactive")), 1)
+    if processing.get("status") == "completed":
+        result["actual"] = {
+            "pages": processing.get("page_count"),
+            "chunks": processing.get("chunk_count"),
+            "embed_calls": (processing.get("embedding") or {}).get("calls"),
+            "wall_time_s": processing.get("duration_s"),
+        }
+    return result
+
+
 # ── GET /api/files/{file_id}/download ───────────────────────────────
 
 @files_router.get("/{file_id}/download")
@@ -326,9 +1051,13 @@ async def download_file(
 @files_router.post("/{file_id}/retry", status_code=status.HTTP_202_ACCEPTED)
 async def retry_file_ingestion(
     file_id: str,
+    reextract: bool = Query(False, description="Ignore the stored extraction and extract again"),
     current_user: dict = Depends(get_current_user),
 ):
-    """Manually retry ingestion for a failed file."""
+    """
+    Manually retry ingestion for a failed file.
+    Resumes from the stored extraction artifact when there is one, unless reextract=true.
+    """
     if current_user["role"] not in ("teacher", "superadmin"):
         raise HTTPException(status_code=403, detail="Only teachers can retry ingestion")
 
@@ -336,13 +1065,57 @@ async def retry_file_ingestion(
     doc = await db.file_metadata.find_one({"file_id": file_id})
     if not doc:
         raise HTTPException(status_code=404, detail="File not found")
+    if current_user["role"] != "superadmin":
+        await require_classroom_member(doc.get("classroom_id", ""), current_user["user_id"])
 
-    await db.file_metadata.update_one(
-        {"file_id": file_id},
-        {"$set": {"processing.status": "pending", "processing.error": None}},
+    # A shared file is retried on the record that owns its content
+    owner = await _load_owner(doc)
+    owner_id = owner["file_id"]
+    # Re-extraction costs a full ingestion; resuming from the stored extraction only re-embeds
+    estimate = await _preflight(
+        owner["storage_path"], owner["file_type"], owner.get("file_size_bytes") or 0,
+        doc["classroom_id"], "interactive", None if reextract else owner.get("processing"),
+    )
+    await db.file_metadata.update_many(
+        {"$or": [{"file_id": owner_id}, {"content_id": owner_id}]},
+        {"$set": {"processing.status": "pending", "processing.error": None, "processing.estimate": estimate}},
+    )
+
+    await enqueue(owner_id, doc["classroom_id"], priority="interactive", reextract=reextract)
+
+    return {"message": "Retry triggered", "status": "pending", "estimate": _estimate_view(estimate)}
+
+
+# ── POST /api/files/{file_id}/reindex ───────────────────────────────
+
+@files_router.post("/{file_id}/reindex", status_code=status.HTTP_202_ACCEPTED)
+async def reindex_file(
+    file_id: str,
+    current_user: dict = Depends(get_current_user),
+):
+    """Re-chunk and re-embed a file from its stored extraction, without re-extracting."""
+    if current_user["role"] not in ("teacher", "superadmin"):
+        raise HTTPException(status_code=403, detail="Only teachers can re-index files")
+
+    db = get_db()
+    doc = await db.file_metadata.find_one({"file_id": file_id})
+    if not doc:
+        raise HTTPException(status_code=404, detail="File not found")
+    if current_user["role"] != "superadmin":
+        await require_classroom_member(doc.get("classroom_id", ""), current_user["user_id"])
+    owner = await _load_owner(doc)
+    if not owner.get("processing", {}).get("artifact"):
+        raise HTTPException(status_code=409, detail="No stored extraction for this file — use /retry")
+
+    estimate = await _preflight(
+        owner["storage_path"], owner["file_type"], owner.get("file_size_bytes") or 0,
+        doc["classroom_id"], "bulk", owner["processing"],
+    )
+    await db.file_metadata.update_many(
+        {"$or": [{"file_id": owner["file_id"]}, {"content_id": owner["file_id"]}]},
+        {"$set": {"processing.status": "pending", "processing.error": None, "processing.estimate": estimate}},
     )
 
-    from api.services.ingestion import process_file_task
-    process_file_task.delay(file_id)
+    await enqueue(owner["file_id"], doc["classroom_id"], priority="bulk", reindex=True)
 
-    return {"message": "Retry triggered", "status": "pending"}
+    return {"message": "Re-index triggered", "status": "pending", "estimate": _estimate_view(estimate)}
@@ -0,0 +1,214 @@
+"""
+artifacts.py — Durable extracted-text artifacts
+===============================================
+
+Extraction is the expensive part of ingestion, so its output is kept:
+
+  storage/artifacts/<file_id>/<extraction_method>.md.gz
+
+The artifact written last is recorded in file_metadata.processing.artifact
+({method, path, chars, bytes, created_at}). Retries and re-chunk/re-embed
+runs start from it instead of calling Gemini/Docling again.
+
+The Celery canvas (services/ingestion_canvas.py) hands stage outputs to the
+next task by file_id instead of through the broker:
+
+  storage/artifacts/<file_id>/chunks/<batch>.jsonl.gz  chunk records (chunk task)
+  storage/artifacts/<file_id>/chunks/manifest.json     {batch_size, count}
+  storage/artifacts/<file_id>/vectors/<batch>.f32    float32 embeddings (embed → index task)
+"""
+
+from __future__ import annotations
+
+import array
+import gzip
+import json
+import logging
+import os
+import shutil
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterable, Optional, TextIO
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_DIR = Path("storage") / "artifacts"
+ARTIFACT_COMPRESSLEVEL = 6
+
+
+def artifact_path(file_id: str, method: str) -> Path:
+    return ARTIFACT_DIR / file_id / f"{method}.md.gz"
+
+
+def save_extraction(file_id: str, method: str, text: str) -> dict:
+    """Write text gzip-compressed (atomically) and return the pointer stored in MongoDB."""
+    path = artifact_path(file_id, method)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    with gzip.open(tmp, "wt", encoding="utf-8", compresslevel=ARTIFACT_COMPRESSLEVEL) as fh:
+        fh.write(text)
+    os.replace(tmp, path)
+    return {
+        "method": method,
+        "path": str(path),
+        "chars": len(text),
+        "bytes": path.stat().st_size,
+        "created_at": datetime.now(timezone.utc),
+    }
+
+
+class ExtractionWriter:
+    """
+    Incremental save_extraction() for streamed extraction: pages are appended
+    to the gzip file as they arrive instead of being joined in memory first.
+    close() publishes the file atomically and returns the pointer; a writer
+    that is never closed leaves no artifact behind (abort()).
+    """
+
+    def __init__(self, file_id: str, method: str) -> None:
+        self.path = artifact_path(file_id, method)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._tmp = self.path.with_suffix(".tmp")
+        self._fh = gzip.open(self._tmp, "wt", encoding="utf-8", compresslevel=ARTIFACT_COMPRESSLEVEL)
+        self.method = method
+        self.chars = 0
+
+    def write(self, text: str) -> None:
+        if self.chars:
+            self._fh.write("\n\n")
+            self.chars += 2
+        self._fh.write(text)
+        self.chars += len(text)
+
+    def close(self) -> dict:
+        self._fh.close()
+        os.replace(self._tmp, self.path)
+        return {
+            "method": self.method,
+            "path": str(self.path),
+            "chars": self.chars,
+            "bytes": self.path.stat().st_size,
+            "created_at": datetime.now(timezone.utc),
+        }
+
+    def abort(self) -> None:
+        self._fh.close()
+        self._tmp.unlink(missing_ok=True)
+
+
+def load_extraction(pointer: Optional[dict]) -> Optional[str]:
+    """Return the artifact text for a processing.artifact pointer, or None if missing."""
+    if not pointer or not pointer.get("path"):
+        return None
+    path = Path(pointer["path"])
+    if not path.exists():
+        logger.warning("[artifacts] Artifact missing on disk: %s", path)
+        return None
+    with gzip.open(path, "rt", encoding="utf-8") as fh:
+        return fh.read()
+
+
+def open_extraction(pointer: Optional[dict]) -> Optional[TextIO]:
+    """load_extraction() as an open text stream, for reading the artifact incrementally."""
+    if not pointer or not pointer.get("path"):
+        return None
+    path = Path(pointer["path"])
+    if not path.exists():
+        logger.warning("[artifacts] Artifact missing on disk: %s", path)
+        return None
+    return gzip.open(path, "rt", encoding="utf-8")
+
+
+def delete_artifacts(file_id: str) -> None:
+    shutil.rmtree(ARTIFACT_DIR / file_id, ignore_errors=True)
+
+
+# ── Canvas stage outputs ─────────────────────────────────────────────
+
+def _chunks_dir(file_id: str) -> Path:
+    return ARTIFACT_DIR / file_id / "chunks"
+
+
+def _vectors_path(file_id: str, batch_no: int) -> Path:
+    return ARTIFACT_DIR / file_id / "vectors" / f"{batch_no}.f32"
+
+
+def save_chunks(file_id: str, records: Iterable[dict], batch_size: int) -> int:
+    """
+    Write chunk records ({id, chunk_index, page_number, page_end, text}) one JSON
+    object per line, `batch_size` records per file, consuming `records` lazily.
+    Returns how many were written.
+    """
+    path = _chunks_dir(file_id)
+    tmp = path.with_suffix(".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    count = 0
+    fh = None
+    try:
+        for record in records:
+            if count % batch_size == 0:
+                if fh:
+                    fh.close()
+                fh = gzip.open(tmp / f"{count // batch_size}.jsonl.gz", "wt",
+                               encoding="utf-8", compresslevel=ARTIFACT_COMPRESSLEVEL)
+            fh.write(json.dumps(record, ensure_ascii=False) + "\n")
+            count += 1
+    finally:
+        if fh:
+            fh.close()
+    (tmp / "manifest.json").write_text(json.dumps({"batch_size": batch_size, "count": count}))
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+    return count
+
+
+def load_chunks(file_id: str, start: int = 0, stop: Optional[int] = None) -> list[dict]:
+    """
+    Chunk records [start:stop) of the manifest written by save_chunks(). Only the
+    batch files overlapping the range are decompressed.
+    """
+    path = _chunks_dir(file_id)
+    manifest = json.loads((path / "manifest.json").read_text())
+    size = manifest["batch_size"]
+    stop = manifest["count"] if stop is None else min(stop, manifest["count"])
+    records = []
+    for batch_no in range(start // size, -(-stop // size)):
+        first = batch_no * size
+        with gzip.open(path / f"{batch_no}.jsonl.gz", "rt", encoding="utf-8") as fh:
+            for n, line in enumerate(fh, start=first):
+                if n >= stop:
+                    break
+                if n >= start:
+                    records.append(json.loads(line))
+    return records
+
+
+def save_vectors(file_id: str, batch_no: int, vectors: np.ndarray) -> None:
+    """Raw float32 rows (an (n, dim) array), prefixed with the dimension as one uint32."""
+    path = _vectors_path(file_id, batch_no)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    dim = vectors.shape[1] if vectors.ndim == 2 else 0
+    tmp = path.with_suffix(".tmp")
+    tmp.write_bytes(array.array("I", [dim]).tobytes() + vectors.tobytes())
+    os.replace(tmp, path)
+
+
+def load_vectors(file_id: str, batch_no: int) -> np.ndarray:
+    """The (n, dim) float32 array saved by save_vectors(), read without per-float objects."""
+    raw = _vectors_path(file_id, batch_no).read_bytes()
+    dim = array.array("I", raw[:4])[0]
+    if not dim:
+        return np.empty((0, 0), dtype=np.float32)
+    return np.frombuffer(raw, dtype=np.float32, offset=4).reshape(-1, dim)
+
+
+def delete_vectors(file_id: str, batch_no: Optional[int] = None) -> None:
+    """Drop one batch's embeddings once indexed, or all of them (batch_no=None)."""
+    if batch_no is None:
+        shutil.rmtree(ARTIFACT_DIR / file_id / "vectors", ignore_errors=True)
+    else:
+        _vectors_path(file_id, batch_no).unlink(missing_ok=True)
@@ -0,0 +1,298 @@
+"""
+chunker.py — Structure-aware, token-budgeted chunking of extracted markdown
+===========================================================================
+
+Tier 1 (Gemini) and Tier 2 (Docling) emit markdown; every PDF page starts with
+a "[Page N]" line. The chunker reads it as blocks instead of characters:
+
+  heading   "# ..." line — a chunk never ends on one; starts a new chunk once
+            the current one holds CHUNK_MIN_TOKENS
+  table     consecutive "|" lines — kept whole; an oversized table is split by
+            rows with its header repeated
+  code      ``` / ~~~ fences — kept whole; oversized ones split by lines, re-fenced
+  math      $$ ... $$ blocks — kept whole; oversized ones split by lines
+  prose     paragraphs — oversized ones split by sentences, then words
+
+Blocks are packed greedily up to CHUNK_TOKENS (approx_tokens, no tokenizer
+download) across section and page boundaries, so short slide pages share a
+chunk; each chunk reports the page span it covers. CHUNK_OVERLAP_TOKENS of
+trailing prose are repeated at the start of the next chunk (never across a
+heading).
+
+MarkdownChunker is incremental — feed() sections as extraction produces them,
+flush() at the end — so the streaming pipeline and the canvas chunk the same
+way. Output is deterministic for the same text (chunk ids, resume watermarks);
+CHUNKER_VERSION changes whenever the output would.
+"""
+
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from typing import Iterable, Iterator, Optional
+
+CHUNKER_VERSION = "md-1"    # Stored as processing.chunker; a different value invalidates resume
+CHUNK_TOKENS = 256          # Target chunk size in approximate tokens (~1000 chars of prose)
+CHUNK_MIN_TOKENS = 128      # A heading only closes a chunk that already has this much
+CHUNK_OVERLAP_TOKENS = 32   # Trailing prose repeated at the start of the next chunk
+
+CHARS_PER_TOKEN = 4         # Gemini's documented rule of thumb for English text
+# A line that opens a non-prose block; group 1 names it
+_SPECIAL_LINE_RE = re.compile(r"[ \t]*(```|~~~|\$\$|\||#{1,6}\s|\[Page \d+\][ \t]*$)")
+_SPECIAL_RE = re.compile(r"(?m)^" + _SPECIAL_LINE_RE.pattern)
+_PARAGRAPH_RE = re.compile(r"\n[ \t]*\n")
+_LEADING_PAGE_RE = re.compile(r"\s*\[Page \d+\][ \t]*\n(?![ \t]*\n)")
+_PAGE_LINE_RE = re.compile(r"\[Page \d+\]\s*$")
+_TABLE_SEP_RE = re.compile(r"\|?\s*:?-{3,}")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def approx_tokens(text: str) -> int:
+    """Token estimate for budgeting — O(1), no tokenizer download or call."""
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+@dataclass
+class Chunk:
+    text: str
+    page_start: Optional[int]
+    page_end: Optional[int]
+
+
+@dataclass(slots=True)
+class _Block:
+    text: str
+    kind: str               # heading | table | code | math | prose | overlap
+    page: Optional[int]
+    tokens: int
+
+
+# ══════════════════════════════════════════════════════════════════════
+# Markdown → blocks
+# ══════════════════════════════════════════════════════════════════════
+
+def _blocks(section: str, page: Optional[int]) -> Iterator[_Block]:
+    marker = _LEADING_PAGE_RE.match(section)
+    if not _SPECIAL_RE.search(section, marker.end() if marker else 0):
+        # Plain prose after the page marker (most PyMuPDF pages): paragraphs only, no line scan
+        for para in _PARAGRAPH_RE.split(section):
+            if para.strip():
+                yield _block_of(para.strip("\n"), "prose", page)
+        return
+
+    lines = section.split("\n")
+    para: list[str] = []
+    prefix: list[str] = []  # "[Page N]" lines, attached to whatever block follows them
+
+    def _block(kind: str, block_lines: list[str]) -> _Block:
+        text = "\n".join(prefix + block_lines).strip("\n")
+        prefix.clear()
+        return _block_of(text, kind, page)
+
+    i, n = 0, len(lines)
+    while i < n:
+        line = lines[i]
+        special = _SPECIAL_LINE_RE.match(line)
+        if special is None and line.strip():
+            para.append(line)
+            i += 1
+            continue
+        if para:
+            yield _block("prose", para)
+            para = []
+        if special is None:  # Blank line
+            i += 1
+            continue
+
+        opener = special.group(1)
+        if opener.startswith("[Page"):
+            prefix.append(line)
+            i += 1
+        elif opener in ("```", "~~~"):
+            j = i + 1
+            while j < n and not lines[j].lstrip().startswith(opener):
+                j += 1
+            yield _block("code", lines[i:j + 1])
+            i = j + 1
+        elif opener == "$$":
+            j = i
+            stripped = line.strip()
+            if stripped == "$$" or not stripped.endswith("$$"):
+                j = i + 1
+                while j < n and "$$" not in lines[j]:
+                    j += 1
+            yield _block("math", lines[i:j + 1])
+            i = j + 1
+        elif opener == "|":
+            j = i
+            while j < n and lines[j].lstrip().startswith("|"):
+                j += 1
+            yield _block("table", lines[i:j])
+            i = j
+        else:
+            yield _block("heading", [line])
+            i += 1
+
+    if para:
+        yield _block("prose", para)
+    elif prefix:
+        yield _block("prose", [])
+
+
+def _block_of(text: str, kind: str, page: Optional[int]) -> _Block:
+    return _Block(text=text, kind=kind, page=page, tokens=approx_tokens(text))
+
+
+# ══════════════════════════════════════════════════════════════════════
+# Oversized blocks → pieces within the budget
+# ══════════════════════════════════════════════════════════════════════
+
+def _pack(units: list[str], budget: int, joiner: str, header: str = "", footer: str = "") -> Iterator[str]:
+    """Greedily join units into pieces of at most `budget` tokens (a lone oversized unit stays whole)."""
+    fixed = approx_tokens(header) + approx_tokens(footer)
+    piece: list[str] = []
+    size = fixed
+    for unit in units:
+        tokens = approx_tokens(unit)
+        if piece and size + tokens > budget:
+            yield header + joiner.join(piece) + footer
+            piece, size = [], fixed
+        piece.append(unit)
+        size += tokens
+    if piece:
+        yield header + joiner.join(piece) + footer
+
+
+def _split(block: _Block, budget: int) -> Iterator[_Block]:
+    if block.tokens <= budget:
+        yield block
+        return
+
+    # A leading "[Page N]" line stays with the first piece only
+    lines = block.text.split("\n")
+    marker = ""
+    while lines and _PAGE_LINE_RE.match(lines[0].strip()):
+        marker += lines.pop(0) + "\n"
+
+    if block.kind == "table":
+        rows = lines
+        head = 2 if len(rows) > 2 and _TABLE_SEP_RE.match(rows[1].strip()) else 0
+        header = "\n".join(rows[:head]) + "\n" if head else ""
+        pieces = _pack(rows[head:], budget, "\n", header=header)
+    elif block.kind == "code":
+        opener = lines[0]
+        fence = opener.strip()[:3]
+        body = lines[1:-1] if len(lines) > 1 and lines[-1].strip().startswith(fence) else lines[1:]
+        pieces = _pack(body, budget, "\n", header=opener + "\n", footer="\n" + fence)
+    elif block.kind == "math":
+        pieces = _pack(lines, budget, "\n")
+    else:
+        sentences = _SENTENCE_RE.split("\n".join(lines))
+        units: list[str] = []
+        for sentence in sentences:
+            if approx_tokens(sentence) > budget:
+                units.extend(_pack(sentence.split(" "), budget, " "))
+            else:
+                units.append(sentence)
+        pieces = _pack(units, budget, " ")
+
+    for text in pieces:
+        yield _block_of(marker + text, block.kind, block.page)
+        marker = ""
+
+
+# ══════════════════════════════════════════════════════════════════════
+# Blocks → chunks
+# ══════════════════════════════════════════════════════════════════════
+
+class MarkdownChunker:
+    """Packs blocks of successive sections into chunks of about CHUNK_TOKENS."""
+
+    def __init__(self, budget: int = CHUNK_TOKENS, min_tokens: int = CHUNK_MIN_TOKENS,
+                 overlap: int = CHUNK_OVERLAP_TOKENS) -> None:
+        self.budget = budget
+        # Scaled down with a smaller budget (index versions may set one; see database/chroma.py)
+        self.min_tokens = min(min_tokens, budget // 2)
+        self.overlap = min(overlap, budget // 8)
+        self._parts: list[_Block] = []
+        self._tokens = 0
+
+    def feed(self, page: Optional[int], section: str) -> list[Chunk]:
+        """Chunks completed by this section; the tail stays buffered for the next one."""
+        out: list[Chunk] = []
+        for block in _blocks(section, page):
+            if block.tokens <= self.budget:
+                self._add(block, out)
+            else:
+                for piece in _split(block, self.budget):
+                    self._add(piece, out)
+        return out
+
+    def flush(self) -> list[Chunk]:
+        """The last, partial chunk (nothing if only overlap text is left)."""
+        if self._has_content():
+            chunk = self._emit()
+            self._parts, self._tokens = [], 0
+            return [chunk]
+        return []
+
+    def _add(self, block: _Block, out: list[Chunk]) -> None:
+        content = self._has_content()
+        if block.kind == "heading" and not content:
+            # A new section never starts with the previous one's tail
+            self._parts, self._tokens = [], 0
+        elif content and (
+            self._tokens + block.tokens > self.budget
+            or (block.kind == "heading" and self._tokens >= self.min_tokens)
+        ):
+            # Headings at the end belong to what follows them
+            trailing: list[_Block] = []
+            while self._parts and self._parts[-1].kind == "heading":
+                trailing.insert(0, self._parts.pop())
+            if self._has_content():
+                out.append(self._emit())
+                self._parts = [] if block.kind == "heading" or trailing else self._overlap_tail()
+            self._parts += trailing
+            self._tokens = sum(p.tokens for p in self._parts)
+        self._parts.append(block)
+        self._tokens += block.tokens
+
+    def _has_content(self) -> bool:
+        """Anything besides the carried-over overlap (always the first part)?"""
+        parts = self._parts
+        return len(parts) > 1 or (len(parts) == 1 and parts[0].kind != "overlap")
+
+    def _emit(self) -> Chunk:
+        pages = [p.page for p in self._parts if p.page is not None]
+        return Chunk(
+            text="\n\n".join(p.text for p in self._parts if p.text),
+            page_start=min(pages) if pages else None,
+            page_end=max(pages) if pages else None,
+        )
+
+    def _overlap_tail(self) -> list[_Block]:
+        """Trailing sentences of the last prose block, up to `overlap` tokens."""
+        last = self._parts[-1] if self._parts else None
+        if not self.overlap or last is None or last.kind != "prose":
+            return []
+        text = last.text[-2 * self.overlap * CHARS_PER_TOKEN:]
+        text = "\n".join(line for line in text.split("\n") if not _PAGE_LINE_RE.match(line.strip()))
+        tail: list[str] = []
+        size = 0
+        for sentence in reversed(_SENTENCE_RE.split(text)):
+            tokens = approx_tokens(sentence)
+            if size + tokens > self.overlap:
+                break
+            tail.insert(0, sentence)
+            size += tokens
+        if not tail:
+            return []
+        return [_Block(text=" ".join(tail), kind="overlap", page=last.page, tokens=size)]
+
+
+def chunk_sections(sections: Iterable[tuple[Optional[int], str]], budget: int = CHUNK_TOKENS) -> Iterator[Chunk]:
+    """Chunk (page_number, section) pairs in one go."""
+    chunker = MarkdownChunker(budget)
+    for page, section in sections:
+        yield from chunker.feed(page, section)
+    yield from chunker.flush()
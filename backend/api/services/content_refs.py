@@ -0,0 +1,161 @@
+"""
+content_refs.py — One copy of each file's content, shared across classrooms
+==========================================================================
+
+Every file_metadata record is classroom-scoped, but the content behind it —
+blob on disk, extraction artifacts, Chroma vectors — exists once per sha256:
+
+  owner       the first record uploaded with that hash. Ingestion runs on it
+              and its vectors carry metadata file_id = owner's file_id.
+  reference   a later record in another classroom with content_id = owner's
+              file_id. It is never ingested; processing.* is mirrored from
+              the owner by notify_file().
+
+  content_id_of(doc) → the file_id the content (vectors, artifacts) lives under
+
+Retrieval maps a user's classrooms to content ids through these records
+(content_scope) and filters Chroma on file_id, so shared material is found
+from every classroom that references it.
+
+Deleting a record (delete_file_record):
+  - a reference, or an owner nobody else uses: record (and for the last user,
+    the blob, vectors and artifacts) removed
+  - an owner still referenced elsewhere: detached (classroom_id None) so the
+    content keeps its ingestion state; it goes when its last reference does
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Optional
+
+from core.websocket import manager
+from database.chroma import delete_vectors
+from database.mongo import get_db
+
+logger = logging.getLogger(__name__)
+
+# processing.* fields a reference mirrors from its owner
+MIRRORED_FIELDS = ("status", "stage", "chunk_count", "page_count", "indexed_chunks", "indexed_pages", "error")
+
+
+def content_id_of(doc: dict) -> str:
+    return doc.get("content_id") or doc["file_id"]
+
+
+def _mirrored(processing: dict) -> dict:
+    return {f"processing.{field}": processing.get(field) for field in MIRRORED_FIELDS}
+
+
+async def find_owner(sha256_hash: str) -> Optional[dict]:
+    """The record that owns this content, wherever it is, or None."""
+    db = get_db()
+    any_record = await db.file_metadata.find_one({"sha256_hash": sha256_hash})
+    if not any_record:
+        return None
+    return await db.file_metadata.find_one({"file_id": content_id_of(any_record)})
+
+
+def new_reference(
+    owner: dict, file_id: str, classroom_id: str, original_name: str,
+    doc_type: Optional[str], user_id: str,
+) -> dict:
+    """A classroom-scoped record for content `owner` already holds (no upload, no ingestion)."""
+    processing = owner.get("processing", {})
+    return {
+        "file_id": file_id,
+        "content_id": owner["file_id"],
+        "original_name": original_name,
+        "storage_path": owner["storage_path"],
+        "mime_type": owner["mime_type"],
+        "file_type": owner["file_type"],
+        "file_size_bytes": owner["file_size_bytes"],
+        "sha256_hash": owner["sha256_hash"],
+        "source": owner.get("source", {"type": "upload", "youtube_video_id": None}),
+        "classroom_id": classroom_id,
+        "doc_type": doc_type,
+        "processing": {field: processing.get(field) for field in MIRRORED_FIELDS},
+        "uploaded_by": user_id,
+        "uploaded_at": datetime.now(timezone.utc),
+    }
+
+
+async def notify_file(file_id: str, classroom_id: Optional[str], event: Optional[dict] = None) -> None:
+    """
+    Mirror the owner's processing state onto its references and send `event`
+    (with each record's own file_id) to the owner's and every referencing classroom.
+    """
+    db = get_db()
+    refs = await db.file_metadata.find(
+        {"content_id": file_id}, {"_id": 0, "file_id": 1, "classroom_id": 1},
+    ).to_list(length=None)
+    if refs:
+        owner = await db.file_metadata.find_one({"file_id": file_id}, {"processing": 1})
+        if owner:
+            await db.file_metadata.update_many(
+                {"content_id": file_id}, {"$set": _mirrored(owner.get("processing", {}))},
+            )
+    if event is None:
+        return
+
+    targets = ([(file_id, classroom_id)] if classroom_id else []) + [
+        (ref["file_id"], ref["classroom_id"]) for ref in refs
+    ]
+    for target_id, target_classroom in targets:
+        try:
+            await manager.publish_update(target_classroom, {**event, "file_id": target_id})
+        except Exception as e:
+            logger.warning("[content_refs] Could not notify classroom %s: %s", target_classroom, e)
+
+
+async def content_scope(classroom_ids: list[str]) -> dict[str, str]:
+    """content_id → original_name for every file in these classrooms (Chroma file_id filter)."""
+    cursor = get_db().file_metadata.find(
+        {"classroom_id": {"$in": classroom_ids}},
+        {"_id": 0, "file_id": 1, "content_id": 1, "original_name": 1},
+    )
+    return {content_id_of(doc): doc.get("original_name") async for doc in cursor}
+
+
+async def delete_file_record(doc: dict) -> None:
+    """Remove one classroom's file record; the shared content goes with its last record."""
+    db = get_db()
+    content_id = content_id_of(doc)
+    others = await db.file_metadata.count_documents({
+        "$or": [{"content_id": content_id}, {"file_id": content_id}],
+        "file_id": {"$ne": doc["file_id"]},
+        "detached": {"$ne": True},
+    })
+
+    if others:
+        if content_id == doc["file_id"]:
+            # Still referenced elsewhere: keep the owner (ingestion state) out of every classroom
+            await db.file_metadata.update_one(
+                {"file_id": doc["file_id"]},
+                {"$set": {"classroom_id": None, "detached": True, "detached_at": datetime.now(timezone.utc)}},
+            )
+            logger.info("[content_refs] Detached owner %s (%d references remain)", content_id, others)
+        else:
+            await db.file_metadata.delete_one({"file_id": doc["file_id"]})
+        return
+
+    # Last record: the content itself goes
+    from api.services.artifacts import delete_artifacts
+    from api.services.near_dup import delete_fingerprints
+
+    storage_path = doc.get("storage_path")
+    if storage_path and os.path.exists(storage_path):
+        try:
+            os.remove(storage_path)
+        except Exception as e:
+            logger.warning("[content_refs] Could not delete file %s: %s", storage_path, e)
+    try:
+        await asyncio.to_thread(delete_vectors, {"file_id": content_id})
+    except Exception as e:
+        logger.warning("[content_refs] Could not delete Chroma vectors for %s: %s", content_id, e)
+    await asyncio.to_thread(delete_artifacts, content_id)
+    await delete_fingerprints(content_id)
+    await db.file_metadata.delete_many({"file_id": {"$in": [doc["file_id"], content_id]}})
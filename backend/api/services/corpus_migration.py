@@ -0,0 +1,603 @@
+"""
+corpus_migration.py — Zero-downtime re-chunking / re-embedding of the corpus
+============================================================================
+
+Changing the embedding model or the chunk size makes every stored vector
+stale. A migration builds the new index version (database/chroma.py) in a new
+collection next to the live one, then switches:
+
+  building    a sliced background job re-chunks each file's stored extraction
+              (processing.artifact) at the target chunk size, embeds it with
+              the target model and writes it to the target collection.
+              Queries keep using the active collection. Files (re)ingested
+              meanwhile are migrated again; deletions reach both collections.
+  switch      once a pass finds nothing left, active_index.json is replaced
+              in one rename and migrated files are re-pointed (processing.index)
+  draining    files that were still being ingested into the old collection
+              are migrated as they complete
+  completed   the old collection stays until it is dropped (drop_source)
+
+Files without a stored extraction (ingested before artifacts existed) and
+files that stopped part-way (partially_ready + error) are copied instead:
+their stored chunks are re-embedded as they are, keeping the old chunking.
+
+THROTTLE
+  A slice runs for MIGRATION_SLICE_S on the ingest_index queue (the single
+  Chroma writer) at the lowest message priority, then re-queues itself after
+  MIGRATION_PAUSE_S, so live index tasks always go first. Embedding is paced
+  to MIGRATION_MAX_CHUNKS_PER_S with MIGRATION_CONCURRENCY batches in flight.
+
+RESUME
+  State lives in MongoDB:
+    corpus_migrations        {migration_id, status, source, target, progress, active_s, ...}
+    corpus_migration_files   {migration_id, file_id, migrated_at, source_completed_at,
+                              source_started_at, chunks, vectors, copied, fingerprints,
+                              attempts, error}
+  A slice claims the migration (runner_until), so a duplicate delivery does
+  nothing. A killed slice is redelivered (acks_late) or resumed through the
+  superadmin API; a file cut off mid-write is simply migrated again.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from typing import Optional
+from uuid import uuid4
+
+from pymongo import ReturnDocument
+
+from core.celery_app import celery_app
+from core.llm_router import ingestion_key_manager
+from api.services import artifacts
+from api.services.chunker import CHUNK_TOKENS, chunk_sections
+from api.services.embedding import AdaptiveEmbedder
+from api.services.ingestion import (
+    EMBED_BATCH_SIZE,
+    _base_metadata,
+    _chunk_metadata,
+    _chunk_record,
+    _iter_sections,
+    _run_task,
+)
+from api.services.leases import IN_FLIGHT_STATUSES
+from api.services.near_dup import ChunkDeduper
+from database.chroma import (
+    COLLECTION_NAME,
+    active_index,
+    drop_collection,
+    get_collection,
+    index_of,
+    write_index_pointer,
+)
+from database.mongo import get_db
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_SLICE_S = int(os.getenv("MIGRATION_SLICE_S", "60"))
+MIGRATION_PAUSE_S = float(os.getenv("MIGRATION_PAUSE_S", "5"))
+MIGRATION_MAX_CHUNKS_PER_S = float(os.getenv("MIGRATION_MAX_CHUNKS_PER_S", "50"))
+MIGRATION_CONCURRENCY = int(os.getenv("MIGRATION_CONCURRENCY", "2"))
+MIGRATION_FILE_ATTEMPTS = 3     # A file failing this often fails the migration (it cannot switch without it)
+MIGRATION_CELERY_PRIORITY = 9   # Lowest step: every live ingestion task goes first
+MIGRATION_CLAIM_S = 900         # A slice's claim outlives its task time limit
+
+_OPEN_STATUSES = ["building", "draining", "paused", "failed"]
+_RUNNING_STATUSES = ["building", "draining"]
+_MARKER_FIELDS = {
+    "_id": 0, "file_id": 1, "classroom_id": 1, "migrated_at": 1, "source_completed_at": 1,
+    "source_started_at": 1, "chunks": 1, "copied": 1,
+}
+_FILE_FIELDS = {
+    "_id": 0, "file_id": 1, "original_name": 1, "file_type": 1, "classroom_id": 1,
+    "doc_type": 1, "uploaded_by": 1, "processing": 1,
+}
+
+
+class MigrationConflict(RuntimeError):
+    """The requested change does not fit the migration's current state."""
+
+
+class MigrationNotFound(LookupError):
+    pass
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _migratable() -> dict:
+    """Owner records with vectors: completed, or stopped part-way for good."""
+    return {
+        "content_id": None,  # References share their owner's vectors
+        "$or": [
+            {"processing.status": "completed"},
+            {"processing.status": "partially_ready", "processing.error": {"$ne": None}},
+        ],
+    }
+
+
+# ══════════════════════════════════════════════════════════════════════
+# Lifecycle
+# ══════════════════════════════════════════════════════════════════════
+
+async def start_migration(
+    embed_model: Optional[str] = None, chunk_tokens: Optional[int] = None, started_by: str = "",
+) -> dict:
+    """Create the target collection and queue the first slice."""
+    db = get_db()
+    if running := await db.corpus_migrations.find_one({"status": {"$in": _OPEN_STATUSES}}):
+        raise MigrationConflict(f"Migration {running['migration_id']} is {running['status']}")
+
+    migration_id = f"mig_{uuid4().hex[:12]}"
+    source = active_index()
+    target = {
+        "collection": f"{COLLECTION_NAME}_{migration_id}",
+        "embed_model": embed_model or source["embed_model"],
+        # The legacy index (chunk_tokens None) has no token budget to keep
+        "chunk_tokens": chunk_tokens or source["chunk_tokens"] or CHUNK_TOKENS,
+    }
+    if (target["embed_model"], target["chunk_tokens"]) == (source["embed_model"], source["chunk_tokens"]):
+        raise MigrationConflict("Target embedding model and chunk size match the active index")
+
+    migration = {
+        "migration_id": migration_id,
+        "status": "building",
+        "source": source,
+        "target": target,
+        "rechunk": target["chunk_tokens"] != source["chunk_tokens"],
+        "started_by": started_by,
+        "created_at": _now(),
+        "updated_at": _now(),
+        "switched_at": None,
+        "completed_at": None,
+        "source_dropped_at": None,
+        "runner_until": None,
+        "active_s": 0.0,
+        "progress": {
+            "files_total": 0, "files_done": 0, "files_copied": 0, "files_remigrated": 0,
+            "file_failures": 0, "chunks": 0, "vectors": 0, "embed_calls": 0, "cache_hits": 0,
+        },
+        "error": None,
+    }
+    await asyncio.to_thread(get_collection, target["collection"])
+    # From here deletions reach the target collection too
+    await asyncio.to_thread(write_index_pointer, source, target)
+    await db.corpus_migrations.insert_one(dict(migration))
+    _dispatch(migration_id)
+    logger.info("[migration] %s started: %s → %s", migration_id, source, target)
+    return migration_report(migration)
+
+
+async def pause_migration(migration_id: str) -> dict:
+    return await _transition(migration_id, _RUNNING_STATUSES, {"status": "paused"})
+
+
+async def resume_migration(migration_id: str) -> dict:
+    """Continue a paused or failed migration; files that ran out of attempts get new ones."""
+    db = get_db()
+    migration = await _load(migration_id)
+    if migration["status"] not in ("paused", "failed"):
+        raise MigrationConflict(f"Migration is {migration['status']}")
+    await db.corpus_migration_files.update_many(
+        {"migration_id": migration_id, "error": {"$ne": None}}, {"$set": {"attempts": 0}},
+    )
+    resumed = await _transition(migration_id, ["paused", "failed"], {
+        "status": "draining" if migration["switched_at"] else "building",
+        "error": None,
+    })
+    _dispatch(migration_id)
+    return resumed
+
+
+async def cancel_migration(migration_id: str) -> dict:
+    """Abandon a migration before the switch: the target collection is dropped."""
+    migration = await _load(migration_id)
+    if (
+        migration["switched_at"]
+        or migration["status"] not in _OPEN_STATUSES
+        or active_index()["collection"] == migration["target"]["collection"]
+    ):
+        raise MigrationConflict(f"Migration is {migration['status']} and can no longer be cancelled")
+    cancelled = await _transition(migration_id, _OPEN_STATUSES, {"status": "cancelled"})
+    await asyncio.to_thread(write_index_pointer, migration["source"], None)
+    await asyncio.to_thread(drop_collection, migration["target"]["collection"])
+    await get_db().corpus_migration_files.delete_many({"migration_id": migration_id})
+    return cancelled
+
+
+async def drop_source(migration_id: str) -> dict:
+    """Delete the collection a completed migration replaced."""
+    migration = await _load(migration_id)
+    if migration["status"] != "completed" or migration["source_dropped_at"]:
+        raise MigrationConflict("Only a completed migration's source collection can be dropped, once")
+    if migration["source"]["collection"] == active_index()["collection"]:
+        raise MigrationConflict("The source collection is serving queries again")
+    await asyncio.to_thread(drop_collection, migration["source"]["collection"])
+    return await _transition(migration_id, ["completed"], {"source_dropped_at": _now()})
+
+
+async def get_migration(migration_id: str) -> dict:
+    return migration_report(await _load(migration_id))
+
+
+async def list_migrations(limit: int = 20) -> list[dict]:
+    cursor = get_db().corpus_migrations.find({}, {"_id": 0}).sort("created_at", -1).limit(limit)
+    return [migration_report(m) async for m in cursor]
+
+
+def migration_report(migration: dict) -> dict:
+    """The migration document plus throughput and a time-to-switch estimate."""
+    progress = migration["progress"]
+    active_s = migration.get("active_s") or 0.0
+    remaining = max(0, progress["files_total"] - progress["files_done"])
+    files_per_s = progress["files_done"] / active_s if active_s else 0.0
+    report = {k: v for k, v in migration.items() if k not in ("_id", "runner_until")}
+    report["throughput"] = {
+        "files_per_min": round(files_per_s * 60, 2),
+        "chunks_per_s": round(progress["chunks"] / active_s, 2) if active_s else 0.0,
+        "files_remaining": remaining,
+        "eta_s": round(remaining / files_per_s) if files_per_s else None,
+    }
+    return report
+
+
+async def _load(migration_id: str) -> dict:
+    migration = await get_db().corpus_migrations.find_one({"migration_id": migration_id}, {"_id": 0})
+    if not migration:
+        raise MigrationNotFound(migration_id)
+    return migration
+
+
+async def _transition(migration_id: str, from_statuses: list[str], update: dict) -> dict:
+    migration = await get_db().corpus_migrations.find_one_and_update(
+        {"migration_id": migration_id, "status": {"$in": from_statuses}},
+        {"$set": {**update, "updated_at": _now()}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER,
+    )
+    if not migration:
+        current = await _load(migration_id)
+        raise MigrationConflict(f"Migration is {current['status']}")
+    return migration_report(migration)
+
+
+def _dispatch(migration_id: str, countdown: float = 0) -> None:
+    migrate_corpus_task.apply_async(
+        args=[migration_id], countdown=countdown, priority=MIGRATION_CELERY_PRIORITY,
+    )
+
+
+# ══════════════════════════════════════════════════════════════════════
+# Slices
+# ══════════════════════════════════════════════════════════════════════
+
+class _Pacer:
+    """Sleeps whenever the chunks written so far run ahead of `rate` per second."""
+
+    def __init__(self, rate: float) -> None:
+        self.rate = rate
+        self.t0 = time.monotonic()
+        self.chunks = 0
+
+    async def account(self, chunks: int) -> None:
+        self.chunks += chunks
+        ahead = self.chunks / self.rate - (time.monotonic() - self.t0)
+        if ahead > 0:
+            await asyncio.sleep(ahead)
+
+
+async def run_slice(migration_id: str) -> None:
+    """One time-boxed pass; queues the next slice while there is work left."""
+    db = get_db()
+    now = _now()
+    migration = await db.corpus_migrations.find_one_and_update(
+        {
+            "migration_id": migration_id,
+            "status": {"$in": _RUNNING_STATUSES},
+            "$or": [{"runner_until": None}, {"runner_until": {"$lt": now}}],
+        },
+        {"$set": {"runner_until": now + timedelta(seconds=MIGRATION_CLAIM_S)}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER,
+    )
+    if not migration:
+        logger.info("[migration] %s: not running or claimed by another slice", migration_id)
+        return
+
+    t0 = time.monotonic()
+    try:
+        await _work(migration, t0)
+    except Exception as e:
+        logger.exception("[migration] %s failed: %s", migration_id, e)
+        await _fail(migration_id, str(e) or type(e).__name__)
+    finally:
+        await db.corpus_migrations.update_one(
+            {"migration_id": migration_id},
+            {
+                "$set": {"runner_until": None, "updated_at": _now()},
+                "$inc": {"active_s": round(time.monotonic() - t0, 1)},
+            },
+        )
+    # Still running (including resumed while this slice wound down): queue the next one
+    if (await _load(migration_id))["status"] in _RUNNING_STATUSES:
+        _dispatch(migration_id, countdown=MIGRATION_PAUSE_S)
+
+
+async def _work(migration: dict, t0: float) -> None:
+    """Migrate candidates until the slice is used up; switch or finish when none are left."""
+    db = get_db()
+    migration_id = migration["migration_id"]
+    target = migration["target"]
+    candidates, unpointed = await _candidates(migration)
+    done = await db.corpus_migration_files.count_documents(
+        {"migration_id": migration_id, "migrated_at": {"$ne": None}},
+    )
+    fresh = sum(not doc["_remigrate"] for doc in candidates)
+    await db.corpus_migrations.update_one(
+        {"migration_id": migration_id},
+        {"$set": {"progress.files_done": done, "progress.files_total": done + fresh}},
+    )
+    if migration["status"] == "draining":
+        for marker in unpointed:  # Left over by a switch that was cut short
+            await _repoint(migration, marker)
+
+    if not candidates:
+        if migration["status"] == "building":
+            await _switch(migration)
+            return
+        # Draining: done once nothing is still being ingested into the old collection
+        in_flight = await db.file_metadata.count_documents({
+            "content_id": None,
+            "processing.status": {"$in": IN_FLIGHT_STATUSES},
+            "processing.error": None,
+            "processing.index.collection": {"$ne": target["collection"]},
+        })
+        if in_flight:
+            return
+        await _transition(migration_id, ["draining"], {"status": "completed", "completed_at": _now()})
+        logger.info("[migration] %s completed", migration_id)
+        return
+
+    embedder = AdaptiveEmbedder(
+        key_pool=ingestion_key_manager,
+        model=target["embed_model"],
+        task_type="RETRIEVAL_DOCUMENT",
+        initial_batch=EMBED_BATCH_SIZE,
+    )
+    pacer = _Pacer(MIGRATION_MAX_CHUNKS_PER_S)
+    for doc in candidates:
+        if time.monotonic() - t0 >= MIGRATION_SLICE_S:
+            return
+        current = await db.corpus_migrations.find_one({"migration_id": migration_id}, {"status": 1})
+        if current["status"] not in _RUNNING_STATUSES:
+            return  # Paused or cancelled meanwhile
+        if not await _migrate_one(migration, doc, embedder, pacer):
+            return
+
+
+async def _candidates(migration: dict) -> tuple[list[dict], list[dict]]:
+    """
+    Files whose current vectors the target collection does not hold yet, and
+    markers of migrated files that still point at the old collection.
+    """
+    db = get_db()
+    markers = {
+        m["file_id"]: m
+        async for m in db.corpus_migration_files.find(
+            {"migration_id": migration["migration_id"]}, _MARKER_FIELDS,
+        )
+    }
+    cursor = db.file_metadata.find(
+        {**_migratable(), "processing.index.collection": {"$ne": migration["target"]["collection"]}},
+        _FILE_FIELDS,
+    ).sort("uploaded_at", 1)
+    candidates, unpointed = [], []
+    async for doc in cursor:
+        marker = markers.get(doc["file_id"])
+        migrated = bool(marker and marker.get("migrated_at"))
+        processing = doc["processing"]
+        if (
+            migrated
+            and marker["source_completed_at"] == processing.get("completed_at")
+            and marker["source_started_at"] == processing.get("started_at")
+        ):
+            unpointed.append(marker)  # Migrated, and not re-ingested since
+            continue
+        doc["_remigrate"] = migrated
+        candidates.append(doc)
+    return candidates, unpointed
+
+
+async def _migrate_one(migration: dict, doc: dict, embedder: AdaptiveEmbedder, pacer: _Pacer) -> bool:
+    """Migrate one file and record the outcome. Returns False if the migration had to fail."""
+    db = get_db()
+    migration_id = migration["migration_id"]
+    file_id = doc["file_id"]
+    key = {"migration_id": migration_id, "file_id": file_id}
+    calls, hits = embedder.calls, embedder.cache_hits
+    try:
+        result = await _migrate_file(migration, doc, embedder, pacer)
+    except Exception as e:
+        error = (str(e) or type(e).__name__)[:500]
+        marker = await db.corpus_migration_files.find_one_and_update(
+            key,
+            {"$set": {"error": error, "failed_at": _now()}, "$inc": {"attempts": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        await db.corpus_migrations.update_one(
+            {"migration_id": migration_id}, {"$inc": {"progress.file_failures": 1}},
+        )
+        logger.warning("[migration] %s: %s failed (attempt %d): %s",
+                       migration_id, file_id, marker["attempts"], error)
+        if marker["attempts"] >= MIGRATION_FILE_ATTEMPTS:
+            await _fail(migration_id, f"{file_id} failed {marker['attempts']} times: {error}")
+            return False
+        return True
+
+    processing = doc["processing"]
+    marker = {
+        "file_id": file_id,
+        "classroom_id": doc.get("classroom_id"),
+        "migrated_at": _now(),
+        "source_completed_at": processing.get("completed_at"),
+        "source_started_at": processing.get("started_at"),
+        "attempts": 0,
+        "error": None,
+        **result,
+    }
+    await db.corpus_migration_files.update_one(key, {"$set": marker}, upsert=True)
+    await db.corpus_migrations.update_one({"migration_id": migration_id}, {"$inc": {
+        "progress.files_done": int(not doc["_remigrate"]),
+        "progress.files_remigrated": int(doc["_remigrate"]),
+        "progress.files_copied": int(result["copied"]),
+        "progress.chunks": result["chunks"],
+        "progress.vectors": result["vectors"],
+        "progress.embed_calls": embedder.calls - calls,
+        "progress.cache_hits": embedder.cache_hits - hits,
+    }})
+    if migration["status"] == "draining":
+        # Already switched: the file is served from the target right away
+        await _repoint(migration, marker)
+    return True
+
+
+async def _migrate_file(migration: dict, doc: dict, embedder: AdaptiveEmbedder, pacer: _Pacer) -> dict:
+    """Write one file's chunks to the target collection, replacing any earlier copy."""
+    target = migration["target"]
+    file_id = doc["file_id"]
+    processing = doc["processing"]
+    text = None
+    if processing["status"] == "completed":
+        text = await asyncio.to_thread(artifacts.load_extraction, processing.get("artifact"))
+    copied = text is None
+
+    deduper = ChunkDeduper()  # Within-file aliases only: classroom reuse needs target-model vectors
+    if not copied:
+        # ① Re-chunk the stored extraction with the target chunk size
+        records = []
+        for index, chunk in enumerate(chunk_sections(_iter_sections(text), target["chunk_tokens"]), start=1):
+            record = _chunk_record(file_id, index, chunk)
+            deduper.check(record)
+            records.append(record)
+        del text
+        chunks = len(records)
+        records = [r for r in records if not r.get("alias_of")]
+        base_metadata = _base_metadata(doc)
+        method = processing["artifact"]["method"]
+        ids = [r["id"] for r in records]
+        texts = [r["text"] for r in records]
+        metadatas = [_chunk_metadata(base_metadata, method, r) for r in records]
+    else:
+        # ① No stored text: copy the chunks the file has now
+        source = get_collection(index_of(processing)["collection"])
+        got = await asyncio.to_thread(
+            source.get, where={"file_id": file_id}, include=["documents", "metadatas"],
+        )
+        ids, texts = got["ids"], got["documents"]
+        metadatas = [{k: v for k, v in m.items() if k != "near_dup_of"} for m in got["metadatas"]]
+        chunks = len(ids)
+    if not ids:
+        raise RuntimeError("No chunks to migrate")
+
+    # ② Embed with the target model, MIGRATION_CONCURRENCY batches at a time, and upsert
+    collection = get_collection(target["collection"])
+    await asyncio.to_thread(collection.delete, where={"file_id": file_id})
+    start = 0
+    while start < len(ids):
+        size = embedder.batch_size
+        stop = min(len(ids), start + size * MIGRATION_CONCURRENCY)
+        parts = await asyncio.gather(*(
+            embedder.embed(texts[i:min(i + size, stop)]) for i in range(start, stop, size)
+        ))
+        await asyncio.to_thread(
+            collection.upsert,
+            ids=ids[start:stop],
+            documents=texts[start:stop],
+            embeddings=[vec for part in parts for vec in part],
+            metadatas=metadatas[start:stop],
+        )
+        await pacer.account(stop - start)
+        start = stop
+
+    return {
+        "chunks": chunks,
+        "vectors": len(ids),
+        "copied": copied,
+        "fingerprints": None if copied else deduper.fingerprints,
+    }
+
+
+async def _switch(migration: dict) -> None:
+    """Make the target collection the one serving queries, then re-point migrated files."""
+    db = get_db()
+    migration_id = migration["migration_id"]
+    # Pointer first: a slice killed in between just switches again on its next pass
+    await asyncio.to_thread(write_index_pointer, migration["target"], None)
+    await _transition(migration_id, ["building", "paused"], {"status": "draining", "switched_at": _now()})
+    logger.info("[migration] %s switched queries to %s", migration_id, migration["target"]["collection"])
+
+    repointed = 0
+    async for marker in db.corpus_migration_files.find(
+        {"migration_id": migration_id, "migrated_at": {"$ne": None}}, _MARKER_FIELDS,
+    ):
+        repointed += await _repoint(migration, marker)
+    logger.info("[migration] %s re-pointed %d files; draining", migration_id, repointed)
+
+
+async def _repoint(migration: dict, marker: dict) -> int:
+    """
+    Record a migrated file as living in the target collection — unless it was
+    re-ingested since it was copied (draining picks it up again).
+    """
+    db = get_db()
+    update = {"processing.index": migration["target"]}
+    if migration["rechunk"]:
+        if marker["copied"]:
+            update["processing.chunker"] = None  # Old chunking: a resume must not trust its watermark
+        else:
+            update["processing.chunk_count"] = marker["chunks"]
+            update["processing.indexed_chunks"] = marker["chunks"]
+    result = await db.file_metadata.update_one(
+        {
+            "file_id": marker["file_id"],
+            "processing.completed_at": marker["source_completed_at"],
+            "processing.started_at": marker["source_started_at"],
+        },
+        {"$set": update},
+    )
+    if result.modified_count and migration["rechunk"] and not marker["copied"] and marker.get("classroom_id"):
+        # Near-duplicate lookups must see the chunk ids the target collection holds
+        stored = await db.corpus_migration_files.find_one(
+            {"migration_id": migration["migration_id"], "file_id": marker["file_id"]}, {"fingerprints": 1},
+        )
+        if stored and stored.get("fingerprints"):
+            await db.chunk_fingerprints.replace_one(
+                {"file_id": marker["file_id"]},
+                {"file_id": marker["file_id"], "classroom_id": marker["classroom_id"],
+                 "fingerprints": stored["fingerprints"]},
+                upsert=True,
+            )
+    return result.modified_count
+
+
+async def _fail(migration_id: str, error: str) -> None:
+    await get_db().corpus_migrations.update_one(
+        {"migration_id": migration_id, "status": {"$in": _RUNNING_STATUSES}},
+        {"$set": {"status": "failed", "error": error[:500], "updated_at": _now()}},
+    )
+
+
+# ══════════════════════════════════════════════════════════════════════
+# Celery task
+# ══════════════════════════════════════════════════════════════════════
+
+@celery_app.task(name="ingestion.migrate_corpus_task", time_limit=900, soft_time_limit=840)
+def migrate_corpus_task(migration_id: str):
+    """One migration slice (routed to ingest_index: see core/celery_app.py)."""
+    _run_task(partial(run_slice, migration_id))
@@ -0,0 +1,231 @@
+"""
+embedding.py — Concurrent, adaptive Gemini embedder for ingestion
+=================================================================
+
+Keeps at most one in-flight embed_content batch per healthy key in the
+INGESTION pool and tunes itself AIMD-style (additive increase, multiplicative
+decrease) from the feedback each call returns:
+
+  - Fast success   → batch size += EMBED_BATCH_STEP, concurrency += 1
+  - 429 / quota    → batch size and concurrency halved, key penalised
+  - Slow success   → batch size halved (latency above EMBED_LATENCY_TARGET_S)
+
+Concurrency is always capped by the number of healthy keys, so a single-key
+deployment behaves like the old sequential loop but without blocking sleeps.
+Texts already in core.embedding_cache never reach Gemini.
+
+Canvas embed tasks share one embedder per (key pool, model, task type) and
+event loop (shared_embedder), so every task running in a worker process
+draws from the same per-key slots and AIMD state.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+import weakref
+from typing import Optional
+
+from core.embedding_cache import embedding_cache
+from core.llm_router import GeminiKeyManager
+
+logger = logging.getLogger(__name__)
+
+EMBED_MIN_BATCH = 10
+EMBED_MAX_BATCH = 100           # Gemini batchEmbedContents hard limit
+EMBED_BATCH_STEP = 10
+EMBED_LATENCY_TARGET_S = 8.0    # Batches slower than this count as congestion
+EMBED_MAX_ATTEMPTS = 5
+
+
+def _is_rate_limited(err: str) -> bool:
+    return "429" in err or "RESOURCE_EXHAUSTED" in err
+
+
+def _count(tally: dict, key: str, n: int) -> None:
+    tally[key] = tally.get(key, 0) + n
+
+
+class AdaptiveEmbedder:
+    """
+    Embeds text batches across every healthy key of a GeminiKeyManager pool.
+
+    One instance is created per ingestion run; `batch_size` and `concurrency`
+    are read by the pipeline's embed stage before it dispatches each batch.
+    """
+
+    def __init__(
+        self,
+        key_pool: GeminiKeyManager,
+        model: str,
+        task_type: str,
+        initial_batch: int = 50,
+    ):
+        self.key_pool = key_pool
+        self.model = model
+        self.task_type = task_type
+
+        self.batch_size = max(EMBED_MIN_BATCH, min(initial_batch, EMBED_MAX_BATCH))
+        self.concurrency = max(1, len(key_pool.healthy_keys()))
+
+        self._busy: set[str] = set()
+        self._cond = asyncio.Condition()
+
+        # Throughput counters
+        self.chunks_embedded = 0
+        self.cache_hits = 0
+        self.calls = 0
+        self.rate_limited = 0
+        self._t_first: Optional[float] = None
+        self._t_last: Optional[float] = None
+
+    # ── Public API ──────────────────────────────────────────────────
+
+    async def embed(self, texts: list[str], tally: Optional[dict] = None) -> list[list[float]]:
+        """
+        Embed one batch; cached texts are served from embedding_cache, the rest from Gemini.
+        `tally` (a dict) also receives this call's counters, for callers sharing the embedder.
+        """
+        if self._t_first is None:
+            self._t_first = time.time()
+        tally = tally if tally is not None else {}
+
+        vectors = await embedding_cache.get_many(self.model, self.task_type, texts)
+        miss_idx = [i for i, v in enumerate(vectors) if v is None]
+        self.cache_hits += len(texts) - len(miss_idx)
+        _count(tally, "cache_hits", len(texts) - len(miss_idx))
+
+        if miss_idx:
+            miss_texts = [texts[i] for i in miss_idx]
+            fresh = await self._embed_remote(miss_texts, tally)
+            await embedding_cache.put_many(self.model, self.task_type, miss_texts, fresh)
+            for i, vec in zip(miss_idx, fresh):
+                vectors[i] = vec
+
+        self._t_last = time.time()
+        return vectors  # type: ignore[return-value]
+
+    async def _embed_remote(self, texts: list[str], tally: dict) -> list[list[float]]:
+        """Embed one batch via Gemini, retrying on other keys after a 429."""
+        for attempt in range(EMBED_MAX_ATTEMPTS):
+            key = await self._acquire_key()
+            t0 = time.time()
+            try:
+                client = self.key_pool.client_for_key(key)
+                resp = await client.aio.models.embed_content(
+                    model=self.model,
+                    contents=texts,
+                    config={"task_type": self.task_type},
+                )
+            except Exception as e:
+                err = str(e)
+                if _is_rate_limited(err) and attempt < EMBED_MAX_ATTEMPTS - 1:
+                    self.rate_limited += 1
+                    _count(tally, "rate_limited", 1)
+                    self._on_congestion(rate_limited=True)
+                    self.key_pool.mark_unhealthy(key, duration=2 ** (attempt + 2))
+                    logger.warning(
+                        "[embedder] 429 on key ...%s (attempt %d). batch_size=%d concurrency=%d",
+                        key[-4:], attempt + 1, self.batch_size, self.concurrency,
+                    )
+                    continue
+                raise RuntimeError(f"Embedding failed after {attempt+1} attempts: {e}")
+            finally:
+                await self._release_key(key)
+
+            latency = time.time() - t0
+            vectors = [list(emb.values) for emb in resp.embeddings]
+            if len(vectors) != len(texts):
+                raise RuntimeError(
+                    f"Embedding mismatch: got {len(vectors)} embeddings for {len(texts)} chunks"
+                )
+
+            self.calls += 1
+            self.chunks_embedded += len(texts)
+            _count(tally, "calls", 1)
+            _count(tally, "chunks_embedded", len(texts))
+            if latency > EMBED_LATENCY_TARGET_S:
+                self._on_congestion(rate_limited=False)
+            else:
+                self._on_success()
+            return vectors
+
+        raise RuntimeError("Embedding failed: retries exhausted")
+
+    @property
+    def chunks_per_sec(self) -> float:
+        """Achieved throughput (cached + remote) from the first dispatch to the last completed batch."""
+        if self._t_first is None or self._t_last is None or self._t_last <= self._t_first:
+            return 0.0
+        return (self.chunks_embedded + self.cache_hits) / (self._t_last - self._t_first)
+
+    def stats(self) -> dict:
+        return {
+            "chunks_embedded": self.chunks_embedded,
+            "cache_hits": self.cache_hits,
+            "calls": self.calls,
+            "rate_limited": self.rate_limited,
+            "chunks_per_sec": round(self.chunks_per_sec, 2),
+            "final_batch_size": self.batch_size,
+            "final_concurrency": self.concurrency,
+        }
+
+    # ── AIMD control ────────────────────────────────────────────────
+
+    def _on_success(self) -> None:
+        self.batch_size = min(self.batch_size + EMBED_BATCH_STEP, EMBED_MAX_BATCH)
+        self.concurrency = min(self.concurrency + 1, max(1, len(self.key_pool.keys)))
+
+    def _on_congestion(self, rate_limited: bool) -> None:
+        self.batch_size = max(self.batch_size // 2, EMBED_MIN_BATCH)
+        if rate_limited:
+            self.concurrency = max(self.concurrency // 2, 1)
+
+    # ── Key scheduling ──────────────────────────────────────────────
+
+    async def _acquire_key(self) -> str:
+        """Wait for a healthy key with no batch in flight, within the concurrency budget."""
+        if not self.key_pool.has_keys:
+            raise RuntimeError(f"[{self.key_pool.pool_name}] No Gemini keys configured")
+
+        async with self._cond:
+            while True:
+                if len(self._busy) < self.concurrency:
+                    free = [k for k in self.key_pool.healthy_keys() if k not in self._busy]
+                    if free:
+                        self._busy.add(free[0])
+                        return free[0]
+                # Re-check periodically so penalty-box expiry is noticed
+                try:
+                    await asyncio.wait_for(self._cond.wait(), timeout=1.0)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _release_key(self, key: str) -> None:
+        async with self._cond:
+            self._busy.discard(key)
+            self._cond.notify_all()
+
+
+# ══════════════════════════════════════════════════════════════════════
+# Shared instances
+# ══════════════════════════════════════════════════════════════════════
+
+# One embedder per event loop (its Condition is bound to the loop) and per (pool, model, task type)
+_shared: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[tuple, AdaptiveEmbedder]] = \
+    weakref.WeakKeyDictionary()
+
+
+def shared_embedder(key_pool: GeminiKeyManager, model: str, task_type: str,
+                    initial_batch: int = 50) -> AdaptiveEmbedder:
+    """
+    The process-wide embedder for a pool, model and task type. Concurrent tasks
+    on the worker loop share its key slots and AIMD state instead of each
+    assuming it owns every healthy key. Use embed(tally=...) for per-task counters.
+    """
+    embedders = _shared.setdefault(asyncio.get_running_loop(), {})
+    key = (key_pool.pool_name, model, task_type)
+    if key not in embedders:
+        embedders[key] = AdaptiveEmbedder(key_pool, model, task_type, initial_batch=initial_batch)
+    return embedders[key]
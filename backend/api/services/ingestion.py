@@ -7,20 +7,59 @@ EXTRACTION TIERS (in order of quality and preference):
   TIER 1 — Gemini File API  (multimodal, handles tables/diagrams/equations)
       - Uses INGESTION key pool with INGESTION_MODEL_CHAIN
       - Retries up to 3 times with key rotation on 429/503
-      - Typical latency: 10-90 seconds depending on file size
+      - Large PDFs are split into page ranges extracted concurrently across keys;
+        a failed range drops to Tier 2/3 on its own (extraction_method = "gemini_mixed")
 
   TIER 2 — Docling  (local, free, structured text + basic tables)
       - CPU-based, no API key needed
       - Good for well-formatted PDFs without complex visuals
-      - Typical latency: 30-120 seconds (heavy model)
+      - Converters are built once per worker process (warm_docling) and reused
+      - Speed profile per document: OCR/table models only when the PDF needs them
 
   TIER 3 — PyMuPDF  (local, free, text-only, fastest)
       - No table/image/equation understanding
+      - Long PDFs are extracted page-parallel across a process pool
       - Used as last resort only
       - File is flagged in metadata: extraction_method = "pymupdf_text_only"
       - Students are warned in the UI that content may be incomplete
 
+TRIAGE:
+  - Before extraction, PyMuPDF measures text-layer coverage, image area and tables
+  - The cheapest adequate tier is tried first; decision + timings go to processing.triage
+  - Set INGESTION_TRIAGE=0 to always start at Tier 1
+
+PIPELINE:
+  - Extract → chunk → embed → upsert run as concurrent stages joined by bounded queues
+  - Text-native PDFs (triaged to Tier 3) stream page by page from the PyMuPDF pool into
+    the chunk stage and the artifact, never holding the whole text (INGESTION_STREAM_PAGES=0
+    extracts in one piece)
+  - Chunking packs markdown blocks (headings, tables, code, LaTeX) into ~256-token
+    chunks spanning page boundaries (see services/chunker.py)
+  - Vectors are upserted batch by batch, so early sections are searchable first
+  - processing.indexed_chunks / indexed_pages track the contiguous prefix already stored;
+    status is "partially_ready" from the first batch, with file_progress WebSocket events
+  - A failed or timed-out run keeps its vectors and a retry resumes after the watermark
+  - Embedding fans out across all healthy INGESTION keys (see services/embedding.py)
+  - Near-duplicate chunks are not embedded (services/near_dup.py): repeats within the
+    file are aliases without a vector, repeats of another classroom file reuse its
+    vector; processing.dedup reports the embeddings skipped
+
+FILE TYPES (EXTRACTORS registry):
+  - pdf   → triage + tier cascade above           (780 s limit)
+  - image → downscale/re-encode, Gemini vision    (120 s limit)
+  - video → Gemini File API transcript            (600 s limit)
+  - anything else fails fast with PermanentIngestionError (no Celery retry)
+
+ARTIFACTS (services/artifacts.py):
+  - Extracted text is saved gzip-compressed per file_id + method once extraction succeeds
+  - Celery retries, /retry and /reindex start from it; /retry?reextract=true extracts again
+
 CELERY TASK:
+  - process_file_task queues extract → chunk → embed/index → finalize as separate
+    tasks on per-stage queues (services/ingestion_canvas.py); INGESTION_CANVAS=0
+    runs the streaming pipeline above inside the one task instead
+  - Each running unit holds a heartbeated lease (services/leases.py); files whose
+    worker died are requeued by the lease sweeper instead of staying "processing"
   - Retries up to 3 times if any tier fails (Celery-level retry, not just tier retry)
   - Hard time limit: 15 minutes per task
   - Uses the INGESTION key pool (never touches ROUTER or CHAT pools)
@@ -30,40 +69,83 @@ from __future__ import annotations
 
 import asyncio
 import logging
+import os
+import re
+import tempfile
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from functools import partial
 from pathlib import Path
+from typing import Any, Awaitable, Callable, Iterator, Optional
 
 from dotenv import load_dotenv
 from google import genai
 
+from core import worker_loop
 from core.celery_app import celery_app
 from core.llm_router import (
     INGESTION_MODEL_CHAIN,
     call_gemini_with_fallback,
     ingestion_key_manager,
 )
-from core.websocket import manager
-from database.chroma import get_chroma_collection
+from api.services import artifacts, pdf_text
+from api.services.chunker import CHUNK_TOKENS, CHUNKER_VERSION, Chunk, MarkdownChunker
+from api.services.content_refs import notify_file
+from api.services.embedding import AdaptiveEmbedder
+from api.services.leases import LeaseLostError, hold_lease, lease_lost
+from api.services.near_dup import (
+    ChunkDeduper, dedup_stats, embed_with_reuse, load_classroom_index, save_fingerprints,
+)
+from database.chroma import active_index, get_collection, index_of
 from database.mongo import get_db
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
-EMBED_MODEL = "models/gemini-embedding-001"
-CHUNK_SIZE = 800
-CHUNK_OVERLAP = 100
-EMBED_BATCH_SIZE = 50   # Reduced from 100 to reduce 429 risk
+EMBED_BATCH_SIZE = 50   # Starting batch size; AdaptiveEmbedder tunes it per run
+PIPELINE_QUEUE_SIZE = 4     # Max items buffered between two pipeline stages
+SECTION_MAX_CHARS = 20_000  # Upper bound on one extracted section fed to the chunker
+PROGRESS_INTERVAL_S = 2.0   # Min gap between indexing-progress writes / WebSocket events
+PDF_STREAM_PAGES = os.getenv("INGESTION_STREAM_PAGES", "1") != "0"  # Stream text-native PDFs page by page
+INGESTION_CANVAS = os.getenv("INGESTION_CANVAS", "1") != "0"  # Per-stage Celery tasks (see CELERY TASK)
+
+_PAGE_MARKER_RE = re.compile(r"(?m)^(?=\[Page \d+\])")
+_HEADING_RE = re.compile(r"(?m)^(?=#{1,3} )")
+_PAGE_NUMBER_RE = re.compile(r"\s*\[Page (\d+)\]")
 
 
 # ══════════════════════════════════════════════════════════════════════
 # TIER 1: Gemini File API
 # ══════════════════════════════════════════════════════════════════════
 
-async def _extract_with_gemini(file_path: str) -> str:
+GEMINI_EXTRACTION_PROMPT = (
+    "You are a precise document parser. Extract ALL content from this document:\n"
+    "1. Text: Preserve the reading order and section hierarchy\n"
+    "2. Tables: Convert to clean Markdown table format\n"
+    "3. Mathematical equations: Render in LaTeX format ($...$ inline, $$...$$ block)\n"
+    "4. Diagrams/Figures: Provide a brief textual description in [Figure: ...] brackets\n"
+    "5. Code: Wrap in ```language ... ``` blocks\n\n"
+    "Output ONLY the extracted content. No preamble, no explanations."
+)
+GEMINI_PAGE_MARKER_PROMPT = (
+    "\n\nThis PDF contains pages {first} to {last} of the document. "
+    "Start the content of every page with a line of the form [Page N], "
+    "numbering pages from {first}."
+)
+
+GEMINI_PAGES_PER_RANGE = 10     # Pages per Gemini call; keeps output under the token limit
+GEMINI_RANGE_ATTEMPTS = 2       # Per-range attempts (each on a fresh key) before local fallback
+GEMINI_FILE_POLL_S = 2          # Poll interval while the File API processes a video
+
+
+async def _gemini_extract_file(file_path: str, prompt: str, wait_active: bool = False) -> str:
     """
-    Upload file to Gemini File API and extract rich text (tables, equations, diagrams).
-    Uses INGESTION key pool with INGESTION_MODEL_CHAIN and key rotation.
+    Upload one file to the Gemini File API and extract it with the INGESTION model chain.
+    wait_active polls until the File API has finished processing the upload (videos).
     """
     client, key = ingestion_key_manager.get_client()
     logger.info("[Tier 1] Uploading %s to Gemini File API...", file_path)
@@ -76,19 +158,16 @@ async def _extract_with_gemini(file_path: str) -> str:
         gemini_file = await asyncio.to_thread(_upload)
     except Exception as e:
         logger.error("[Tier 1] Upload failed: %s", e)
+        if "429" in str(e) or "RESOURCE_EXHAUSTED" in str(e):
+            ingestion_key_manager.mark_unhealthy(key)
         raise
 
     try:
-        logger.info("[Tier 1] Extracting content via model chain: %s", INGESTION_MODEL_CHAIN)
-        prompt = (
-            "You are a precise document parser. Extract ALL content from this document:\n"
-            "1. Text: Preserve the reading order and section hierarchy\n"
-            "2. Tables: Convert to clean Markdown table format\n"
-            "3. Mathematical equations: Render in LaTeX format ($...$ inline, $$...$$ block)\n"
-            "4. Diagrams/Figures: Provide a brief textual description in [Figure: ...] brackets\n"
-            "5. Code: Wrap in ```language ... ``` blocks\n\n"
-            "Output ONLY the extracted content. No preamble, no explanations."
-        )
+        while wait_active and getattr(gemini_file.state, "name", "ACTIVE") == "PROCESSING":
+            await asyncio.sleep(GEMINI_FILE_POLL_S)
+            gemini_file = await asyncio.to_thread(client.files.get, name=gemini_file.name)
+        if getattr(gemini_file.state, "name", "ACTIVE") == "FAILED":
+            raise RuntimeError(f"Gemini could not process {Path(file_path).name}")
 
         response = await call_gemini_with_fallback(
             model_chain=INGESTION_MODEL_CHAIN,
@@ -100,8 +179,6 @@ async def _extract_with_gemini(file_path: str) -> str:
         text = response.text
         if not text or not text.strip():
             raise RuntimeError("Gemini returned empty text for this file")
-
-        logger.info("[Tier 1] Extraction successful: %d characters", len(text))
         return text
 
     finally:
@@ -114,22 +191,214 @@ async def _extract_with_gemini(file_path: str) -> str:
         await asyncio.to_thread(_delete)
 
 
+def _write_page_range(file_path: str, first: int, last: int, out_path: str) -> None:
+    """Copy 1-based pages first..last of a PDF into a new file."""
+    import fitz  # PyMuPDF
+    with fitz.open(file_path) as src, fitz.open() as dst:
+        dst.insert_pdf(src, from_page=first - 1, to_page=last - 1)
+        dst.save(out_path)
+
+
+async def _extract_gemini_range(file_path: str, first: int, last: int, workdir: str) -> str:
+    """Extract one page range via Gemini, retrying on a fresh key. Raises if all attempts fail."""
+    range_path = str(Path(workdir) / f"pages_{first}_{last}.pdf")
+    await asyncio.to_thread(_write_page_range, file_path, first, last, range_path)
+    prompt = GEMINI_EXTRACTION_PROMPT + GEMINI_PAGE_MARKER_PROMPT.format(first=first, last=last)
+
+    last_error: Optional[Exception] = None
+    for attempt in range(GEMINI_RANGE_ATTEMPTS):
+        try:
+            text = await _gemini_extract_file(range_path, prompt)
+            if not _PAGE_MARKER_RE.search(text):
+                text = f"[Page {first}]\n{text}"
+            return text
+        except Exception as e:
+            last_error = e
+            logger.warning("[Tier 1] Pages %d-%d attempt %d/%d failed: %s",
+                           first, last, attempt + 1, GEMINI_RANGE_ATTEMPTS, str(e)[:200])
+    raise RuntimeError(f"Pages {first}-{last}: {last_error}")
+
+
+async def _extract_range_locally(file_path: str, first: int, last: int, workdir: str) -> str:
+    """Lower-tier fallback for a single failed range: Docling on the range, then PyMuPDF."""
+    range_path = str(Path(workdir) / f"pages_{first}_{last}.pdf")
+    try:
+        text = await _extract_with_docling(range_path, page_offset=first - 1)
+        if not _PAGE_MARKER_RE.search(text):
+            text = f"[Page {first}]\n{text}"
+        return text
+    except Exception as e:
+        logger.warning("[Tier 1] Docling fallback for pages %d-%d failed: %s", first, last, e)
+    pages = await asyncio.to_thread(pdf_text.extract_pages, file_path, first, last)
+    return "\n\n".join(f"[Page {num}]\n{text}" for num, text in pages)
+
+
+async def _extract_with_gemini(file_path: str) -> tuple[str, str]:
+    """
+    Extract rich text (tables, equations, diagrams) via the Gemini File API.
+
+    PDFs longer than GEMINI_PAGES_PER_RANGE are split into page ranges with
+    PyMuPDF and extracted concurrently (one range in flight per INGESTION key),
+    then stitched in page order. A range that keeps failing drops to Docling /
+    PyMuPDF on its own; only if every range fails does the whole tier fail.
+
+    Returns (text, method) where method is "gemini", or "gemini_mixed" when
+    some ranges came from a lower tier.
+    """
+    logger.info("[Tier 1] Extracting content via model chain: %s", INGESTION_MODEL_CHAIN)
+
+    is_pdf = file_path.lower().endswith(".pdf")
+    page_count = await asyncio.to_thread(pdf_text.page_count, file_path) if is_pdf else 0
+    if page_count <= GEMINI_PAGES_PER_RANGE:
+        # PDFs are asked for [Page N] markers too, so their chunks carry page numbers
+        prompt = GEMINI_EXTRACTION_PROMPT
+        if is_pdf:
+            prompt += GEMINI_PAGE_MARKER_PROMPT.format(first=1, last=page_count)
+        text = await _gemini_extract_file(file_path, prompt)
+        if is_pdf and not _PAGE_MARKER_RE.search(text):
+            text = f"[Page 1]\n{text}"
+        logger.info("[Tier 1] Extraction successful: %d characters", len(text))
+        return text, "gemini"
+
+    ranges = [
+        (first, min(first + GEMINI_PAGES_PER_RANGE - 1, page_count))
+        for first in range(1, page_count + 1, GEMINI_PAGES_PER_RANGE)
+    ]
+    concurrency = max(1, len(ingestion_key_manager.healthy_keys()))
+    semaphore = asyncio.Semaphore(concurrency)
+    logger.info("[Tier 1] %d pages → %d ranges, %d concurrent",
+                page_count, len(ranges), concurrency)
+
+    with tempfile.TemporaryDirectory(prefix="gemini_ranges_") as workdir:
+        async def _one(first: int, last: int) -> Optional[str]:
+            async with semaphore:
+                try:
+                    return await _extract_gemini_range(file_path, first, last, workdir)
+                except Exception as e:
+                    logger.warning("[Tier 1] Range %d-%d failed: %s", first, last, e)
+                    return None
+
+        results = await asyncio.gather(*(_one(first, last) for first, last in ranges))
+
+        failed = [r for r, text in zip(ranges, results) if text is None]
+        if len(failed) == len(ranges):
+            raise RuntimeError(f"All {len(ranges)} page ranges failed in Gemini")
+
+        for idx, (first, last) in enumerate(ranges):
+            if results[idx] is None:
+                logger.warning("[Tier 1] Falling back to local extraction for pages %d-%d", first, last)
+                results[idx] = await _extract_range_locally(file_path, first, last, workdir)
+
+    text = "\n\n".join(results)
+    method = "gemini_mixed" if failed else "gemini"
+    logger.info("[Tier 1] Extraction successful: %d characters (%d/%d ranges via fallback)",
+                len(text), len(failed), len(ranges))
+    return text, method
+
+
 # ══════════════════════════════════════════════════════════════════════
 # TIER 2: Docling (local, free, structured)
 # ══════════════════════════════════════════════════════════════════════
 
-async def _extract_with_docling(file_path: str) -> str:
+# Speed profiles: (do_ocr, do_table_structure). Chosen per document by
+# _choose_docling_profile — OCR is only worth its cost on scanned pages.
+DOCLING_PROFILES: dict[str, tuple[bool, bool]] = {
+    "full": (True, True),    # Scanned / mixed PDFs
+    "text": (False, True),   # Text-native PDFs with tables
+    "fast": (False, False),  # Text-native PDFs, no tables detected
+}
+DOCLING_TEXT_NATIVE_RATIO = 0.9        # Share of sampled pages that must have a text layer
+
+# One converter per profile, built once per worker process (see warm_docling)
+_docling_converters: dict[str, Any] = {}
+_docling_lock = threading.Lock()
+
+
+def _build_docling_converter(profile: str):
+    from docling.datamodel.base_models import InputFormat
+    from docling.datamodel.pipeline_options import PdfPipelineOptions
+    from docling.document_converter import DocumentConverter, PdfFormatOption
+
+    do_ocr, do_tables = DOCLING_PROFILES[profile]
+    options = PdfPipelineOptions()
+    options.do_ocr = do_ocr
+    options.do_table_structure = do_tables
+    converter = DocumentConverter(
+        format_options={InputFormat.PDF: PdfFormatOption(pipeline_options=options)},
+    )
+    # Load layout/table/OCR models now instead of on the first convert()
+    converter.initialize_pipeline(InputFormat.PDF)
+    return converter
+
+
+def get_docling_converter(profile: str):
+    """Return the process-wide converter for a profile, building it on first use."""
+    with _docling_lock:
+        converter = _docling_converters.get(profile)
+        if converter is None:
+            t0 = time.time()
+            converter = _build_docling_converter(profile)
+            _docling_converters[profile] = converter
+            logger.info("[Tier 2] Docling '%s' converter ready in %.1fs", profile, time.time() - t0)
+        return converter
+
+
+def warm_docling(profiles: Optional[list[str]] = None) -> dict[str, float]:
+    """
+    Build and pre-load Docling converters. Called once per worker process at
+    startup so the first document does not pay the model-loading cost.
+    Returns the cold build time per profile in seconds.
+    """
+    timings: dict[str, float] = {}
+    for profile in profiles or list(DOCLING_PROFILES):
+        t0 = time.time()
+        try:
+            get_docling_converter(profile)
+        except ImportError:
+            logger.warning("[Tier 2] Docling not installed — skipping pre-warm")
+            break
+        timings[profile] = round(time.time() - t0, 2)
+    if timings:
+        logger.info("[Tier 2] Docling pre-warm complete: %s", timings)
+    return timings
+
+
+def _docling_profile_for(stats: dict) -> str:
+    """Pick the cheapest Docling profile from pdf_text.analyze_pdf() statistics."""
+    if not stats.get("page_count") or stats["text_coverage"] < DOCLING_TEXT_NATIVE_RATIO:
+        return "full"
+    return "text" if stats["table_pages"] else "fast"
+
+
+def _choose_docling_profile(file_path: str) -> str:
+    try:
+        return _docling_profile_for(pdf_text.analyze_pdf(file_path))
+    except Exception as e:
+        logger.warning("[Tier 2] Profile detection failed (%s) — using 'full'", e)
+        return "full"
+
+
+async def _extract_with_docling(file_path: str, profile: Optional[str] = None, page_offset: int = 0) -> str:
     """
     Extract text using Docling (local). Handles structured PDFs with tables.
-    Runs in a thread to avoid blocking the async event loop.
+    Reuses the worker's pre-warmed converter and runs in a thread to avoid
+    blocking the async event loop. Each page is exported on its own behind a
+    [Page N] marker so page numbers reach chunk metadata; page_offset shifts
+    them when file_path holds a page range cut from a longer document.
     """
-    logger.info("[Tier 2] Extracting with Docling: %s", file_path)
+    if profile is None:
+        profile = await asyncio.to_thread(_choose_docling_profile, file_path)
+    logger.info("[Tier 2] Extracting with Docling (profile=%s): %s", profile, file_path)
 
     def _run_docling() -> str:
-        from docling.document_converter import DocumentConverter
-        converter = DocumentConverter()
-        result = converter.convert(file_path)
-        return result.document.export_to_markdown()
+        converter = get_docling_converter(profile)
+        document = converter.convert(file_path).document
+        if not document.pages:
+            return document.export_to_markdown()
+        return "\n\n".join(
+            f"[Page {page_no + page_offset}]\n{document.export_to_markdown(page_no=page_no)}"
+            for page_no in sorted(document.pages)
+        )
 
     try:
         text = await asyncio.to_thread(_run_docling)
@@ -152,19 +421,14 @@ async def _extract_with_pymupdf(file_path: str) -> str:
     """
     Last-resort text extraction using PyMuPDF (fitz).
     No table or image understanding — plain text only.
+    Long documents are split across a process pool (see services/pdf_text.py);
+    every page keeps its [Page N] marker so page numbers reach chunk metadata.
     """
     logger.warning("[Tier 3] Using PyMuPDF (text-only). Tables/images may be missing: %s", file_path)
 
     def _run_pymupdf() -> str:
-        import fitz  # PyMuPDF
-        doc = fitz.open(file_path)
-        pages = []
-        for page_num, page in enumerate(doc, 1):
-            page_text = page.get_text("text")
-            if page_text.strip():
-                pages.append(f"[Page {page_num}]\n{page_text}")
-        doc.close()
-        return "\n\n".join(pages)
+        pages = pdf_text.extract_pages_parallel(file_path)
+        return "\n\n".join(f"[Page {page_num}]\n{page_text}" for page_num, page_text in pages)
 
     try:
         text = await asyncio.to_thread(_run_pymupdf)
@@ -180,58 +444,619 @@ async def _extract_with_pymupdf(file_path: str) -> str:
 
 
 # ══════════════════════════════════════════════════════════════════════
-# Orchestrator: Try all 3 tiers in order
+# Triage: pick the cheapest tier that meets quality
+# ══════════════════════════════════════════════════════════════════════
+
+TIER_ORDER = ["gemini", "docling", "pymupdf"]
+
+TRIAGE_ENABLED = os.getenv("INGESTION_TRIAGE", "1") != "0"
+TRIAGE_TEXT_COVERAGE = 0.9      # Below this share of text-layer pages → scanned → Gemini
+TRIAGE_MAX_IMAGE_AREA = 0.3     # Above this mean image coverage → diagram-heavy → Gemini
+
+
+def _triage_document(file_path: str, file_type: str) -> dict:
+    """
+    Decide which tier to start with, using cheap PyMuPDF statistics.
+
+      scanned or image-heavy       → gemini  (needs vision)
+      text-native with tables      → docling (profile "text", no OCR)
+      text-native, plain text      → pymupdf (milliseconds, no quota)
+
+    Returns {"tier", "reason", "stats", "elapsed_s"}; stored in processing.triage.
+    """
+    t0 = time.time()
+    stats: dict = {}
+    if not TRIAGE_ENABLED:
+        tier, reason = "gemini", "triage disabled"
+    elif file_type != "pdf":
+        tier, reason = "gemini", f"{file_type} needs multimodal extraction"
+    else:
+        try:
+            stats = pdf_text.analyze_pdf(file_path)
+        except Exception as e:
+            logger.warning("[Triage] Analysis failed (%s) — defaulting to Gemini", e)
+            stats = {}
+        if not stats.get("page_count"):
+            tier, reason = "gemini", "could not analyse PDF"
+        elif stats["text_coverage"] < TRIAGE_TEXT_COVERAGE:
+            tier, reason = "gemini", f"text layer on {stats['text_coverage']:.0%} of pages (scanned)"
+        elif stats["image_area_ratio"] > TRIAGE_MAX_IMAGE_AREA:
+            tier, reason = "gemini", f"images cover {stats['image_area_ratio']:.0%} of page area"
+        elif stats["table_pages"]:
+            tier, reason = "docling", f"tables on {stats['table_pages']} sampled pages"
+        else:
+            tier, reason = "pymupdf", "text-native, no tables or significant images"
+
+    decision = {"tier": tier, "reason": reason, "stats": stats, "elapsed_s": round(time.time() - t0, 3)}
+    logger.info("[Triage] %s → %s (%s)", file_path, tier, reason)
+    return decision
+
+
+# ══════════════════════════════════════════════════════════════════════
+# Orchestrator: Try tiers in order, starting from the triaged one
 # ══════════════════════════════════════════════════════════════════════
 
-async def _extract_text_tiered(file_path: str, file_type: str) -> tuple[str, str]:
+async def _extract_text_tiered(
+    file_path: str,
+    file_type: str,
+    triage: Optional[dict] = None,
+    timings: Optional[dict] = None,
+) -> tuple[str, str]:
     """
     Try extraction tiers in order. Returns (extracted_text, method_used).
 
-    method_used is one of: "gemini", "docling", "pymupdf_text_only"
-    If pymupdf_text_only, the caller should flag the content in metadata.
+    With a triage decision, the triaged tier is tried first and the remaining
+    tiers keep their usual order as fallbacks. Per-tier wall time is written
+    into `timings` when given.
+
+    method_used is one of: "gemini", "gemini_mixed", "docling", "pymupdf",
+    "pymupdf_text_only". "pymupdf" means triage judged the text layer complete;
+    "pymupdf_text_only" means Tier 3 was a last resort and the caller should
+    flag the content in metadata.
     """
+    start = (triage or {}).get("tier", TIER_ORDER[0])
+    order = [start] + [t for t in TIER_ORDER if t != start]
+    docling_profile = _docling_profile_for(triage["stats"]) if triage and triage.get("stats") else None
+    timings = timings if timings is not None else {}
     errors: list[str] = []
 
-    # Tier 1 — Gemini File API (best quality, multimodal)
-    if ingestion_key_manager.has_keys:
+    for tier in order:
+        t0 = time.time()
         try:
-            text = await _extract_with_gemini(file_path)
-            return text, "gemini"
+            if tier == "gemini":
+                # Tier 1 — Gemini File API (best quality, multimodal)
+                if not ingestion_key_manager.has_keys:
+                    logger.warning("[Extraction] Skipping Tier 1 — no INGESTION keys configured")
+                    errors.append("Tier 1 (Gemini): No API keys configured")
+                    continue
+                return await _extract_with_gemini(file_path)
+
+            if tier == "docling":
+                # Tier 2 — Docling (local, handles tables)
+                text = await _extract_with_docling(file_path, profile=docling_profile)
+                return text, "docling"
+
+            # Tier 3 — PyMuPDF (text-only)
+            text = await _extract_with_pymupdf(file_path)
+            return text, "pymupdf" if tier == start else "pymupdf_text_only"
+
         except Exception as e:
-            logger.warning("[Extraction] Tier 1 (Gemini) failed: %s. Trying Tier 2...", e)
-            errors.append(f"Tier 1 (Gemini): {e}")
+            logger.warning("[Extraction] Tier %s failed: %s. Trying next tier...", tier, e)
+            errors.append(f"Tier {TIER_ORDER.index(tier) + 1} ({tier}): {e}")
+        finally:
+            timings[tier] = round(time.time() - t0, 2)
+
+    # All tiers failed
+    raise RuntimeError(
+        f"All extraction tiers failed for {file_path}:\n" + "\n".join(errors)
+    )
+
+
+# ══════════════════════════════════════════════════════════════════════
+# Extractor registry: one extraction strategy per file_type
+# ══════════════════════════════════════════════════════════════════════
+
+@dataclass
+class _IngestionRun:
+    """Shared state for one pass of the pipeline over a single file."""
+
+    file_id: str
+    base_metadata: dict
+    extraction_method: Optional[str] = None
+    triage: Optional[dict] = None
+    extraction_timings: dict = field(default_factory=dict)
+    artifact: Optional[dict] = None         # processing.artifact pointer to resume from
+    index: dict = field(default_factory=active_index)  # Index version (collection, model, chunking) written to
+    resumed_from_artifact: bool = False
+    chunk_count: int = 0
+    upserted_count: int = 0
+    deduper: ChunkDeduper = field(default_factory=ChunkDeduper)
+    reused_count: int = 0                   # Chunks that took a classroom near-duplicate's vector
+    resume_after: int = 0                   # Chunks already indexed by an earlier attempt
+    indexed_chunks: int = 0                 # Watermark: chunks 1..N are all in ChromaDB
+    indexed_pages: int = 0                  # Page of the last chunk under the watermark
+    stored_ahead: dict = field(default_factory=dict)  # chunk_index → page, upserted past the watermark
+    t_progress: float = 0.0
+    t_start: float = field(default_factory=time.time)
+    t_extract: Optional[float] = None
+    t_first_upsert: Optional[float] = None
+
+
+class PermanentIngestionError(Exception):
+    """A failure that retrying cannot fix (e.g. unsupported file type). Celery does not retry it."""
+
+
+IMAGE_MAX_SIDE = 2048           # Longest edge sent to Gemini; larger adds tokens, not detail
+IMAGE_JPEG_QUALITY = 85
+
+GEMINI_IMAGE_PROMPT = (
+    "You are a precise document parser. This is an image from course material "
+    "(slide, whiteboard, handwritten notes, diagram or scanned page). Extract ALL of it:\n"
+    "1. Text: Transcribe in reading order, preserving headings and lists\n"
+    "2. Tables: Convert to clean Markdown table format\n"
+    "3. Mathematical equations: Render in LaTeX format ($...$ inline, $$...$$ block)\n"
+    "4. Diagrams/Figures: Describe structure and labels in [Figure: ...] brackets\n\n"
+    "Output ONLY the extracted content. No preamble, no explanations."
+)
+GEMINI_VIDEO_PROMPT = (
+    "You are transcribing a recorded lecture for a study knowledge base. Produce:\n"
+    "1. A faithful transcript of the spoken content, grouped into paragraphs, each "
+    "starting with a [mm:ss] timestamp\n"
+    "2. Any text, equations (LaTeX) or diagrams shown on screen, described where they appear\n\n"
+    "Output ONLY the transcript. No preamble, no explanations."
+)
+
+
+def _prepare_image(src_path: str, out_dir: str) -> str:
+    """Downscale to IMAGE_MAX_SIDE and re-encode as JPEG; returns the new path."""
+    from PIL import Image, ImageOps
+
+    out_path = str(Path(out_dir) / f"{Path(src_path).stem}.jpg")
+    with Image.open(src_path) as img:
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((IMAGE_MAX_SIDE, IMAGE_MAX_SIDE))
+        if img.mode in ("RGBA", "LA", "P"):
+            img = img.convert("RGBA")
+            flat = Image.new("RGB", img.size, (255, 255, 255))
+            flat.paste(img, mask=img.getchannel("A"))
+            img = flat
+        elif img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.save(out_path, "JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+    return out_path
+
+
+def _require_gemini(file_type: str) -> None:
+    if not ingestion_key_manager.has_keys:
+        raise PermanentIngestionError(
+            f"{file_type} files need Gemini extraction but no INGESTION keys are configured"
+        )
+
+
+async def _extract_pdf(run: _IngestionRun, file_path: str) -> tuple[str, str]:
+    """PDFs: triage (unless the caller already did), then the tier cascade."""
+    if run.triage is None:
+        run.triage = await asyncio.to_thread(_triage_document, file_path, "pdf")
+    return await _extract_text_tiered(
+        file_path, "pdf", triage=run.triage, timings=run.extraction_timings,
+    )
+
+
+async def _extract_image(run: _IngestionRun, file_path: str) -> tuple[str, str]:
+    """Images: downscale + re-encode locally, then a single Gemini vision call."""
+    _require_gemini("image")
+    t0 = time.time()
+    with tempfile.TemporaryDirectory(prefix="img_") as workdir:
+        prepared = await asyncio.to_thread(_prepare_image, file_path, workdir)
+        logger.info("[Image] Re-encoded %s: %d → %d bytes", Path(file_path).name,
+                    Path(file_path).stat().st_size, Path(prepared).stat().st_size)
+        text = await _gemini_extract_file(prepared, GEMINI_IMAGE_PROMPT)
+    run.extraction_timings["gemini"] = round(time.time() - t0, 2)
+    return text, "gemini"
+
+
+async def _extract_video(run: _IngestionRun, file_path: str) -> tuple[str, str]:
+    """Videos: Gemini File API transcription (no local tier can read video)."""
+    _require_gemini("video")
+    t0 = time.time()
+    text = await _gemini_extract_file(file_path, GEMINI_VIDEO_PROMPT, wait_active=True)
+    run.extraction_timings["gemini"] = round(time.time() - t0, 2)
+    return text, "gemini"
+
+
+@dataclass(frozen=True)
+class _Extractor:
+    extract: Callable[[_IngestionRun, str], Awaitable[tuple[str, str]]]
+    time_limit_s: int   # Must stay below the Celery soft_time_limit (840 s)
+
+
+EXTRACTORS: dict[str, _Extractor] = {
+    "pdf": _Extractor(_extract_pdf, time_limit_s=780),
+    "image": _Extractor(_extract_image, time_limit_s=120),
+    "video": _Extractor(_extract_video, time_limit_s=600),
+}
+
+
+def _get_extractor(file_type: str) -> _Extractor:
+    extractor = EXTRACTORS.get(file_type)
+    if extractor is None:
+        raise PermanentIngestionError(f"No extractor for file type '{file_type}'")
+    return extractor
+
+
+# ══════════════════════════════════════════════════════════════════════
+# Streaming pipeline: extract → chunk → embed → upsert
+# ══════════════════════════════════════════════════════════════════════
+#
+# Each stage runs as its own asyncio task connected by bounded queues, so
+# embedding overlaps extraction/chunking and vectors are written to Chroma
+# batch by batch. Only PIPELINE_QUEUE_SIZE items are ever buffered between
+# two stages. Text-native PDFs are also read page by page (_stream_pdf_pages)
+# and vectors travel as float32 arrays, so peak memory stays flat however long
+# the document is (scripts/bench_memory.py).
+
+_DONE = object()  # Sentinel pushed downstream when a stage has drained its input
+
+
+def _iter_sections(full_text: str) -> Iterator[tuple[Optional[int], str]]:
+    """
+    Split extracted text into (page_number, section) units for the chunk stage.
+    Prefers "[Page N]" markers (PDF extractors), then markdown headings
+    (Gemini / Docling without page markers), and finally cuts oversized sections
+    on paragraph boundaries — every cut keeps the page of the marker it follows.
+    Sections are sliced lazily, so only one is copied out of full_text at a time.
+    """
+    if _PAGE_MARKER_RE.search(full_text):
+        boundary = _PAGE_MARKER_RE
+    elif _HEADING_RE.search(full_text):
+        boundary = _HEADING_RE
+    else:
+        boundary = None
+
+    starts = [0] if boundary is None else (m.start() for m in boundary.finditer(full_text))
+    page_number: Optional[int] = None
+    prev = 0
+    for start in starts:
+        if start > prev:
+            page_number = yield from _cut_section(page_number, full_text[prev:start])
+        prev = start
+    yield from _cut_section(page_number, full_text[prev:])
+
+
+def _cut_section(page_number: Optional[int], part: str) -> Iterator[tuple[Optional[int], str]]:
+    """Yield one split part as sections of at most SECTION_MAX_CHARS; returns its page number."""
+    if page_match := _PAGE_NUMBER_RE.match(part):
+        page_number = int(page_match.group(1))
+    while len(part) > SECTION_MAX_CHARS:
+        cut = part.rfind("\n\n", 0, SECTION_MAX_CHARS)
+        if cut <= 0:
+            cut = SECTION_MAX_CHARS
+        yield page_number, part[:cut]
+        part = part[cut:]
+    if part.strip():
+        yield page_number, part
+    return page_number
+
+
+async def _run_extractor(run: _IngestionRun, storage_path: str, file_type: str) -> str:
+    """Run the file type's extractor under its time limit; sets run.extraction_method."""
+    extractor = _get_extractor(file_type)
+    try:
+        full_text, run.extraction_method = await asyncio.wait_for(
+            extractor.extract(run, storage_path), timeout=extractor.time_limit_s,
+        )
+    except asyncio.TimeoutError:
+        raise RuntimeError(f"{file_type} extraction exceeded {extractor.time_limit_s}s")
+    return full_text
+
+
+async def _extract_stage(run: _IngestionRun, storage_path: str, file_type: str,
+                         out_q: asyncio.Queue) -> None:
+    """
+    Stage 1 — produce the document text and stream it as sections.
+    Starts from the stored extraction artifact when there is one; otherwise runs
+    the file type's extractor under its time limit and persists the result.
+    """
+    full_text = await asyncio.to_thread(artifacts.load_extraction, run.artifact)
+    if full_text is not None:
+        run.extraction_method = run.artifact["method"]
+        run.resumed_from_artifact = True
     else:
-        logger.warning("[Extraction] Skipping Tier 1 — no INGESTION keys configured")
-        errors.append("Tier 1 (Gemini): No API keys configured")
+        if run.resume_after:
+            # The stored text is gone, so the indexed chunks cannot be matched to it
+            await asyncio.to_thread(get_collection(run.index["collection"]).delete, where={"file_id": run.file_id})
+            run.resume_after = run.indexed_chunks = run.indexed_pages = 0
+        if file_type == "pdf" and PDF_STREAM_PAGES:
+            if run.triage is None:
+                run.triage = await asyncio.to_thread(_triage_document, storage_path, "pdf")
+            if run.triage["tier"] == "pymupdf" and await _stream_pdf_pages(run, storage_path, out_q):
+                run.t_extract = time.time() - run.t_start
+                logger.info("[ingestion] Streamed pages using pymupdf in %.1fs", run.t_extract)
+                await out_q.put(_DONE)
+                return
+        full_text = await _run_extractor(run, storage_path, file_type)
+        if full_text.strip():
+            await _save_artifact(run, full_text)
+    run.t_extract = time.time() - run.t_start
+    logger.info("[ingestion] Extracted %d chars using %s in %.1fs%s",
+                len(full_text), run.extraction_method, run.t_extract,
+                " (from stored artifact)" if run.resumed_from_artifact else "")
+
+    if not full_text.strip():
+        raise RuntimeError("Extraction returned empty text")
+
+    for page_number, section in _iter_sections(full_text):
+        await out_q.put((page_number, section))
+    await out_q.put(_DONE)
+
+
+async def _stream_pdf_pages(run: _IngestionRun, file_path: str, out_q: asyncio.Queue) -> bool:
+    """
+    Tier 3 for text-native PDFs, streamed: pages go to the chunk stage as the
+    process pool extracts them (pdf_text.iter_pages) and are appended to the
+    artifact on the way, so the full text is never held in memory. Produces the
+    same sections and artifact as _extract_with_pymupdf() + _iter_sections().
+    Returns False, with nothing emitted, if the PDF has no text at all.
+    """
+    pages = pdf_text.iter_pages(file_path)
+    writer: Optional[artifacts.ExtractionWriter] = artifacts.ExtractionWriter(run.file_id, "pymupdf")
+    # One thread owns the generator (and its pool) and the writer; calls must not overlap
+    thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pdf-pages")
+    loop = asyncio.get_running_loop()
+
+    def _next_page() -> Optional[tuple[int, str]]:
+        nonlocal writer
+        page = next(pages, None)
+        if page is None:
+            return None
+        section = f"[Page {page[0]}]\n{page[1]}"
+        if writer is not None:
+            try:
+                writer.write(section)
+            except Exception as e:  # The artifact is an optimisation — never fail the run
+                logger.warning("[ingestion] Could not write extraction artifact: %s", e)
+                writer.abort()
+                writer = None
+        return page[0], section
+
+    def _publish() -> Optional[dict]:
+        nonlocal writer
+        pointer, writer = writer.close() if writer is not None else None, None
+        return pointer
+
+    t0 = time.time()
+    try:
+        page = await loop.run_in_executor(thread, _next_page)
+        if page is None:
+            return False
+        run.extraction_method = "pymupdf"
+        await _record_artifact(run, None)  # Reset the watermark before the first chunk is stored
+        while page is not None:
+            for section in _cut_section(*page):
+                await out_q.put(section)
+            page = await loop.run_in_executor(thread, _next_page)
+        try:
+            pointer = await loop.run_in_executor(thread, _publish)
+            if pointer is not None:
+                await _record_artifact(run, pointer, reset_watermark=False)
+        except Exception as e:
+            logger.warning("[ingestion] Could not save extraction artifact: %s", e)
+        return True
+    finally:
+        thread.submit(lambda: writer is not None and writer.abort())
+        thread.submit(pages.close)
+        thread.shutdown(wait=False)
+        run.extraction_timings["pymupdf"] = round(time.time() - t0, 2)
 
-    # Tier 2 — Docling (local, handles tables)
+
+async def _save_artifact(run: _IngestionRun, full_text: str) -> None:
+    """Persist extracted text so retries and re-indexing skip extraction. Never fails the run."""
     try:
-        text = await _extract_with_docling(file_path)
-        return text, "docling"
+        pointer = await asyncio.to_thread(
+            artifacts.save_extraction, run.file_id, run.extraction_method, full_text,
+        )
+        await _record_artifact(run, pointer)
     except Exception as e:
-        logger.warning("[Extraction] Tier 2 (Docling) failed: %s. Trying Tier 3...", e)
-        errors.append(f"Tier 2 (Docling): {e}")
+        logger.warning("[ingestion] Could not save extraction artifact: %s", e)
+
+
+async def _record_artifact(run: _IngestionRun, pointer: Optional[dict], reset_watermark: bool = True) -> None:
+    """
+    Store a new processing.artifact pointer. A new extraction invalidates any
+    watermark from earlier attempts; a streamed one resets it up front
+    (pointer=None) and sets the pointer once the artifact is complete.
+    """
+    update: dict[str, Any] = {"processing.stage": "indexing"}
+    if pointer is not None:
+        update["processing.artifact"] = pointer
+        logger.info("[ingestion] Saved extraction artifact: %d chars → %d bytes",
+                    pointer["chars"], pointer["bytes"])
+    if reset_watermark:
+        update.update({
+            "processing.indexed_chunks": 0,
+            "processing.indexed_pages": 0,
+            "processing.indexed_batches": [],
+        })
+    await get_db().file_metadata.update_one({"file_id": run.file_id}, {"$set": update})
+
+
+def _base_metadata(doc: dict) -> dict:
+    """ChromaDB metadata shared by every chunk of a file_metadata document."""
+    return {
+        "file_id": doc["file_id"],
+        "file_name": doc.get("original_name", "unknown"),
+        "file_type": doc["file_type"],
+        "classroom_id": doc.get("classroom_id") or "",  # None once detached (content_refs)
+        "doc_type": doc.get("doc_type", ""),
+        "uploaded_by": doc.get("uploaded_by", ""),
+    }
+
+
+def _chunk_record(file_id: str, chunk_index: int, chunk: Chunk) -> dict:
+    """page_number / page_end: the page span the chunk covers."""
+    return {
+        "id": f"{file_id}_c{chunk_index}",
+        "chunk_index": chunk_index,
+        "page_number": chunk.page_start,
+        "page_end": chunk.page_end,
+        "text": chunk.text,
+    }
+
+
+def _chunk_metadata(base_metadata: dict, extraction_method: Optional[str], record: dict) -> dict:
+    meta = {**base_metadata, "extraction_method": extraction_method}
+    if record["page_number"] is not None:  # ChromaDB rejects None values
+        meta["page_number"] = record["page_number"]
+        meta["page_end"] = record.get("page_end") or record["page_number"]
+    if record.get("reuse_of"):
+        meta["near_dup_of"] = record["reuse_of"]
+    return meta
+
+
+async def _chunk_stage(run: _IngestionRun, in_q: asyncio.Queue, out_q: asyncio.Queue) -> None:
+    """
+    Stage 2 — pack sections into chunk records (services/chunker.py) with
+    file-global indices and mark near-duplicates. Chunks up to run.resume_after
+    are fingerprinted (later chunks may alias them) but not re-emitted (already indexed).
+    """
+    chunker = MarkdownChunker(budget=run.index["chunk_tokens"] or CHUNK_TOKENS)  # None: legacy index
 
-    # Tier 3 — PyMuPDF (text-only, last resort)
+    async def _emit(chunks: list[Chunk]) -> None:
+        for chunk in chunks:
+            run.chunk_count += 1
+            record = _chunk_record(run.file_id, run.chunk_count, chunk)
+            run.deduper.check(record)
+            if run.chunk_count <= run.resume_after:
+                continue
+            await out_q.put(record)
+
+    while (item := await in_q.get()) is not _DONE:
+        await _emit(chunker.feed(*item))
+    await _emit(chunker.flush())
+    await out_q.put(_DONE)
+
+
+async def _embed_stage(run: _IngestionRun, embedder: AdaptiveEmbedder, in_q: asyncio.Queue,
+                       out_q: asyncio.Queue) -> None:
+    """
+    Stage 3 — group chunk records into batches and embed them concurrently.
+    Batch size and the number of in-flight batches follow the embedder's AIMD state.
+    Near-duplicates are not embedded: aliases get no vector, reuses take the stored one.
+    """
+    in_flight: set[asyncio.Task] = set()
+
+    async def _dispatch(records: list[dict]) -> None:
+        kept, vectors, reused = await embed_with_reuse(embedder.embed, records, run.index["collection"])
+        run.reused_count += reused
+        await out_q.put((records, kept, vectors))
+
+    async def _wait_for_slot(limit: int) -> None:
+        nonlocal in_flight
+        while len(in_flight) > limit:
+            done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()  # Propagate the first embedding failure
+
+    batch: list[dict] = []
     try:
-        text = await _extract_with_pymupdf(file_path)
-        return text, "pymupdf_text_only"
+        while True:
+            record = await in_q.get()
+            if record is not _DONE:
+                batch.append(record)
+            if batch and (len(batch) >= embedder.batch_size or record is _DONE):
+                await _wait_for_slot(embedder.concurrency - 1)
+                in_flight.add(asyncio.create_task(_dispatch(batch)))
+                batch = []
+            if record is _DONE:
+                break
+        await _wait_for_slot(0)
+    finally:
+        for task in in_flight:
+            task.cancel()
+    await out_q.put(_DONE)
+
+
+async def _upsert_stage(run: _IngestionRun, in_q: asyncio.Queue) -> None:
+    """Stage 4 — write each embedded batch to ChromaDB as soon as it arrives."""
+    collection = get_collection(run.index["collection"])
+    while (item := await in_q.get()) is not _DONE:
+        records, kept, vectors = item
+        if kept:
+            await asyncio.to_thread(
+                collection.upsert,
+                ids=[r["id"] for r in kept],
+                documents=[r["text"] for r in kept],
+                embeddings=vectors,
+                metadatas=[_chunk_metadata(run.base_metadata, run.extraction_method, r) for r in kept],
+            )
+        run.upserted_count += len(kept)
+        if run.t_first_upsert is None:
+            run.t_first_upsert = time.time() - run.t_start
+            logger.info("[ingestion] First %d vectors searchable after %.1fs",
+                        len(records), run.t_first_upsert)
+        # Aliases count as stored: their canonical chunk comes earlier in the file
+        if _advance_watermark(run, records) and time.time() - run.t_progress >= PROGRESS_INTERVAL_S:
+            await _publish_progress(run)
+
+
+def _advance_watermark(run: _IngestionRun, records: list[dict]) -> bool:
+    """
+    Record an upserted batch. Batches finish out of order, so the watermark only
+    moves over a contiguous run of stored chunks. Returns True if it moved.
+    """
+    for r in records:
+        run.stored_ahead[r["chunk_index"]] = r.get("page_end", r["page_number"])
+    before = run.indexed_chunks
+    while run.indexed_chunks + 1 in run.stored_ahead:
+        run.indexed_chunks += 1
+        page = run.stored_ahead.pop(run.indexed_chunks)
+        if page is not None:
+            run.indexed_pages = page
+    return run.indexed_chunks > before
+
+
+async def _publish_progress(run: _IngestionRun) -> None:
+    """Persist the watermark and tell the classroom; the file is queryable from here on."""
+    run.t_progress = time.time()
+    progress = {
+        "processing.status": "partially_ready",
+        "processing.indexed_chunks": run.indexed_chunks,
+        "processing.indexed_pages": run.indexed_pages,
+    }
+    await get_db().file_metadata.update_one({"file_id": run.file_id}, {"$set": progress})
+    try:
+        await notify_file(run.file_id, run.base_metadata["classroom_id"], {
+            "type": "file_progress",
+            "status": "partially_ready",
+            "indexed_chunks": run.indexed_chunks,
+            "indexed_pages": run.indexed_pages,
+        })
     except Exception as e:
-        errors.append(f"Tier 3 (PyMuPDF): {e}")
+        logger.warning("[ingestion] Could not publish progress: %s", e)
 
-    # All tiers failed
-    raise RuntimeError(
-        f"All extraction tiers failed for {file_path}:\n" + "\n".join(errors)
-    )
+
+async def _run_stages(*stages: Awaitable[None]) -> None:
+    """Run pipeline stages concurrently; the first failure cancels the rest and is re-raised."""
+    tasks = [asyncio.ensure_future(stage) for stage in stages]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
 
 
 # ══════════════════════════════════════════════════════════════════════
 # Core async processing logic
 # ══════════════════════════════════════════════════════════════════════
 
-async def _process_file_async(file_id: str) -> None:
-    from langchain_text_splitters import RecursiveCharacterTextSplitter
-
+async def _process_file_async(file_id: str, reextract: bool = False, reindex: bool = False) -> None:
+    """
+    Ingest one file. Reuses the stored extraction artifact (so only chunking,
+    embedding and indexing run again) unless `reextract` is set, and resumes
+    after the indexed-chunk watermark unless `reindex` asks for a fresh index.
+    """
     db = get_db()
 
     # 1. Look up file metadata
@@ -244,161 +1069,165 @@ async def _process_file_async(file_id: str) -> None:
     storage_path = doc["storage_path"]
     file_type = doc["file_type"]
     classroom_id = doc.get("classroom_id", "")
-    doc_type = doc.get("doc_type", "")
     original_name = doc.get("original_name", "unknown")
-    uploaded_by = doc.get("uploaded_by", "")
+    processing = doc.get("processing", {})
+    artifact = None if reextract else processing.get("artifact")
+    index = active_index()
+    # Chunk ids are deterministic for the same text, so a watermark is only valid with its artifact,
+    # the chunker that cut it and the collection it indexed into
+    same_chunks = (
+        artifact
+        and processing.get("chunker") == CHUNKER_VERSION
+        and index_of(processing)["collection"] == index["collection"]
+    )
+    resume_after = (processing.get("indexed_chunks") or 0) if same_chunks and not reindex else 0
 
-    # 2. Mark as processing
+    # 2. Mark as processing (a resumed file stays queryable while it finishes)
     await db.file_metadata.update_one(
         {"file_id": file_id},
-        {"$set": {"processing.status": "processing", "processing.error": None}},
+        {"$set": {
+            "processing.status": "partially_ready" if resume_after else "processing",
+            "processing.stage": "indexing" if artifact else "extracting",
+            "processing.started_at": datetime.now(timezone.utc),
+            "processing.indexed_chunks": resume_after,
+            "processing.indexed_pages": processing.get("indexed_pages", 0) if resume_after else 0,
+            "processing.chunker": CHUNKER_VERSION,
+            "processing.index": index,
+            "processing.error": None,
+        }},
     )
+    await notify_file(file_id, classroom_id)
 
+    run: Optional[_IngestionRun] = None
     try:
-        # 3. Extract text (3-tier cascade)
-        logger.info("[ingestion] Starting extraction for %s (%s)", original_name, file_type)
-        t_start = time.time()
-        full_text, extraction_method = await _extract_text_tiered(storage_path, file_type)
-        t_extract = time.time() - t_start
-        logger.info("[ingestion] Extracted %d chars using %s in %.1fs",
-                    len(full_text), extraction_method, t_extract)
-
-        if not full_text.strip():
-            raise RuntimeError("Extraction returned empty text")
-
-        # 4. Chunk
-        splitter = RecursiveCharacterTextSplitter(
-            chunk_size=CHUNK_SIZE,
-            chunk_overlap=CHUNK_OVERLAP,
+        if not artifact:
+            _get_extractor(file_type)  # Unsupported types fail here, before any work
+
+        # 3. Drop vectors from any earlier attempt — chunk ids are re-issued from 1
+        if resume_after:
+            logger.info("[ingestion] Resuming after %d already-indexed chunks", resume_after)
+        else:
+            collection = get_collection(index["collection"])
+            await asyncio.to_thread(collection.delete, where={"file_id": file_id})
+
+        # 4. Extract → chunk → embed → upsert, streamed through bounded queues
+        logger.info("[ingestion] Starting pipeline for %s (%s)", original_name, file_type)
+        run = _IngestionRun(
+            file_id=file_id,
+            base_metadata=_base_metadata(doc),
+            artifact=artifact,
+            index=index,
+            deduper=ChunkDeduper(await load_classroom_index(doc.get("classroom_id"), file_id)),
+            resume_after=resume_after,
+            indexed_chunks=resume_after,
+            indexed_pages=processing.get("indexed_pages", 0) if resume_after else 0,
         )
-        chunks = splitter.split_text(full_text)
-        if not chunks:
-            raise RuntimeError("Chunking produced zero chunks")
-
-        chunk_records = [
-            {
-                "id": f"{file_id}_c{idx}",
-                "chunk_index": idx,
-                "text": text,
-            }
-            for idx, text in enumerate(chunks, 1)
-        ]
-        logger.info("[ingestion] Produced %d chunks", len(chunk_records))
-
-        # 5. Embed — use INGESTION key pool with retry backoff
-        logger.info("[ingestion] Embedding %d chunks...", len(chunk_records))
-        all_embeddings: list[list[float]] = []
-
-        for batch_start in range(0, len(chunk_records), EMBED_BATCH_SIZE):
-            batch = chunk_records[batch_start: batch_start + EMBED_BATCH_SIZE]
-            batch_texts = [r["text"] for r in batch]
-
-            for attempt in range(5):
-                try:
-                    embed_client, embed_key = ingestion_key_manager.get_client()
-                    resp = await embed_client.aio.models.embed_content(
-                        model=EMBED_MODEL,
-                        contents=batch_texts,
-                        config={"task_type": "RETRIEVAL_DOCUMENT"},
-                    )
-                    for emb in resp.embeddings:
-                        all_embeddings.append(list(emb.values))
-                    break  # Batch success
-
-                except Exception as e:
-                    err = str(e)
-                    if ("429" in err or "RESOURCE_EXHAUSTED" in err) and attempt < 4:
-                        wait = 2 ** (attempt + 1)
-                        logger.warning(
-                            "[ingestion] Embedding 429 (batch %d, attempt %d). Waiting %ds...",
-                            batch_start // EMBED_BATCH_SIZE, attempt + 1, wait,
-                        )
-                        ingestion_key_manager.mark_unhealthy(embed_key, duration=wait * 2)
-                        await asyncio.sleep(wait)
-                        continue
-                    raise RuntimeError(f"Embedding failed after {attempt+1} attempts: {e}")
-
-        if len(all_embeddings) != len(chunk_records):
-            raise RuntimeError(
-                f"Embedding mismatch: got {len(all_embeddings)} embeddings for {len(chunk_records)} chunks"
-            )
-
-        # 6. Store in ChromaDB
-        logger.info("[ingestion] Storing %d vectors in ChromaDB...", len(chunk_records))
-        metadatas = [
-            {
-                "file_id": file_id,
-                "file_name": original_name,
-                "file_type": file_type,
-                "classroom_id": classroom_id,
-                "doc_type": doc_type,
-                "uploaded_by": uploaded_by,
-                "extraction_method": extraction_method,  # Track which tier was used
-            }
-            for _ in chunk_records
-        ]
-
-        collection = get_chroma_collection()
-        collection.upsert(
-            ids=[r["id"] for r in chunk_records],
-            documents=[r["text"] for r in chunk_records],
-            embeddings=all_embeddings,
-            metadatas=metadatas,
+        sections_q: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        chunks_q: asyncio.Queue = asyncio.Queue(maxsize=EMBED_BATCH_SIZE * PIPELINE_QUEUE_SIZE)
+        vectors_q: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        embedder = AdaptiveEmbedder(
+            key_pool=ingestion_key_manager,
+            model=index["embed_model"],
+            task_type="RETRIEVAL_DOCUMENT",
+            initial_batch=EMBED_BATCH_SIZE,
         )
 
-        # 7. Mark complete in MongoDB
-        await db.file_metadata.update_one(
-            {"file_id": file_id},
-            {
-                "$set": {
-                    "processing.status": "completed",
-                    "processing.chunk_count": len(chunk_records),
-                    "processing.extraction_method": extraction_method,
-                    "processing.extraction_warning": (
-                        "Text extracted without table/image understanding. "
-                        "Re-upload may improve quality."
-                        if extraction_method == "pymupdf_text_only" else None
-                    ),
-                    "processing.error": None,
-                }
-            },
+        await _run_stages(
+            _extract_stage(run, storage_path, file_type, sections_q),
+            _chunk_stage(run, sections_q, chunks_q),
+            _embed_stage(run, embedder, chunks_q, vectors_q),
+            _upsert_stage(run, vectors_q),
         )
+
+        if not run.chunk_count:
+            raise RuntimeError("Chunking produced zero chunks")
+
+        extraction_method = run.extraction_method
+        embed_stats = embedder.stats()
+        dedup = dedup_stats(run.chunk_count, run.deduper.aliased, run.reused_count)
+        logger.info("[ingestion] Stored %d vectors in %.1fs (embedding: %s, near-duplicates: %s)",
+                    run.upserted_count, time.time() - run.t_start, embed_stats, dedup)
+        await save_fingerprints(file_id, doc.get("classroom_id"), run.deduper)
+
+        # 5. Mark complete in MongoDB
+        completed = {
+            "processing.status": "completed",
+            "processing.stage": "completed",
+            "processing.recoveries": 0,
+            "processing.completed_at": datetime.now(timezone.utc),
+            "processing.duration_s": round(time.time() - run.t_start, 1),  # Estimator history
+            "processing.chunk_count": run.chunk_count,
+            "processing.indexed_chunks": run.indexed_chunks,
+            "processing.indexed_pages": run.indexed_pages,
+            "processing.extraction_method": extraction_method,
+            "processing.embedding": embed_stats,
+            "processing.dedup": dedup,
+            "processing.resumed_from_artifact": run.resumed_from_artifact,
+            "processing.extraction_warning": _extraction_warning(extraction_method),
+            "processing.error": None,
+        }
+        if not run.resumed_from_artifact:
+            # A resumed run did no extraction — keep the original triage and timings
+            completed["processing.triage"] = run.triage
+            completed["processing.extraction_timings"] = run.extraction_timings
+            if page_count := ((run.triage or {}).get("stats") or {}).get("page_count"):
+                completed["processing.page_count"] = page_count
+        await db.file_metadata.update_one({"file_id": file_id}, {"$set": completed})
         logger.info("[ingestion] ✓ Completed file_id=%s via %s", file_id, extraction_method)
 
-        # 8. Notify frontend via WebSocket
-        await manager.publish_update(classroom_id, {
+        # 6. Notify frontend via WebSocket (and every classroom sharing this file)
+        await notify_file(file_id, classroom_id, {
             "type": "file_processed",
-            "file_id": file_id,
             "status": "ready",
             "extraction_method": extraction_method,
             "warning": "pymupdf_text_only" if extraction_method == "pymupdf_text_only" else None,
         })
 
-    except Exception as exc:
+    except (Exception, asyncio.CancelledError) as exc:  # Cancelled: time limit / shutdown
         logger.exception("[ingestion] ✗ Failed file_id=%s: %s", file_id, exc)
+        await _mark_failed(file_id, exc, run)
+        raise  # Re-raise so Celery can handle retry logic
 
-        await db.file_metadata.update_one(
-            {"file_id": file_id},
-            {
-                "$set": {
-                    "processing.status": "failed",
-                    "processing.error": str(exc)[:500],
-                }
-            },
-        )
 
-        # Notify frontend of failure
-        try:
-            await manager.publish_update(classroom_id, {
-                "type": "file_processed",
-                "file_id": file_id,
-                "status": "failed",
-                "error": str(exc)[:200],
-            })
-        except Exception:
-            pass
+def _extraction_warning(extraction_method: Optional[str]) -> Optional[str]:
+    if extraction_method == "pymupdf_text_only":
+        return "Text extracted without table/image understanding. Re-upload may improve quality."
+    return None
 
-        raise  # Re-raise so Celery can handle retry logic
+
+async def _mark_failed(file_id: str, exc: Exception, run: Optional[_IngestionRun] = None) -> None:
+    """
+    Record a failed attempt and notify the classroom. Whatever was already
+    indexed stays searchable (partially_ready) and a retry resumes after it.
+    Without a run, the watermark already stored in MongoDB decides.
+    A run whose lease was lost records nothing: the sweeper already decided.
+    """
+    if lease_lost():
+        logger.warning("[ingestion] file_id=%s lost its lease — leaving its status to the sweeper", file_id)
+        return
+    db = get_db()
+    doc = await db.file_metadata.find_one({"file_id": file_id}) or {}
+    error = str(exc) or type(exc).__name__
+    failed = {"processing.status": "failed", "processing.error": error[:500]}
+    if run is not None and run.indexed_chunks:
+        failed.update({
+            "processing.status": "partially_ready",
+            "processing.indexed_chunks": run.indexed_chunks,
+            "processing.indexed_pages": run.indexed_pages,
+        })
+    elif run is None and doc.get("processing", {}).get("indexed_chunks"):
+        failed["processing.status"] = "partially_ready"
+    await db.file_metadata.update_one({"file_id": file_id}, {"$set": failed})
+
+    # Notify frontend of failure
+    try:
+        await notify_file(file_id, doc.get("classroom_id"), {
+            "type": "file_processed",
+            "status": failed["processing.status"],
+            "error": error[:200],
+        })
+    except Exception:
+        pass
 
 
 # ══════════════════════════════════════════════════════════════════════
@@ -409,6 +1238,7 @@ async def _process_file_async(file_id: str) -> None:
     name="ingestion.process_file_task",
     # Retry up to 3 times if the task raises any exception
     autoretry_for=(RuntimeError, Exception),
+    dont_autoretry_for=(PermanentIngestionError, LeaseLostError),  # Lost lease: the sweeper requeued it
     retry_kwargs={"max_retries": 3},
     retry_backoff=True,         # Exponential backoff between retries (1s, 2s, 4s)
     retry_backoff_max=120,      # Cap backoff at 2 minutes
@@ -417,19 +1247,31 @@ async def _process_file_async(file_id: str) -> None:
     time_limit=900,             # Hard kill after 15 minutes
     soft_time_limit=840,        # SIGTERM warning at 14 minutes (lets us handle gracefully)
 )
-def process_file_task(file_id: str):
+def process_file_task(file_id: str, reextract: bool = False, reindex: bool = False):
     """
     Celery entry point. Bridges to the async processing logic.
-    Retries up to 3x with exponential backoff on failure.
+    Retries up to 3x with exponential backoff on failure; a retry after the
+    extraction artifact was saved resumes at chunking instead of re-extracting.
+
+    With INGESTION_CANVAS on (default) this only queues the per-stage task
+    chain (services/ingestion_canvas.py); otherwise every stage runs here.
     """
-    async def _run():
-        from database.mongo import connect_db, close_db
-        from database.chroma import connect_chroma
-        await connect_db()
-        connect_chroma()
-        try:
-            await _process_file_async(file_id)
-        finally:
-            await close_db()
+    if INGESTION_CANVAS:
+        from api.services.ingestion_canvas import start_canvas
+        _run_task(partial(start_canvas, file_id, reextract=reextract, reindex=reindex))
+    else:
+        _run_task(partial(
+            _leased, file_id, "pipeline",
+            partial(_process_file_async, file_id, reextract=reextract, reindex=reindex),
+        ))
+
+
+async def _leased(file_id: str, lease_id: str, coro_fn: Callable[[], Awaitable[None]]) -> None:
+    """Run coro_fn while holding a heartbeated ingestion lease (see services/leases.py)."""
+    async with hold_lease(file_id, lease_id):
+        await coro_fn()
+
 
-    asyncio.run(_run())
+def _run_task(coro_fn: Callable[[], Awaitable[None]]) -> None:
+    """Run one Celery task's coroutine on the worker's persistent loop and shared handles."""
+    worker_loop.run(coro_fn)
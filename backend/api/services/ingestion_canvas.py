@@ -0,0 +1,499 @@
+"""
+ingestion_canvas.py — Ingestion as a Celery canvas
+==================================================
+
+process_file_task (ingestion.py) calls start_canvas(), which queues:
+
+  extract ──► chunk ──► chord( embed[b] ──► index[b]  for each batch b ) ──► finalize
+
+QUEUES (declared in core/celery_app.py):
+  ingestion        dispatch, chunking, finalize            (cheap)
+  ingest_extract   Gemini / PyMuPDF / image / video        (mostly waiting on I/O)
+  ingest_docling   PDFs triaged to Docling                 (run with -c 1: model RAM)
+  ingest_embed     Gemini embeddings                       (I/O bound: high concurrency)
+  ingest_index     ChromaDB upserts                        (one process: PersistentClient
+                                                            is not multi-process safe)
+
+BY REFERENCE:
+  - Tasks only receive file_id (+ batch number); nothing bulky crosses the broker
+  - Extraction artifact, chunk manifest and per-batch vectors live under
+    storage/artifacts/<file_id>/ (services/artifacts.py)
+
+PROGRESS / RESUME:
+  - Each index task adds its batch to processing.indexed_batches; the contiguous
+    prefix becomes the indexed_chunks / indexed_pages watermark (file_progress events)
+  - Re-running the canvas for the same extraction skips batches already indexed
+  - Embed stats are stored per batch (processing.embedding_batches.<b>) and
+    summed by finalize, so a redelivered batch is not counted twice
+  - Any stage failing marks the file failed (or partially_ready) like the
+    in-process pipeline; each task retries on its own
+  - Each stage holds its own lease ("extract", "embed:3", ...), so a killed
+    worker is noticed by the lease sweeper
+
+NEAR-DUPLICATES (services/near_dup.py):
+  - chunk marks repeats in the manifest (alias_of / reuse_of); embed skips them
+    and index stores only the chunks that have a vector
+
+PRIORITY:
+  - Every stage task carries the file's processing.priority as its Celery
+    message priority (services/ingestion_queue.py), so interactive files
+    overtake bulk backfills inside each stage queue
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from functools import partial
+from pathlib import Path
+from typing import Awaitable, Callable, Iterator, Optional, TextIO
+
+from celery import chord
+from pymongo import ReturnDocument
+
+from core.celery_app import celery_app
+from core.llm_router import ingestion_key_manager
+from api.services import artifacts, pdf_text
+from api.services.chunker import CHUNK_TOKENS, CHUNKER_VERSION, chunk_sections
+from api.services.content_refs import notify_file
+from api.services.embedding import shared_embedder
+from api.services.ingestion_queue import celery_priority
+from api.services.leases import LeaseLostError, hold_lease
+from api.services.near_dup import ChunkDeduper, dedup_stats, embed_with_reuse, load_classroom_index, save_fingerprints
+from api.services.ingestion import (
+    EMBED_BATCH_SIZE,
+    PDF_STREAM_PAGES,
+    PermanentIngestionError,
+    _PAGE_MARKER_RE,
+    _IngestionRun,
+    _base_metadata,
+    _chunk_metadata,
+    _chunk_record,
+    _cut_section,
+    _extraction_warning,
+    _get_extractor,
+    _iter_sections,
+    _mark_failed,
+    _run_extractor,
+    _run_task,
+    _triage_document,
+)
+from database.chroma import active_index, get_collection, index_of
+from database.mongo import get_db
+
+logger = logging.getLogger(__name__)
+
+CANVAS_BATCH_CHUNKS = 200   # Chunks per embed → index task pair
+
+_STAGE_RETRY = dict(
+    autoretry_for=(Exception,),
+    dont_autoretry_for=(PermanentIngestionError, LeaseLostError),
+    retry_kwargs={"max_retries": 3},
+    retry_backoff=True,
+    retry_backoff_max=120,
+    retry_jitter=True,
+)
+
+
+def _run_stage(file_id: str, lease_id: str, coro_fn: Callable[[], Awaitable[None]]) -> None:
+    """
+    Run one stage under its lease; on failure record it on the file before
+    Celery retries. A lease held elsewhere (duplicate delivery) just retries;
+    a lease lost mid-stage (swept and requeued) stops the stage for good.
+    """
+    async def _guarded():
+        async with hold_lease(file_id, lease_id):
+            try:
+                await coro_fn()
+            except (Exception, asyncio.CancelledError) as exc:  # Cancelled: time limit / shutdown
+                logger.exception("[canvas] ✗ Stage failed for file_id=%s: %s", file_id, exc)
+                await _mark_failed(file_id, exc)
+                raise
+
+    _run_task(_guarded)
+
+
+async def _load_doc(file_id: str) -> dict:
+    doc = await get_db().file_metadata.find_one({"file_id": file_id})
+    if not doc:
+        raise PermanentIngestionError(f"file_id={file_id} not found in database")
+    return doc
+
+
+# ══════════════════════════════════════════════════════════════════════
+# Dispatch
+# ══════════════════════════════════════════════════════════════════════
+
+async def start_canvas(file_id: str, reextract: bool = False, reindex: bool = False) -> None:
+    """
+    Queue the stage chain for one file. A stored extraction (unless `reextract`)
+    starts the chain at chunking; otherwise triage picks the extract queue.
+    """
+    async def _start():
+        doc = await _load_doc(file_id)
+        processing = doc.get("processing", {})
+        artifact = None if reextract else processing.get("artifact")
+        if artifact and not Path(artifact["path"]).exists():
+            artifact = None
+        index = active_index()
+        # Batches indexed into another collection do not carry over
+        reindex_all = reindex or index_of(processing)["collection"] != index["collection"]
+        resuming = bool(artifact and not reindex_all and processing.get("indexed_batches"))
+
+        await get_db().file_metadata.update_one(
+            {"file_id": file_id},
+            {"$set": {
+                "processing.status": "partially_ready" if resuming else "processing",
+                "processing.stage": "indexing" if artifact else "extracting",
+                "processing.started_at": datetime.now(timezone.utc),
+                "processing.resumed_from_artifact": bool(artifact),
+                "processing.index": index,
+                "processing.error": None,
+            }},
+        )
+        await notify_file(file_id, doc.get("classroom_id"))
+
+        priority = celery_priority(processing)
+        flow = chunk_task.si(file_id, reindex=reindex_all).set(priority=priority)
+        if not artifact:
+            _get_extractor(doc["file_type"])  # Unsupported types fail here, before any work
+            triage = await asyncio.to_thread(_triage_document, doc["storage_path"], doc["file_type"])
+            queue = "ingest_docling" if triage["tier"] == "docling" else "ingest_extract"
+            flow = extract_task.si(file_id, triage).set(queue=queue, priority=priority) | flow
+            logger.info("[canvas] %s → %s (%s)", file_id, queue, triage["reason"])
+        flow.apply_async()
+
+    try:
+        await _start()
+    except (Exception, asyncio.CancelledError) as exc:
+        logger.exception("[canvas] ✗ Could not start ingestion for file_id=%s: %s", file_id, exc)
+        await _mark_failed(file_id, exc)
+        raise
+
+
+# ══════════════════════════════════════════════════════════════════════
+# Stage bodies
+# ══════════════════════════════════════════════════════════════════════
+
+def _write_pdf_pages(file_id: str, file_path: str, time_limit_s: Optional[float] = None) -> Optional[dict]:
+    """
+    Tier 3 for text-native PDFs, streamed: pages go from pdf_text.iter_pages()
+    straight into the artifact, so the full text is never held in memory.
+    Writes the same artifact as _extract_with_pymupdf() + save_extraction().
+    Returns its pointer, or None (nothing written) if the PDF has no text at all.
+    """
+    deadline = time.monotonic() + time_limit_s if time_limit_s else None
+    writer = artifacts.ExtractionWriter(file_id, "pymupdf")
+    pages = pdf_text.iter_pages(file_path)
+    has_text = False
+    try:
+        for page_no, text in pages:
+            writer.write(f"[Page {page_no}]\n{text}")
+            has_text = has_text or bool(text.strip())
+            if deadline and time.monotonic() > deadline:
+                raise RuntimeError(f"pdf extraction exceeded {time_limit_s}s")
+    except BaseException:
+        writer.abort()
+        raise
+    finally:
+        pages.close()
+    if not has_text:
+        writer.abort()
+        return None
+    return writer.close()
+
+
+async def _extract(file_id: str, triage: Optional[dict]) -> None:
+    doc = await _load_doc(file_id)
+    run = _IngestionRun(file_id=file_id, base_metadata=_base_metadata(doc), triage=triage)
+    pointer = None
+    if doc["file_type"] == "pdf" and PDF_STREAM_PAGES and (triage or {}).get("tier") == "pymupdf":
+        t0 = time.time()
+        pointer = await asyncio.to_thread(
+            _write_pdf_pages, file_id, doc["storage_path"], _get_extractor("pdf").time_limit_s,
+        )
+        run.extraction_timings["pymupdf"] = round(time.time() - t0, 2)
+        run.extraction_method = "pymupdf"
+    if pointer is None:  # Not a text-native PDF, or no text layer after all: the file type's extractor
+        full_text = await _run_extractor(run, doc["storage_path"], doc["file_type"])
+        if not full_text.strip():
+            raise RuntimeError("Extraction returned empty text")
+        pointer = await asyncio.to_thread(
+            artifacts.save_extraction, file_id, run.extraction_method, full_text,
+        )
+        del full_text
+    await get_db().file_metadata.update_one(
+        {"file_id": file_id},
+        {"$set": {
+            "processing.artifact": pointer,
+            "processing.stage": "indexing",
+            "processing.triage": run.triage,
+            "processing.extraction_timings": run.extraction_timings,
+            "processing.resumed_from_artifact": False,
+            # A new extraction invalidates any watermark from earlier attempts
+            "processing.indexed_chunks": 0,
+            "processing.indexed_pages": 0,
+            "processing.indexed_batches": [],
+        }},
+    )
+    logger.info("[canvas] Extracted %d chars from %s using %s in %.1fs",
+                pointer["chars"], file_id, run.extraction_method, sum(run.extraction_timings.values()))
+
+
+def _iter_artifact_sections(fh: TextIO) -> Iterator[tuple[Optional[int], str]]:
+    """
+    _iter_sections() over an open extraction artifact. Page-marked text (the
+    PDF extractors) is split line by line, one page in memory at a time; other
+    text is read whole, since its section boundaries depend on all of it.
+    """
+    head: list[str] = []
+    for line in fh:
+        head.append(line)
+        if line.strip():
+            break
+    if not (head and _PAGE_MARKER_RE.match(head[-1])):
+        yield from _iter_sections("".join(head) + fh.read())
+        return
+
+    yield from _cut_section(None, "".join(head[:-1]))  # Blank lines before the first marker
+    page_number: Optional[int] = None
+    part = head[-1:]
+    for line in fh:
+        if _PAGE_MARKER_RE.match(line):
+            page_number = yield from _cut_section(page_number, "".join(part))
+            part = []
+        part.append(line)
+    yield from _cut_section(page_number, "".join(part))
+
+
+def _chunk_text(file_id: str, sections: Iterator[tuple[Optional[int], str]],
+                deduper: ChunkDeduper, budget: int) -> Iterator[dict]:
+    """Chunk records in manifest order, marked by the deduper as they are cut."""
+    for index, chunk in enumerate(chunk_sections(sections, budget), start=1):
+        record = _chunk_record(file_id, index, chunk)
+        deduper.check(record)
+        yield record
+
+
+async def _chunk(file_id: str, reindex: bool) -> None:
+    db = get_db()
+    doc = await _load_doc(file_id)
+    processing = doc.get("processing", {})
+    index = index_of(processing)
+    deduper = ChunkDeduper(await load_classroom_index(doc.get("classroom_id"), file_id))
+    fh = await asyncio.to_thread(artifacts.open_extraction, processing.get("artifact"))
+    if fh is None:
+        raise PermanentIngestionError("Stored extraction is missing — retry with reextract=true")
+    budget = index["chunk_tokens"] or CHUNK_TOKENS  # None: the legacy index (database/chroma.py)
+    # The artifact is read as it is chunked and records go straight to the manifest
+    try:
+        chunk_count = await asyncio.to_thread(
+            artifacts.save_chunks, file_id, _chunk_text(file_id, _iter_artifact_sections(fh), deduper, budget),
+            CANVAS_BATCH_CHUNKS,
+        )
+    finally:
+        fh.close()
+    if not chunk_count:
+        raise RuntimeError("Chunking produced zero chunks")
+    await save_fingerprints(file_id, doc.get("classroom_id"), deduper)
+
+    # Chunk ids are deterministic for the same text and chunker, so indexed batches carry over
+    same_chunks = processing.get("chunker") == CHUNKER_VERSION
+    done = set(processing.get("indexed_batches") or []) if same_chunks and not reindex else set()
+    progress = {
+        "processing.chunker": CHUNKER_VERSION,
+        "processing.chunk_count": chunk_count,
+        "processing.stage": "indexing",
+        "processing.dedup.chunks": chunk_count,
+        "processing.dedup.aliased": deduper.aliased,
+    }
+    if not done:
+        await asyncio.to_thread(get_collection(index["collection"]).delete, where={"file_id": file_id})
+        progress.update({
+            "processing.embedding_batches": {},
+            "processing.indexed_chunks": 0,
+            "processing.indexed_pages": 0,
+            "processing.indexed_batches": [],
+        })
+    await db.file_metadata.update_one({"file_id": file_id}, {"$set": progress})
+
+    n_batches = -(-chunk_count // CANVAS_BATCH_CHUNKS)  # ceil division
+    pending = [b for b in range(n_batches) if b not in done]
+    logger.info("[canvas] %s: %d chunks → %d batches (%d already indexed)",
+                file_id, chunk_count, n_batches, n_batches - len(pending))
+    priority = celery_priority(processing)
+    if pending:
+        chord(
+            embed_task.si(file_id, b).set(priority=priority)
+            | index_task.si(file_id, b).set(priority=priority)
+            for b in pending
+        )(finalize_task.si(file_id).set(priority=priority))
+    else:
+        finalize_task.apply_async(args=[file_id], priority=priority)
+
+
+_EMBED_STATS = ("chunks_embedded", "cache_hits", "calls", "rate_limited")
+
+
+def _batch_bounds(batch_no: int) -> tuple[int, int]:
+    return batch_no * CANVAS_BATCH_CHUNKS, (batch_no + 1) * CANVAS_BATCH_CHUNKS
+
+
+async def _embed(file_id: str, batch_no: int) -> None:
+    index = index_of((await _load_doc(file_id)).get("processing", {}))
+    records = await asyncio.to_thread(artifacts.load_chunks, file_id, *_batch_bounds(batch_no))
+    # Shared by every embed task in this worker process: one in-flight request per key overall
+    embedder = shared_embedder(
+        ingestion_key_manager, index["embed_model"], "RETRIEVAL_DOCUMENT", initial_batch=EMBED_BATCH_SIZE,
+    )
+    stats: dict[str, int] = {}
+
+    async def _embed_all(texts: list[str]) -> list[list[float]]:
+        # The embedder holds one in-flight request per healthy key, so this fans out safely
+        size = embedder.batch_size
+        parts = await asyncio.gather(*(
+            embedder.embed(texts[i:i + size], tally=stats) for i in range(0, len(texts), size)
+        ))
+        return [vec for part in parts for vec in part]
+
+    # Vectors of the batch's non-alias chunks, in manifest order (what _index upserts)
+    _, vectors, reused = await embed_with_reuse(_embed_all, records, index["collection"])
+    await asyncio.to_thread(artifacts.save_vectors, file_id, batch_no, vectors)
+
+    # $set per batch, not $inc: a redelivered batch overwrites its own counters instead of adding twice
+    batch_stats = {key: stats.get(key, 0) for key in _EMBED_STATS}
+    batch_stats["reused"] = reused
+    await get_db().file_metadata.update_one(
+        {"file_id": file_id}, {"$set": {f"processing.embedding_batches.{batch_no}": batch_stats}},
+    )
+
+
+async def _index(file_id: str, batch_no: int) -> None:
+    db = get_db()
+    doc = await _load_doc(file_id)
+    processing = doc.get("processing", {})
+    first, last = _batch_bounds(batch_no)
+    records = await asyncio.to_thread(artifacts.load_chunks, file_id, first, last)
+    records = [r for r in records if not r.get("alias_of")]  # Aliases have no vector
+    vectors = await asyncio.to_thread(artifacts.load_vectors, file_id, batch_no)
+
+    base_metadata = _base_metadata(doc)
+    method = (processing.get("artifact") or {}).get("method")
+    if records:
+        await asyncio.to_thread(
+            get_collection(index_of(processing)["collection"]).upsert,
+            ids=[r["id"] for r in records],
+            documents=[r["text"] for r in records],
+            embeddings=vectors,
+            metadatas=[_chunk_metadata(base_metadata, method, r) for r in records],
+        )
+    await asyncio.to_thread(artifacts.delete_vectors, file_id, batch_no)
+
+    # Batches finish out of order; the watermark covers the contiguous prefix only
+    doc = await db.file_metadata.find_one_and_update(
+        {"file_id": file_id},
+        {"$addToSet": {"processing.indexed_batches": batch_no}},
+        return_document=ReturnDocument.AFTER,
+    )
+    done = set(doc["processing"]["indexed_batches"])
+    prefix = 0
+    while prefix in done:
+        prefix += 1
+    indexed_chunks = min(prefix * CANVAS_BATCH_CHUNKS, doc["processing"].get("chunk_count") or 0)
+    if not indexed_chunks:
+        return
+
+    edge = await asyncio.to_thread(artifacts.load_chunks, file_id, indexed_chunks - 1, indexed_chunks)
+    indexed_pages = edge[0].get("page_end", edge[0]["page_number"]) or 0
+    await db.file_metadata.update_one(
+        {"file_id": file_id, "processing.status": {"$ne": "completed"}},
+        {
+            "$set": {"processing.status": "partially_ready"},
+            "$max": {
+                "processing.indexed_chunks": indexed_chunks,
+                "processing.indexed_pages": indexed_pages,
+            },
+        },
+    )
+    try:
+        await notify_file(file_id, doc.get("classroom_id"), {
+            "type": "file_progress",
+            "status": "partially_ready",
+            "indexed_chunks": indexed_chunks,
+            "indexed_pages": indexed_pages,
+        })
+    except Exception as e:
+        logger.warning("[canvas] Could not publish progress: %s", e)
+
+
+async def _finalize(file_id: str) -> None:
+    doc = await _load_doc(file_id)
+    processing = doc.get("processing", {})
+    method = (processing.get("artifact") or {}).get("method")
+    chunk_count = processing.get("chunk_count") or 0
+    batches = (processing.get("embedding_batches") or {}).values()
+    embedding = {key: sum(b.get(key, 0) for b in batches) for key in _EMBED_STATS}
+    reused = sum(b.get("reused", 0) for b in batches)
+    dedup = dedup_stats(chunk_count, (processing.get("dedup") or {}).get("aliased", 0), reused)
+    now = datetime.now(timezone.utc)
+    started_at = processing.get("started_at") or now
+    if started_at.tzinfo is None:  # Motor returns naive UTC datetimes
+        started_at = started_at.replace(tzinfo=timezone.utc)
+
+    completed = {
+        "processing.status": "completed",
+        "processing.stage": "completed",
+        "processing.recoveries": 0,
+        "processing.completed_at": now,
+        "processing.duration_s": round((now - started_at).total_seconds(), 1),  # Estimator history
+        "processing.indexed_chunks": chunk_count,
+        "processing.dedup": dedup,
+        "processing.embedding": embedding,
+        "processing.extraction_method": method,
+        "processing.extraction_warning": _extraction_warning(method),
+        "processing.error": None,
+    }
+    if page_count := ((processing.get("triage") or {}).get("stats") or {}).get("page_count"):
+        completed["processing.page_count"] = page_count
+    await get_db().file_metadata.update_one({"file_id": file_id}, {"$set": completed})
+    await asyncio.to_thread(artifacts.delete_vectors, file_id)
+    logger.info("[canvas] ✓ Completed file_id=%s via %s (%d chunks, %d embeddings skipped as near-duplicates)",
+                file_id, method, chunk_count, dedup["embeddings_skipped"])
+
+    await notify_file(file_id, doc.get("classroom_id"), {
+        "type": "file_processed",
+        "status": "ready",
+        "extraction_method": method,
+        "warning": "pymupdf_text_only" if method == "pymupdf_text_only" else None,
+    })
+
+
+# ══════════════════════════════════════════════════════════════════════
+# Celery tasks (queues: see core/celery_app.py task_routes)
+# ══════════════════════════════════════════════════════════════════════
+
+@celery_app.task(name="ingestion.extract_task", time_limit=900, soft_time_limit=840, **_STAGE_RETRY)
+def extract_task(file_id: str, triage: Optional[dict] = None):
+    _run_stage(file_id, "extract", partial(_extract, file_id, triage))
+
+
+@celery_app.task(name="ingestion.chunk_task", time_limit=300, soft_time_limit=280, **_STAGE_RETRY)
+def chunk_task(file_id: str, reindex: bool = False):
+    _run_stage(file_id, "chunk", partial(_chunk, file_id, reindex))
+
+
+@celery_app.task(name="ingestion.embed_task", time_limit=300, soft_time_limit=280, **_STAGE_RETRY)
+def embed_task(file_id: str, batch_no: int):
+    _run_stage(file_id, f"embed:{batch_no}", partial(_embed, file_id, batch_no))
+
+
+@celery_app.task(name="ingestion.index_task", time_limit=120, soft_time_limit=100, **_STAGE_RETRY)
+def index_task(file_id: str, batch_no: int):
+    _run_stage(file_id, f"index:{batch_no}", partial(_index, file_id, batch_no))
+
+
+@celery_app.task(name="ingestion.finalize_task", time_limit=60, soft_time_limit=50, **_STAGE_RETRY)
+def finalize_task(file_id: str):
+    _run_stage(file_id, "finalize", partial(_finalize, file_id))
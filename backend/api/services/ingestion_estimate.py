@@ -0,0 +1,358 @@
+"""
+ingestion_estimate.py — Pre-flight ingestion estimates + per-classroom daily budgets
+====================================================================================
+
+Before a file is queued, estimate_ingestion() predicts what ingesting it costs:
+
+  pages           PyMuPDF page count (PDFs)
+  tier            the extraction tier triage would start with
+  chunks          text-layer density of the sampled pages (or, for content only
+                  Gemini can read, history) ÷ characters per stored chunk
+  api_calls       Gemini extraction calls + embedding batches, less the share of
+                  chunks near-duplicate detection has been skipping
+  wall_time_s     historical seconds per unit of work for the tier
+  queue_wait_s    files ahead in the admission queue × mean file time ÷ window
+  eta_s           queue_wait_s + wall_time_s
+
+The estimate is stored on the file (processing.estimate) next to the actuals.
+
+HISTORY
+  Rates come from the last HISTORY_FILES completed files (processing.duration_s,
+  page_count, artifact.chars, chunk_count, dedup), per tier: PDFs per page,
+  images per file, videos per MB; runs that started from a stored extraction
+  form the "reindex" rate, per chunk. DEFAULT_* apply until a key has
+  HISTORY_MIN_FILES files. Cached in-process for HISTORY_TTL_S.
+
+DAILY BUDGETS
+  Each classroom may book INGESTION_DAILY_API_CALLS estimated Gemini calls and
+  INGESTION_DAILY_WORKER_MINUTES estimated worker minutes per UTC day
+  (classrooms.ingestion_budget overrides either; 0 = unlimited). charge()
+  books an estimate atomically in ingestion_usage
+    {classroom_id, day, api_calls, worker_minutes, files}
+  and raises BudgetExceeded if it does not fit — the routers answer 429
+  before the file is stored or queued. Shared content (content_refs) and
+  sweeper requeues are never charged.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import os
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from api.services import pdf_text
+from api.services.chunker import CHARS_PER_TOKEN, CHUNK_TOKENS
+from api.services.ingestion_queue import INGESTION_MAX_IN_FLIGHT, files_ahead
+from database.mongo import get_db
+
+logger = logging.getLogger(__name__)
+
+INGESTION_DAILY_API_CALLS = int(os.getenv("INGESTION_DAILY_API_CALLS", "5000"))
+INGESTION_DAILY_WORKER_MINUTES = float(os.getenv("INGESTION_DAILY_WORKER_MINUTES", "240"))
+BUDGET_FIELDS = ("api_calls", "worker_minutes")
+
+HISTORY_FILES = 200             # Most recent completed files the rates are drawn from
+HISTORY_MIN_FILES = 3           # Fewer files than this for a key → defaults
+HISTORY_TTL_S = 300
+
+# Rates until there is history — seconds and extracted characters per unit of work
+DEFAULT_SECONDS_PER_UNIT = {
+    "gemini": 3.0, "docling": 1.5, "pymupdf": 0.05,     # PDFs: per page
+    "image": 10.0, "video": 30.0, "reindex": 0.1,       # per file / per MB / per chunk
+}
+DEFAULT_CHARS_PER_UNIT = {"gemini": 2500, "docling": 2500, "pymupdf": 2500, "image": 1200, "video": 6000}
+DEFAULT_CHARS_PER_CHUNK = CHUNK_TOKENS * CHARS_PER_TOKEN
+DEFAULT_FILE_SECONDS = 60.0
+
+_history: Optional[tuple[float, dict]] = None   # (loaded_at, history)
+
+
+class BudgetExceeded(Exception):
+    """The estimate does not fit in what is left of the classroom's daily budget."""
+
+    def __init__(self, status: dict, estimate: dict) -> None:
+        self.detail = {
+            "message": "Daily ingestion budget exceeded for this classroom — try again tomorrow "
+                       "or ask an administrator to raise it.",
+            "budget": status,
+            "estimate": {f: estimate[f] for f in BUDGET_FIELDS},
+        }
+        super().__init__(self.detail["message"])
+
+
+def _rate_key(file_type: str, tier: str) -> str:
+    return tier if file_type == "pdf" else file_type
+
+
+def _units(file_type: str, pages: Optional[int], size_bytes: int) -> float:
+    """Unit of work the rates are per: pages for PDFs, MB for videos, one per image."""
+    if file_type == "pdf":
+        return float(max(pages or 1, 1))
+    if file_type == "video":
+        return max(size_bytes / 2**20, 0.1)
+    return 1.0
+
+
+# ══════════════════════════════════════════════════════════════════════
+# History
+# ══════════════════════════════════════════════════════════════════════
+
+async def throughput_history() -> dict:
+    """
+    {rates: {key: {seconds_per_unit, chars_per_unit, files}}, chars_per_chunk,
+    skip_ratio, file_seconds, files} from recently completed files.
+    """
+    global _history
+    if _history and time.time() - _history[0] < HISTORY_TTL_S:
+        return _history[1]
+
+    cursor = get_db().file_metadata.find(
+        {
+            "processing.status": "completed",
+            "processing.duration_s": {"$gt": 0},
+            "content_id": {"$exists": False},   # Shared references did no work of their own
+        },
+        {
+            "_id": 0, "file_type": 1, "file_size_bytes": 1,
+            "processing.duration_s": 1, "processing.page_count": 1, "processing.chunk_count": 1,
+            "processing.extraction_method": 1, "processing.artifact.chars": 1,
+            "processing.dedup": 1, "processing.resumed_from_artifact": 1,
+        },
+    ).sort("processing.completed_at", -1).limit(HISTORY_FILES)
+
+    totals: dict[str, dict] = {}
+    chars = chunks = dedup_chunks = skipped = files = 0
+    seconds = 0.0
+    async for doc in cursor:
+        p = doc["processing"]
+        doc_chars = (p.get("artifact") or {}).get("chars") or 0
+        doc_chunks = p.get("chunk_count") or 0
+        if p.get("resumed_from_artifact"):
+            key, units = "reindex", float(doc_chunks)
+        elif doc["file_type"] == "pdf" and not p.get("page_count"):
+            continue  # Completed before page counts were recorded
+        else:
+            tier = (p.get("extraction_method") or "gemini").split("_")[0]
+            key = _rate_key(doc["file_type"], tier)
+            units = _units(doc["file_type"], p.get("page_count"), doc.get("file_size_bytes") or 0)
+        if not units:
+            continue
+        t = totals.setdefault(key, {"seconds": 0.0, "chars": 0, "units": 0.0, "files": 0})
+        t["seconds"] += p["duration_s"]
+        t["chars"] += doc_chars
+        t["units"] += units
+        t["files"] += 1
+        chars += doc_chars
+        chunks += doc_chunks
+        seconds += p["duration_s"]
+        files += 1
+        if dedup := p.get("dedup"):
+            dedup_chunks += dedup.get("chunks") or 0
+            skipped += dedup.get("embeddings_skipped") or 0
+
+    history = {
+        "rates": {
+            key: {
+                "seconds_per_unit": t["seconds"] / t["units"],
+                "chars_per_unit": t["chars"] / t["units"],
+                "files": t["files"],
+            }
+            for key, t in totals.items()
+        },
+        "chars_per_chunk": chars / chunks if chunks and chars else DEFAULT_CHARS_PER_CHUNK,
+        "skip_ratio": min(skipped / dedup_chunks, 0.9) if dedup_chunks else 0.0,
+        "file_seconds": seconds / files if files else DEFAULT_FILE_SECONDS,
+        "files": files,
+    }
+    _history = (time.time(), history)
+    return history
+
+
+def _rate(history: dict, key: str) -> tuple[float, float, str]:
+    """(seconds_per_unit, chars_per_unit, source) for a rate key."""
+    rate = history["rates"].get(key)
+    if rate and rate["files"] >= HISTORY_MIN_FILES:
+        chars = rate["chars_per_unit"] or DEFAULT_CHARS_PER_UNIT.get(key, 0)
+        return rate["seconds_per_unit"], chars, "history"
+    return DEFAULT_SECONDS_PER_UNIT[key], DEFAULT_CHARS_PER_UNIT.get(key, 0), "default"
+
+
+# ══════════════════════════════════════════════════════════════════════
+# Estimates
+# ══════════════════════════════════════════════════════════════════════
+
+def _embed_calls(chunks: int, history: dict) -> int:
+    from api.services.ingestion import EMBED_BATCH_SIZE
+    return math.ceil(chunks * (1 - history["skip_ratio"]) / EMBED_BATCH_SIZE)
+
+
+def estimate_file(file_path: str, file_type: str, size_bytes: int, history: dict) -> dict:
+    """Full-ingestion estimate for a file on disk (blocking: PyMuPDF triage)."""
+    from api.services.ingestion import GEMINI_PAGES_PER_RANGE, _triage_document
+
+    triage = _triage_document(file_path, file_type)
+    stats = triage.get("stats") or {}
+    if file_type == "pdf" and not stats.get("page_count"):
+        try:  # Triage disabled or failed — still count pages
+            stats = pdf_text.analyze_pdf(file_path)
+        except Exception as e:
+            logger.warning("[estimate] Could not analyse %s: %s", file_path, e)
+    pages = stats.get("page_count") or None
+    tier = triage["tier"]
+    key = _rate_key(file_type, tier)
+    units = _units(file_type, pages, size_bytes)
+    seconds_per_unit, chars_per_unit, source = _rate(history, key)
+
+    if tier != "gemini" and stats.get("chars_per_page"):
+        chars = stats["chars_per_page"] * units     # The text layer is what gets extracted
+    else:
+        chars = chars_per_unit * units
+    chunks = max(1, math.ceil(chars / history["chars_per_chunk"]))
+
+    if tier != "gemini":
+        extract_calls = 0
+    elif file_type == "pdf" and pages and pages > GEMINI_PAGES_PER_RANGE:
+        extract_calls = math.ceil(pages / GEMINI_PAGES_PER_RANGE)
+    else:
+        extract_calls = 1
+    embed_calls = _embed_calls(chunks, history)
+    wall_time_s = seconds_per_unit * units
+
+    return {
+        "pages": pages,
+        "tier": tier,
+        "chars": round(chars),
+        "chunks": chunks,
+        "extract_calls": extract_calls,
+        "embed_calls": embed_calls,
+        "api_calls": extract_calls + embed_calls,
+        "wall_time_s": round(wall_time_s, 1),
+        "worker_minutes": round(wall_time_s / 60, 2),
+        "source": source,
+    }
+
+
+def estimate_reindex(processing: dict, history: dict) -> dict:
+    """Re-chunk + re-embed from the stored extraction: embedding calls only."""
+    chars = (processing.get("artifact") or {}).get("chars") or 0
+    chunks = processing.get("chunk_count") or max(1, math.ceil(chars / history["chars_per_chunk"]))
+    seconds_per_unit, _, source = _rate(history, "reindex")
+    embed_calls = _embed_calls(chunks, history)
+    wall_time_s = seconds_per_unit * chunks
+    return {
+        "pages": processing.get("page_count"),
+        "tier": "reindex",
+        "chars": chars,
+        "chunks": chunks,
+        "extract_calls": 0,
+        "embed_calls": embed_calls,
+        "api_calls": embed_calls,
+        "wall_time_s": round(wall_time_s, 1),
+        "worker_minutes": round(wall_time_s / 60, 2),
+        "source": source,
+    }
+
+
+async def queue_wait(priority: str, history: Optional[dict] = None) -> float:
+    """Seconds until a file queued now would be dispatched."""
+    history = history or await throughput_history()
+    return await files_ahead(priority) * history["file_seconds"] / INGESTION_MAX_IN_FLIGHT
+
+
+async def estimate_ingestion(
+    file_path: str, file_type: str, size_bytes: int, priority: str = "interactive",
+    processing: Optional[dict] = None,
+) -> dict:
+    """
+    Estimate for queueing a file now. With a `processing` that has a stored
+    extraction, only re-chunking and re-embedding are estimated.
+    """
+    history = await throughput_history()
+    if processing and processing.get("artifact"):
+        estimate = estimate_reindex(processing, history)
+    else:
+        estimate = await asyncio.to_thread(estimate_file, file_path, file_type, size_bytes, history)
+    estimate["queue_wait_s"] = round(await queue_wait(priority, history), 1)
+    estimate["eta_s"] = round(estimate["queue_wait_s"] + estimate["wall_time_s"], 1)
+    estimate["estimated_at"] = datetime.now(timezone.utc)
+    return estimate
+
+
+# ══════════════════════════════════════════════════════════════════════
+# Daily budgets
+# ══════════════════════════════════════════════════════════════════════
+
+def _today() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+
+async def budget_limits(classroom_id: str) -> dict:
+    classroom = await get_db().classrooms.find_one(
+        {"classroom_id": classroom_id}, {"_id": 0, "ingestion_budget": 1},
+    ) or {}
+    override = classroom.get("ingestion_budget") or {}
+    return {
+        "api_calls": override.get("api_calls", INGESTION_DAILY_API_CALLS),
+        "worker_minutes": override.get("worker_minutes", INGESTION_DAILY_WORKER_MINUTES),
+    }
+
+
+async def budget_status(classroom_id: str) -> dict:
+    """Today's limits, booked usage and what is left (None = unlimited)."""
+    limits = await budget_limits(classroom_id)
+    usage = await get_db().ingestion_usage.find_one(
+        {"classroom_id": classroom_id, "day": _today()}, {"_id": 0},
+    ) or {}
+    return {
+        "classroom_id": classroom_id,
+        "day": _today(),
+        "limits": limits,
+        "used": {f: usage.get(f, 0) for f in (*BUDGET_FIELDS, "files")},
+        "remaining": {
+            f: round(max(limits[f] - usage.get(f, 0), 0), 2) if limits[f] else None
+            for f in BUDGET_FIELDS
+        },
+    }
+
+
+async def require_budget_left(classroom_id: str) -> None:
+    """Raise BudgetExceeded if any limited budget is already spent (before a large upload)."""
+    status = await budget_status(classroom_id)
+    if any(left is not None and left <= 0 for left in status["remaining"].values()):
+        raise BudgetExceeded(status, {f: 0 for f in BUDGET_FIELDS})
+
+
+async def charge(classroom_id: str, estimate: dict) -> None:
+    """Book an estimate against today's budget; BudgetExceeded if it does not fit."""
+    coll = get_db().ingestion_usage
+    key = {"classroom_id": classroom_id, "day": _today()}
+    limits = await budget_limits(classroom_id)
+    try:
+        await coll.update_one(
+            key, {"$setOnInsert": {"api_calls": 0, "worker_minutes": 0.0, "files": 0}}, upsert=True,
+        )
+    except DuplicateKeyError:
+        pass  # A concurrent charge created it
+
+    # Only books if every limited field still has room for the whole estimate
+    fits = {f: {"$lte": limits[f] - estimate[f]} for f in BUDGET_FIELDS if limits[f]}
+    result = await coll.update_one(
+        {**key, **fits},
+        {"$inc": {"api_calls": estimate["api_calls"], "worker_minutes": estimate["worker_minutes"], "files": 1}},
+    )
+    if not result.matched_count:
+        raise BudgetExceeded(await budget_status(classroom_id), estimate)
+
+
+async def refund(classroom_id: str, estimate: dict) -> None:
+    """Give back a charge whose file was never queued (e.g. its metadata write failed)."""
+    await get_db().ingestion_usage.update_one(
+        {"classroom_id": classroom_id, "day": _today()},
+        {"$inc": {"api_calls": -estimate["api_calls"], "worker_minutes": -estimate["worker_minutes"], "files": -1}},
+    )
@@ -0,0 +1,335 @@
+"""
+ingestion_queue.py — Priority + per-classroom fair-share admission
+==================================================================
+
+Celery queues are FIFO: a teacher bulk-uploading a semester of slides would
+put every other classroom's urgent handout behind all of it. Files therefore
+wait here (Redis) and are admitted to Celery by this scheduler:
+
+  PRIORITY
+    interactive   single uploads, manual retries
+    bulk          batch uploads, re-index / backfill, sweeper requeues of bulk files
+    A bulk file is only admitted when no interactive file is waiting, unless
+    the next one has waited longer than INGESTION_BULK_MAX_WAIT_S: then it goes
+    first, at most every other admission, so a steady stream of interactive
+    uploads cannot starve a backfill.
+
+  FAIR SHARE
+    Within a priority, classrooms take turns: the classroom served least
+    recently goes next (a classroom that had nothing queued goes first).
+
+  WINDOW
+    At most INGESTION_MAX_IN_FLIGHT files are dispatched but unfinished at a
+    time, so the backlog waits here — where order is still decided — rather
+    than in the broker. The priority also becomes the Celery message priority
+    of every stage task, so interactive work overtakes bulk work already in
+    the per-stage queues.
+
+Redis keys:
+  ingest_fq:<priority>:<classroom_id>   list of queued jobs (JSON)
+  ingest_fq:<priority>:rr               zset classroom_id → last served (round robin)
+  ingest_fq:wait:<classroom_id>         hash: dispatched, wait_total_s, wait_max_s
+  ingest_fq:last_admitted               priority of the last admitted file (bulk aging)
+
+enqueue() / enqueue_many() are called by the routers and dispatch immediately
+when a slot is free; fair_dispatcher() (API background loop) fills slots as
+files finish. If Redis is unreachable, they fall back to a direct Celery send.
+dispatch_ready() holds ingest_fq:dispatch_lock while it counts and fills
+slots, so concurrent callers (every API worker) cannot overfill the window.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from database.mongo import get_db
+from database.redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+PRIORITIES = ["interactive", "bulk"]                    # Admission order
+CELERY_PRIORITY = {"interactive": 0, "bulk": 6}         # Redis transport: 0 is served first
+
+INGESTION_MAX_IN_FLIGHT = int(os.getenv("INGESTION_MAX_IN_FLIGHT", "4"))
+INGESTION_DISPATCH_INTERVAL_S = 1.0
+INGESTION_DISPATCH_STALE_S = 3600   # Dispatched longer ago than this no longer holds a slot
+INGESTION_DISPATCH_LOCK_MS = 30_000  # Upper bound on one dispatch_ready() pass holding the lock
+INGESTION_BULK_MAX_WAIT_S = float(os.getenv("INGESTION_BULK_MAX_WAIT_S", "1800"))  # Then bulk goes first
+
+_KEY_PREFIX = "ingest_fq"
+_IN_FLIGHT_STATUSES = ["pending", "processing", "partially_ready"]
+
+# Pop the next job: first non-empty priority, least recently served classroom
+_POP_SCRIPT = """
+for i = 2, #ARGV do
+  local rr = ARGV[1] .. ':' .. ARGV[i] .. ':rr'
+  local head = redis.call('ZRANGE', rr, 0, 0)
+  if #head > 0 then
+    local classroom = head[1]
+    local key = ARGV[1] .. ':' .. ARGV[i] .. ':' .. classroom
+    local job = redis.call('LPOP', key)
+    if redis.call('LLEN', key) == 0 then
+      redis.call('ZREM', rr, classroom)
+    else
+      redis.call('ZADD', rr, redis.call('TIME')[1], classroom)
+    end
+    if job then return {ARGV[i], classroom, job} end
+  end
+end
+return nil
+"""
+
+# Release the dispatch lock only if this caller still holds it
+_UNLOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def _queue_key(priority: str, classroom_id: str) -> str:
+    return f"{_KEY_PREFIX}:{priority}:{classroom_id}"
+
+
+def _rr_key(priority: str) -> str:
+    return f"{_KEY_PREFIX}:{priority}:rr"
+
+
+def _last_admitted_key() -> str:
+    return f"{_KEY_PREFIX}:last_admitted"
+
+
+def celery_priority(processing: dict) -> int:
+    """Celery message priority for a file's stage tasks."""
+    return CELERY_PRIORITY.get(processing.get("priority"), CELERY_PRIORITY["interactive"])
+
+
+async def enqueue(file_id: str, classroom_id: str, priority: str = "interactive", **task_kwargs) -> None:
+    """Queue a file for ingestion (process_file_task kwargs pass through)."""
+    await enqueue_many([file_id], classroom_id, priority, **task_kwargs)
+
+
+async def enqueue_many(
+    file_ids: list[str], classroom_id: str, priority: str = "interactive", **task_kwargs,
+) -> None:
+    """Queue several files of one classroom with one Mongo write and one Redis round trip."""
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown ingestion priority: {priority}")
+    if not file_ids:
+        return
+    now = datetime.now(timezone.utc)
+    await get_db().file_metadata.update_many(
+        {"file_id": {"$in": file_ids}},
+        {"$set": {
+            "processing.priority": priority,
+            "processing.queued": True,
+            "processing.queued_at": now,
+        }},
+    )
+
+    jobs = [
+        json.dumps({"file_id": file_id, "kwargs": task_kwargs, "queued_at": now.timestamp()})
+        for file_id in file_ids
+    ]
+    try:
+        redis = await get_redis()
+        pipe = redis.pipeline()
+        pipe.rpush(_queue_key(priority, classroom_id), *jobs)
+        pipe.zadd(_rr_key(priority), {classroom_id: 0}, nx=True)
+        await pipe.execute()
+    except Exception as e:
+        logger.warning("[ingestion_queue] Redis unavailable (%s) — sending %d file(s) straight to Celery",
+                       e, len(file_ids))
+        for file_id in file_ids:
+            await _send(file_id, classroom_id, priority, task_kwargs, wait_s=0.0)
+        return
+
+    await dispatch_ready()
+
+
+async def _in_flight() -> int:
+    since = datetime.now(timezone.utc) - timedelta(seconds=INGESTION_DISPATCH_STALE_S)
+    return await get_db().file_metadata.count_documents({
+        "processing.status": {"$in": _IN_FLIGHT_STATUSES},
+        "processing.error": None,
+        "processing.queued": False,
+        "processing.dispatched_at": {"$gt": since},
+    })
+
+
+async def files_ahead(priority: str) -> int:
+    """
+    Files a newly queued file of `priority` waits behind: everything in flight,
+    every waiting interactive file and, for bulk, every waiting bulk file.
+    """
+    ahead = await _in_flight()
+    try:
+        redis = await get_redis()
+        for p in PRIORITIES[:PRIORITIES.index(priority) + 1]:
+            classrooms = await redis.zrange(_rr_key(p), 0, -1)
+            if classrooms:
+                pipe = redis.pipeline()
+                for classroom_id in classrooms:
+                    pipe.llen(_queue_key(p, classroom_id))
+                ahead += sum(await pipe.execute())
+    except Exception as e:
+        logger.warning("[ingestion_queue] Queue depth unavailable: %s", e)
+    return ahead
+
+
+async def dispatch_ready() -> int:
+    """
+    Admit queued files into Celery while the in-flight window has room. Returns how many.
+    If another caller holds the dispatch lock, returns 0 — that caller or the
+    next fair_dispatcher() pass admits whatever was just queued.
+    """
+    redis = await get_redis()
+    lock_key, token = f"{_KEY_PREFIX}:dispatch_lock", uuid.uuid4().hex
+    if not await redis.set(lock_key, token, nx=True, px=INGESTION_DISPATCH_LOCK_MS):
+        return 0
+    try:
+        return await _dispatch_slots(redis)
+    finally:
+        await redis.eval(_UNLOCK_SCRIPT, 1, lock_key, token)
+
+
+async def _admission_order(redis) -> list[str]:
+    """
+    PRIORITIES, or bulk first when the bulk file next in line has waited longer
+    than INGESTION_BULK_MAX_WAIT_S and the last admission was not bulk.
+    """
+    if await redis.get(_last_admitted_key()) == "bulk":
+        return PRIORITIES
+    head = await redis.zrange(_rr_key("bulk"), 0, 0)
+    raw = await redis.lindex(_queue_key("bulk", head[0]), 0) if head else None
+    if raw and time.time() - json.loads(raw)["queued_at"] > INGESTION_BULK_MAX_WAIT_S:
+        return ["bulk"] + [p for p in PRIORITIES if p != "bulk"]
+    return PRIORITIES
+
+
+async def _dispatch_slots(redis) -> int:
+    slots = INGESTION_MAX_IN_FLIGHT - await _in_flight()
+    dispatched = 0
+    while dispatched < slots:
+        popped = await redis.eval(_POP_SCRIPT, 0, _KEY_PREFIX, *await _admission_order(redis))
+        if not popped:
+            break
+        priority, classroom_id, raw = popped
+        await redis.set(_last_admitted_key(), priority)
+        job = json.loads(raw)
+        wait_s = max(0.0, time.time() - job["queued_at"])
+        await _send(job["file_id"], classroom_id, priority, job["kwargs"], wait_s)
+
+        stats_key = f"{_KEY_PREFIX}:wait:{classroom_id}"
+        pipe = redis.pipeline()
+        pipe.hincrby(stats_key, "dispatched", 1)
+        pipe.hincrbyfloat(stats_key, "wait_total_s", wait_s)
+        await pipe.execute()
+        if wait_s > float(await redis.hget(stats_key, "wait_max_s") or 0):
+            await redis.hset(stats_key, "wait_max_s", round(wait_s, 3))
+        dispatched += 1
+    return dispatched
+
+
+async def _send(file_id: str, classroom_id: str, priority: str, task_kwargs: dict, wait_s: float) -> None:
+    from api.services.ingestion import process_file_task
+
+    await get_db().file_metadata.update_one(
+        {"file_id": file_id},
+        {"$set": {
+            "processing.queued": False,
+            "processing.dispatched_at": datetime.now(timezone.utc),
+            "processing.queue_wait_s": round(wait_s, 3),
+        }},
+    )
+    process_file_task.apply_async(
+        args=[file_id], kwargs=task_kwargs, priority=CELERY_PRIORITY[priority],
+    )
+    logger.info("[ingestion_queue] Dispatched file_id=%s (%s, classroom=%s) after %.1fs",
+                file_id, priority, classroom_id, wait_s)
+
+
+async def fair_dispatcher() -> None:
+    """Background loop for the API process: refill the window as files finish."""
+    while True:
+        await asyncio.sleep(INGESTION_DISPATCH_INTERVAL_S)
+        try:
+            await dispatch_ready()
+        except Exception as e:
+            logger.warning("[ingestion_queue] Dispatch failed: %s", e)
+
+
+# ══════════════════════════════════════════════════════════════════════
+# Metrics
+# ══════════════════════════════════════════════════════════════════════
+
+async def queue_stats() -> dict:
+    """Per-priority, per-classroom depth and wait times, plus Celery broker depth per queue."""
+    from core.celery_app import celery_app
+
+    redis = await get_redis()
+    now = time.time()
+    classrooms: dict[str, dict] = {}
+    depth = {}
+    for priority in PRIORITIES:
+        depth[priority] = 0
+        for classroom_id in await redis.zrange(_rr_key(priority), 0, -1):
+            key = _queue_key(priority, classroom_id)
+            n = await redis.llen(key)
+            head = await redis.lindex(key, 0)
+            entry = classrooms.setdefault(classroom_id, {"classroom_id": classroom_id})
+            entry[f"{priority}_depth"] = n
+            entry[f"{priority}_oldest_wait_s"] = (
+                round(now - json.loads(head)["queued_at"], 1) if head else None
+            )
+            depth[priority] += n
+
+    async for key in redis.scan_iter(match=f"{_KEY_PREFIX}:wait:*"):
+        classroom_id = key.rsplit(":", 1)[1]
+        stats = await redis.hgetall(key)
+        dispatched = int(stats.get("dispatched", 0))
+        entry = classrooms.setdefault(classroom_id, {"classroom_id": classroom_id})
+        entry["dispatched"] = dispatched
+        entry["avg_wait_s"] = round(float(stats.get("wait_total_s", 0)) / dispatched, 2) if dispatched else None
+        entry["max_wait_s"] = float(stats.get("wait_max_s", 0))
+
+    try:
+        broker = await asyncio.to_thread(_broker_depth, [q.name for q in celery_app.conf.task_queues])
+    except Exception as e:
+        logger.warning("[ingestion_queue] Broker depth unavailable: %s", e)
+        broker = None
+
+    return {
+        "in_flight": await _in_flight(),
+        "max_in_flight": INGESTION_MAX_IN_FLIGHT,
+        "waiting": depth,
+        "broker_depth": broker,
+        "classrooms": sorted(classrooms.values(), key=lambda c: c["classroom_id"]),
+    }
+
+
+def _broker_depth(queue_names: list[str]) -> dict[str, int]:
+    """
+    Messages waiting in each Celery queue, asked of the broker itself
+    (CELERY_BROKER_URL, which need not be REDIS_URL). The Redis transport
+    counts every priority step of a queue.
+    """
+    from core.celery_app import celery_app
+
+    depth = {}
+    with celery_app.connection_for_read() as conn:
+        channel = conn.default_channel
+        for name in queue_names:
+            try:
+                depth[name] = channel.queue_declare(queue=name, passive=True).message_count
+            except conn.channel_errors:  # Never declared: nothing was sent to it yet
+                depth[name] = 0
+                channel = conn.channel()  # AMQP closes a channel on a failed passive declare
+    return depth
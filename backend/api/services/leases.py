@@ -0,0 +1,255 @@
+"""
+leases.py — Time-bounded ingestion leases and stuck-job recovery
+================================================================
+
+A worker that is OOM-killed mid-Docling never reaches its except block, so
+the file would stay "processing" forever. Every running ingestion unit holds
+a lease instead:
+
+  processing.leases: [{id, stage, owner, acquired_at, heartbeat_at, expires_at}]
+
+  - id is the unit of work: "pipeline" (in-process run) or a canvas stage such
+    as "extract", "embed:3" — so concurrent batch tasks of one file coexist
+  - hold_lease() renews expires_at every LEASE_HEARTBEAT_S while the task runs
+    and removes the lease when it ends (success or failure)
+  - a holder whose lease was swept anyway (e.g. stalled past LEASE_TTL_S) is
+    cancelled and hold_lease() raises LeaseLostError: the file was already
+    requeued, so the old run must stop — and must not record itself as failed
+    (lease_lost(), checked by ingestion._mark_failed)
+  - sweep_expired_leases() (API background loop, or POST /api/superadmin/
+    ingestion/sweep) requeues files whose lease expired, up to
+    LEASE_MAX_RECOVERIES times, then marks them failed
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import socket
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Optional
+from uuid import uuid4
+
+from database.mongo import get_db
+
+logger = logging.getLogger(__name__)
+
+LEASE_TTL_S = int(os.getenv("INGESTION_LEASE_TTL_S", "120"))
+LEASE_HEARTBEAT_S = LEASE_TTL_S / 4
+LEASE_SWEEP_INTERVAL_S = 60
+LEASE_MAX_RECOVERIES = 2    # Requeues after a lost worker before the file is marked failed
+
+IN_FLIGHT_STATUSES = ["pending", "processing", "partially_ready"]
+
+
+class LeaseHeldError(RuntimeError):
+    """Another live worker holds this lease (e.g. a redelivered duplicate task)."""
+
+
+class LeaseLostError(RuntimeError):
+    """The lease was swept while its holder still ran; the file is someone else's now."""
+
+
+# {"lost": bool} of the hold_lease() block the current task runs in
+_held: ContextVar[Optional[dict]] = ContextVar("ingestion_lease", default=None)
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _as_utc(value: datetime) -> datetime:
+    # Motor returns naive UTC datetimes unless the client is tz_aware
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def lease_lost() -> bool:
+    """True inside a hold_lease() block whose lease was lost (its holder is being cancelled)."""
+    state = _held.get()
+    return bool(state and state["lost"])
+
+
+def has_expired_lease(processing: dict) -> bool:
+    now = _now()
+    return any(_as_utc(l["expires_at"]) < now for l in processing.get("leases", []))
+
+
+@asynccontextmanager
+async def hold_lease(file_id: str, lease_id: str) -> AsyncIterator[None]:
+    """Hold `lease_id` on a file for the duration of the block, heartbeating in the background."""
+    db = get_db()
+    owner = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+    now = _now()
+
+    # Drop an expired copy of this lease (its worker is gone), then claim it if free
+    await db.file_metadata.update_one(
+        {"file_id": file_id},
+        {"$pull": {"processing.leases": {"id": lease_id, "expires_at": {"$lte": now}}}},
+    )
+    claimed = await db.file_metadata.update_one(
+        {"file_id": file_id, "processing.leases.id": {"$ne": lease_id}},
+        {"$push": {"processing.leases": {
+            "id": lease_id,
+            "stage": lease_id.split(":")[0],
+            "owner": owner,
+            "acquired_at": now,
+            "heartbeat_at": now,
+            "expires_at": now + timedelta(seconds=LEASE_TTL_S),
+        }}},
+    )
+    if not claimed.matched_count and await db.file_metadata.count_documents({"file_id": file_id}):
+        raise LeaseHeldError(f"{lease_id} of file_id={file_id} is already running elsewhere")
+
+    state = {"lost": False}
+    token = _held.set(state)
+    heartbeat = asyncio.create_task(_heartbeat(file_id, lease_id, owner, asyncio.current_task(), state))
+    try:
+        yield
+    except asyncio.CancelledError:
+        if not state["lost"]:
+            raise
+        asyncio.current_task().uncancel()  # The cancellation was ours, not a time limit / shutdown
+        raise LeaseLostError(f"{lease_id} lease of file_id={file_id} was lost — stopped") from None
+    finally:
+        heartbeat.cancel()
+        _held.reset(token)
+        await db.file_metadata.update_one(
+            {"file_id": file_id},
+            {"$pull": {"processing.leases": {"owner": owner}}},
+        )
+
+
+async def _heartbeat(file_id: str, lease_id: str, owner: str, holder: asyncio.Task, state: dict) -> None:
+    db = get_db()
+    while True:
+        await asyncio.sleep(LEASE_HEARTBEAT_S)
+        now = _now()
+        try:
+            renewed = await db.file_metadata.update_one(
+                {"file_id": file_id, "processing.leases": {"$elemMatch": {"owner": owner}}},
+                {"$set": {
+                    "processing.leases.$.heartbeat_at": now,
+                    "processing.leases.$.expires_at": now + timedelta(seconds=LEASE_TTL_S),
+                }},
+            )
+            if not renewed.matched_count:
+                logger.warning("[lease] Lost %s lease on file_id=%s (swept?) — stopping its holder",
+                               lease_id, file_id)
+                state["lost"] = True
+                holder.cancel()
+                return
+        except Exception as e:
+            logger.warning("[lease] Heartbeat failed for file_id=%s: %s", file_id, e)
+
+
+# ══════════════════════════════════════════════════════════════════════
+# Sweeper
+# ══════════════════════════════════════════════════════════════════════
+
+async def sweep_expired_leases() -> dict:
+    """Requeue (or fail, after LEASE_MAX_RECOVERIES) every file holding an expired lease."""
+    from api.services.content_refs import notify_file
+    from api.services.ingestion_queue import enqueue
+
+    db = get_db()
+    now = _now()
+    requeued, failed = [], []
+    cursor = db.file_metadata.find({"processing.leases.expires_at": {"$lt": now}})
+    async for doc in cursor:
+        file_id = doc["file_id"]
+        processing = doc.get("processing", {})
+        expired = [l for l in processing.get("leases", []) if _as_utc(l["expires_at"]) < now]
+        # Claim the recovery: only one sweeper wins the $pull of these exact leases
+        pulled = await db.file_metadata.update_one(
+            {"file_id": file_id, "processing.leases.owner": expired[0]["owner"]},
+            {"$pull": {"processing.leases": {"owner": {"$in": [l["owner"] for l in expired]}}}},
+        )
+        if not pulled.modified_count:
+            continue
+
+        stages = ", ".join(sorted({l["stage"] for l in expired}))
+        recoveries = processing.get("recoveries", 0)
+        partial = bool(processing.get("indexed_chunks"))
+        if recoveries < LEASE_MAX_RECOVERIES:
+            await db.file_metadata.update_one(
+                {"file_id": file_id},
+                {"$set": {
+                    "processing.status": "partially_ready" if partial else "pending",
+                    "processing.error": None,
+                }, "$inc": {"processing.recoveries": 1}},
+            )
+            await enqueue(file_id, doc.get("classroom_id") or "shared",
+                          priority=processing.get("priority", "interactive"))
+            requeued.append(file_id)
+            logger.warning("[lease] file_id=%s lost its worker during %s — requeued (%d/%d)",
+                           file_id, stages, recoveries + 1, LEASE_MAX_RECOVERIES)
+        else:
+            await db.file_metadata.update_one(
+                {"file_id": file_id},
+                {"$set": {
+                    "processing.status": "partially_ready" if partial else "failed",
+                    "processing.error": f"Worker stopped responding during {stages} "
+                                        f"({recoveries} recoveries attempted)",
+                }},
+            )
+            failed.append(file_id)
+            logger.error("[lease] file_id=%s lost its worker during %s — marked failed", file_id, stages)
+        await notify_file(file_id, None)  # Mirror the new status onto classrooms sharing the file
+
+    return {"requeued": requeued, "failed": failed}
+
+
+async def lease_sweeper() -> None:
+    """Background loop for the API process: sweep every LEASE_SWEEP_INTERVAL_S."""
+    while True:
+        await asyncio.sleep(LEASE_SWEEP_INTERVAL_S)
+        try:
+            await sweep_expired_leases()
+        except Exception as e:
+            logger.warning("[lease] Sweep failed: %s", e)
+
+
+async def list_in_flight() -> list[dict]:
+    """Files still being ingested, oldest first, with stage, elapsed time and lease health."""
+    db = get_db()
+    now = _now()
+    cursor = db.file_metadata.find(
+        {
+            "processing.status": {"$in": IN_FLIGHT_STATUSES},
+            "processing.error": None,   # partially_ready + error = given up, not in flight
+            "content_id": None,         # References mirror their owner's status; they run nothing
+        },
+        {"_id": 0, "file_id": 1, "original_name": 1, "classroom_id": 1, "file_type": 1,
+         "uploaded_at": 1, "processing": 1},
+    ).sort("uploaded_at", 1)
+
+    jobs = []
+    async for doc in cursor:
+        processing = doc.get("processing", {})
+        started = processing.get("started_at") or doc.get("uploaded_at")
+        leases = [{
+            "id": l["id"],
+            "stage": l["stage"],
+            "owner": l["owner"],
+            "heartbeat_age_s": round((now - _as_utc(l["heartbeat_at"])).total_seconds(), 1),
+            "expires_in_s": round((_as_utc(l["expires_at"]) - now).total_seconds(), 1),
+        } for l in processing.get("leases", [])]
+        jobs.append({
+            "file_id": doc["file_id"],
+            "original_name": doc.get("original_name"),
+            "classroom_id": doc.get("classroom_id"),
+            "file_type": doc.get("file_type"),
+            "status": processing.get("status"),
+            "stage": processing.get("stage"),
+            "indexed_chunks": processing.get("indexed_chunks", 0),
+            "chunk_count": processing.get("chunk_count"),
+            "started_at": started,
+            "elapsed_s": round((now - _as_utc(started)).total_seconds(), 1) if started else None,
+            "recoveries": processing.get("recoveries", 0),
+            "leases": leases,
+            "stalled": any(l["expires_in_s"] < 0 for l in leases),
+        })
+    return jobs
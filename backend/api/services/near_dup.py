@@ -0,0 +1,194 @@
+"""
+near_dup.py — Near-duplicate chunk detection before embedding (SimHash)
+======================================================================
+
+Lecture decks repeat headers, footers, title slides and whole sections across
+weeks. Every chunk gets a 64-bit SimHash over word 3-shingles; two chunks
+whose fingerprints differ in at most NEAR_DUP_MAX_DISTANCE bits are treated
+as the same content:
+
+  within a file       the later chunk becomes an alias of the earlier one
+                      (record["alias_of"] = canonical chunk id): no embedding
+                      call and no vector; the alias stays in the chunk manifest
+  across a classroom  the chunk reuses the earlier file's vector from ChromaDB
+                      (record["reuse_of"]): no embedding call, but it keeps its
+                      own row so file-scoped search, sharing and deletion of
+                      either file stay independent
+
+Fingerprints of each file's stored chunks live in Mongo chunk_fingerprints
+  {file_id, classroom_id, fingerprints: [[chunk_id, simhash_hex, tokens]]}
+
+Lookup is exact on one of NEAR_DUP_BANDS 16-bit bands: fingerprints within
+3 bits of each other always share at least one band (pigeonhole).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import os
+import re
+from typing import Awaitable, Callable, Optional
+
+import numpy as np
+
+from database.chroma import get_chroma_collection, get_collection
+from database.mongo import get_db
+
+logger = logging.getLogger(__name__)
+
+NEAR_DUP_ENABLED = os.getenv("INGESTION_NEAR_DUP", "1") != "0"
+NEAR_DUP_MAX_DISTANCE = 3       # Differing SimHash bits still counted as a duplicate
+NEAR_DUP_MIN_TOKENS = 8         # Shorter chunks must match exactly — few shingles, noisy hash
+NEAR_DUP_BANDS = 4              # 64 bits → 4 × 16-bit lookup bands (needs MAX_DISTANCE < BANDS)
+
+_BAND_BITS = 64 // NEAR_DUP_BANDS
+_BAND_MASK = (1 << _BAND_BITS) - 1
+_TOKEN_RE = re.compile(r"\w+")
+_PAGE_MARKER_RE = re.compile(r"\[Page \d+\]")
+
+
+def simhash(text: str) -> tuple[int, int]:
+    """64-bit SimHash of `text` over word 3-shingles, and its token count."""
+    tokens = _TOKEN_RE.findall(_PAGE_MARKER_RE.sub(" ", text).lower())
+    shingles = {" ".join(tokens[i:i + 3]) for i in range(max(1, len(tokens) - 2))}
+    bits = [
+        format(int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "big"), "064b")
+        for s in shingles
+    ]
+    # Column-wise majority vote; zip(*bits) keeps the per-bit counting in C
+    half = len(bits) / 2
+    fingerprint = 0
+    for column in zip(*bits):
+        fingerprint = (fingerprint << 1) | (column.count("1") > half)
+    return fingerprint, len(tokens)
+
+
+class DedupIndex:
+    """Fingerprints of stored chunks, looked up by band."""
+
+    def __init__(self) -> None:
+        self._bands: dict[tuple[int, int], list[tuple[int, int, str]]] = {}
+
+    def add(self, chunk_id: str, fingerprint: int, tokens: int) -> None:
+        for band in range(NEAR_DUP_BANDS):
+            key = (band, (fingerprint >> (band * _BAND_BITS)) & _BAND_MASK)
+            self._bands.setdefault(key, []).append((fingerprint, tokens, chunk_id))
+
+    def find(self, fingerprint: int, tokens: int) -> Optional[str]:
+        """The first stored chunk this one duplicates, if any."""
+        for band in range(NEAR_DUP_BANDS):
+            key = (band, (fingerprint >> (band * _BAND_BITS)) & _BAND_MASK)
+            for other, other_tokens, chunk_id in self._bands.get(key, ()):
+                limit = NEAR_DUP_MAX_DISTANCE if min(tokens, other_tokens) >= NEAR_DUP_MIN_TOKENS else 0
+                if (fingerprint ^ other).bit_count() <= limit:
+                    return chunk_id
+        return None
+
+
+class ChunkDeduper:
+    """Marks one file's chunk records, in chunk order, as aliases or vector reuses."""
+
+    def __init__(self, classroom_index: Optional[DedupIndex] = None) -> None:
+        self.file_index = DedupIndex()
+        self.classroom_index = classroom_index or DedupIndex()
+        self.fingerprints: list[list] = []  # [chunk_id, simhash_hex, tokens] of chunks that get a vector
+        self.chunks = 0
+        self.aliased = 0
+        self.reuse_candidates = 0
+
+    def check(self, record: dict) -> None:
+        self.chunks += 1
+        if not NEAR_DUP_ENABLED:
+            return
+        fingerprint, tokens = simhash(record["text"])
+        if canonical := self.file_index.find(fingerprint, tokens):
+            record["alias_of"] = canonical
+            self.aliased += 1
+            return
+        if canonical := self.classroom_index.find(fingerprint, tokens):
+            record["reuse_of"] = canonical
+            self.reuse_candidates += 1
+        self.file_index.add(record["id"], fingerprint, tokens)
+        self.fingerprints.append([record["id"], f"{fingerprint:016x}", tokens])
+
+
+def dedup_stats(chunks: int, aliased: int, reused: int) -> dict:
+    """processing.dedup: how much embedding work near-duplicate detection saved."""
+    skipped = aliased + reused
+    return {
+        "chunks": chunks,
+        "aliased": aliased,
+        "reused": reused,
+        "embeddings_skipped": skipped,
+        "skipped_pct": round(100 * skipped / chunks, 1) if chunks else 0.0,
+    }
+
+
+# ══════════════════════════════════════════════════════════════════════
+# Persistence + vector reuse
+# ══════════════════════════════════════════════════════════════════════
+
+async def load_classroom_index(classroom_id: Optional[str], exclude_file_id: str) -> DedupIndex:
+    """Fingerprints of every other file already chunked in the classroom."""
+    index = DedupIndex()
+    if not NEAR_DUP_ENABLED or not classroom_id:
+        return index
+    cursor = get_db().chunk_fingerprints.find(
+        {"classroom_id": classroom_id, "file_id": {"$ne": exclude_file_id}},
+        {"_id": 0, "fingerprints": 1},
+    )
+    async for doc in cursor:
+        for chunk_id, fingerprint, tokens in doc["fingerprints"]:
+            index.add(chunk_id, int(fingerprint, 16), tokens)
+    return index
+
+
+async def save_fingerprints(file_id: str, classroom_id: Optional[str], deduper: ChunkDeduper) -> None:
+    if not NEAR_DUP_ENABLED or not classroom_id:
+        return
+    await get_db().chunk_fingerprints.replace_one(
+        {"file_id": file_id},
+        {"file_id": file_id, "classroom_id": classroom_id, "fingerprints": deduper.fingerprints},
+        upsert=True,
+    )
+
+
+async def delete_fingerprints(file_id: str) -> None:
+    await get_db().chunk_fingerprints.delete_many({"file_id": file_id})
+
+
+async def embed_with_reuse(
+    embed: Callable[[list[str]], Awaitable[list[list[float]]]], records: list[dict],
+    collection: Optional[str] = None,
+) -> tuple[list[dict], np.ndarray, int]:
+    """
+    Vectors for the records that need one (aliases are dropped). Records marked
+    reuse_of take the canonical chunk's stored vector from `collection` (default:
+    the active one) — a vector is only reusable under the model that made it; the
+    rest, including reuses whose canonical vector is not there, are embedded.
+    Returns (records, float32 (n, dim) vectors, reused_count).
+    """
+    kept = [r for r in records if not r.get("alias_of")]
+    reuse_ids = list({r["reuse_of"] for r in kept if r.get("reuse_of")})
+    stored: dict[str, np.ndarray] = {}
+    if reuse_ids:
+        try:
+            source = get_collection(collection) if collection else get_chroma_collection()
+            got = await asyncio.to_thread(source.get, ids=reuse_ids, include=["embeddings"])
+            stored = {
+                chunk_id: np.asarray(vector, dtype=np.float32)
+                for chunk_id, vector in zip(got["ids"], got["embeddings"])
+            }
+        except Exception as e:
+            logger.warning("[near_dup] Could not load reusable vectors: %s", e)
+
+    to_embed = [r for r in kept if r.get("reuse_of") not in stored]
+    fresh = iter(await embed([r["text"] for r in to_embed]) if to_embed else [])
+    # float32 rows: ~1/8 the memory of Python float lists while batches wait to be stored
+    vectors = np.asarray(
+        [stored[r["reuse_of"]] if r.get("reuse_of") in stored else next(fresh) for r in kept],
+        dtype=np.float32,
+    )
+    return kept, vectors, len(kept) - len(to_embed)
@@ -0,0 +1,233 @@
+"""
+pdf_text.py — Page-level PyMuPDF text extraction (Tier 3)
+=========================================================
+
+Kept free of app imports on purpose: process-pool workers are started with
+the "spawn" method and import only this module and fitz.
+
+  analyze_pdf()             cheap layout statistics used for extraction triage
+  extract_pages()           single-threaded, optional page range
+  extract_pages_parallel()  splits the page range across a ProcessPoolExecutor;
+                            each worker opens the document once (pool initializer)
+  iter_pages()              the same pool as a generator with bounded lookahead,
+                            for streaming ingestion of very large documents
+
+All return / yield (page_number, text) for non-empty pages, 1-based, in order.
+
+A daemonic process (a Celery prefork child) may not start child processes,
+so there the pool is skipped and pages are extracted in-process, with a
+warning. Run the extract worker with -P threads to get the parallel path.
+"""
+
+from __future__ import annotations
+
+import logging
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+PARALLEL_MIN_PAGES = 64         # Below this, process start-up costs more than it saves
+RANGES_PER_WORKER = 4           # Smaller ranges smooth out uneven page density
+STREAM_RANGE_PAGES = 16         # iter_pages(): pages per worker task
+STREAM_LOOKAHEAD = 2            # iter_pages(): ranges in flight per worker (bounds buffered text)
+
+TEXT_NATIVE_MIN_CHARS = 50      # Chars on a page for it to count as having a text layer
+ANALYZE_SAMPLE_PAGES = 20       # Pages sampled for text/image statistics
+TABLE_SAMPLE_PAGES = 5          # find_tables() is slow; sample fewer pages for it
+
+_worker_doc = None  # fitz.Document opened once per pool worker
+_warned_daemonic = False
+
+
+def available_cores() -> int:
+    """CPU cores this process may run on (respects affinity / container limits)."""
+    override = os.getenv("PYMUPDF_WORKERS")
+    if override and override.isdigit() and int(override) > 0:
+        return int(override)
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # Windows / macOS
+        return os.cpu_count() or 1
+
+
+def page_count(file_path: str) -> int:
+    import fitz  # PyMuPDF
+    with fitz.open(file_path) as doc:
+        return doc.page_count
+
+
+def _sample(page_count: int, k: int) -> list[int]:
+    """Up to k 0-based page indices spread evenly over the document."""
+    if page_count <= k:
+        return list(range(page_count))
+    step = page_count / k
+    return [int(i * step) for i in range(k)]
+
+
+def analyze_pdf(file_path: str) -> dict:
+    """
+    Measure how a PDF is built, from a sample of pages:
+      text_coverage     share of pages with a usable text layer
+      chars_per_page    mean text-layer characters per sampled page
+      image_area_ratio  mean share of page area covered by raster images
+      table_pages       sampled pages where find_tables() detects a table
+    """
+    import fitz  # PyMuPDF
+    with fitz.open(file_path) as doc:
+        total = doc.page_count
+        if not total:
+            return {"page_count": 0, "text_coverage": 0.0, "chars_per_page": 0,
+                    "image_area_ratio": 0.0, "table_pages": 0}
+
+        sample = _sample(total, ANALYZE_SAMPLE_PAGES)
+        text_pages = 0
+        text_chars = 0
+        image_ratio_sum = 0.0
+        for idx in sample:
+            page = doc[idx]
+            chars = len(page.get_text("text").strip())
+            text_chars += chars
+            if chars >= TEXT_NATIVE_MIN_CHARS:
+                text_pages += 1
+            page_area = abs(page.rect) or 1.0
+            image_area = sum(abs(fitz.Rect(info["bbox"]) & page.rect) for info in page.get_image_info())
+            image_ratio_sum += min(image_area / page_area, 1.0)
+
+        table_pages = 0
+        for idx in _sample(total, TABLE_SAMPLE_PAGES):
+            try:
+                if doc[idx].find_tables().tables:
+                    table_pages += 1
+            except Exception:
+                pass
+
+    return {
+        "page_count": total,
+        "sampled_pages": len(sample),
+        "text_coverage": round(text_pages / len(sample), 3),
+        "chars_per_page": round(text_chars / len(sample)),
+        "image_area_ratio": round(image_ratio_sum / len(sample), 3),
+        "table_pages": table_pages,
+    }
+
+
+def _page_texts(doc, first: int, last: int) -> list[tuple[int, str]]:
+    pages = []
+    for page_num in range(first, last + 1):
+        text = doc[page_num - 1].get_text("text")
+        if text.strip():
+            pages.append((page_num, text))
+    return pages
+
+
+def extract_pages(file_path: str, first: int = 1, last: Optional[int] = None) -> list[tuple[int, str]]:
+    """Return (page_number, text) for non-empty pages first..last in a single thread."""
+    import fitz  # PyMuPDF
+    with fitz.open(file_path) as doc:
+        last = min(last or doc.page_count, doc.page_count)
+        return _page_texts(doc, first, last)
+
+
+# ── Process-pool workers ─────────────────────────────────────────────
+
+def _pool_allowed() -> bool:
+    """False inside a daemonic process, which cannot have children."""
+    global _warned_daemonic
+    if not multiprocessing.current_process().daemon:
+        return True
+    if not _warned_daemonic:
+        _warned_daemonic = True
+        logger.warning("[pdf_text] Running in a daemonic process (Celery prefork child) — "
+                       "page extraction stays single-process; start the worker with -P threads "
+                       "to extract in parallel")
+    return False
+
+
+def _init_worker(file_path: str) -> None:
+    global _worker_doc
+    import fitz  # PyMuPDF
+    _worker_doc = fitz.open(file_path)
+
+
+def _extract_range(bounds: tuple[int, int]) -> list[tuple[int, str]]:
+    return _page_texts(_worker_doc, *bounds)
+
+
+def extract_pages_parallel(file_path: str, workers: Optional[int] = None) -> list[tuple[int, str]]:
+    """
+    Extract every page using up to `workers` processes (default: available cores).
+    Falls back to extract_pages() for short documents, single-core hosts,
+    daemonic processes, or if the pool cannot be started.
+    """
+    total = page_count(file_path)
+    workers = min(workers or available_cores(), max(1, total // RANGES_PER_WORKER))
+    if total < PARALLEL_MIN_PAGES or workers <= 1 or not _pool_allowed():
+        return extract_pages(file_path)
+
+    n_ranges = workers * RANGES_PER_WORKER
+    size = -(-total // n_ranges)  # ceil division
+    ranges = [(first, min(first + size - 1, total)) for first in range(1, total + 1, size)]
+
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(file_path,),
+        ) as pool:
+            results = list(pool.map(_extract_range, ranges))
+    except Exception as e:
+        logger.warning("[pdf_text] Process pool failed (%s) — extracting single-threaded", e)
+        return extract_pages(file_path)
+
+    return [page for chunk in results for page in chunk]
+
+
+def iter_pages(file_path: str, workers: Optional[int] = None) -> Iterator[tuple[int, str]]:
+    """
+    Yield (page_number, text) in order while later pages are extracted in the
+    pool. At most workers × STREAM_LOOKAHEAD ranges of STREAM_RANGE_PAGES pages
+    are held at once, however long the document. Runs in-process for short
+    documents, single-core hosts, daemonic processes, or if the pool fails —
+    then from the first range not yet yielded.
+    """
+    total = page_count(file_path)
+    workers = min(workers or available_cores(), max(1, total // STREAM_RANGE_PAGES))
+    ranges = [
+        (first, min(first + STREAM_RANGE_PAGES - 1, total))
+        for first in range(1, total + 1, STREAM_RANGE_PAGES)
+    ]
+    done = 0  # Ranges already yielded
+    if total >= PARALLEL_MIN_PAGES and workers > 1 and _pool_allowed():
+        try:
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(file_path,),
+            ) as pool:
+                pending = deque()
+                todo = iter(ranges)
+                for bounds in todo:
+                    pending.append(pool.submit(_extract_range, bounds))
+                    if len(pending) >= workers * STREAM_LOOKAHEAD:
+                        break
+                while pending:
+                    pages = pending.popleft().result()
+                    if (bounds := next(todo, None)) is not None:
+                        pending.append(pool.submit(_extract_range, bounds))
+                    done += 1
+                    yield from pages
+            return
+        except Exception as e:
+            logger.warning("[pdf_text] Process pool failed (%s) — extracting the remaining %d range(s) "
+                           "single-threaded", e, len(ranges) - done)
+
+    import fitz  # PyMuPDF
+    with fitz.open(file_path) as doc:
+        for first, last in ranges[done:]:
+            yield from _page_texts(doc, first, last)
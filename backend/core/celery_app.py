@@ -3,12 +3,35 @@ celery_app.py — CampusMind Celery Worker Configuration
 =======================================================
 Broker + Backend: Redis
 Worker: Single process (solo pool) for safe Docling/PyMuPDF usage
-Task retry, time limits, and serialization are configured here.
+Task retry, time limits, serialization and per-stage queues are configured here.
+
+A worker started without -Q consumes every ingestion queue (fine for local
+development). In production run one worker per queue group, e.g.:
+
+  celery -A core.celery_app worker -Q ingestion,ingest_extract -P threads -c 4
+  celery -A core.celery_app worker -Q ingest_docling -c 1
+  celery -A core.celery_app worker -Q ingest_embed -P threads -c 16 --prefetch-multiplier 4   (DOCLING_PREWARM=0)
+  celery -A core.celery_app worker -Q ingest_index -c 1                            (DOCLING_PREWARM=0)
+
+The extract worker uses -P threads: prefork children are daemonic and cannot
+start the PyMuPDF process pools (api/services/pdf_text.py). The embed worker
+does too, so all its tasks share one embedder (api/services/embedding.py
+shared_embedder) and never send more than one request per key at a time.
 """
 
 import os
+import threading
 from celery import Celery
-from celery.signals import task_failure, task_retry, task_success
+from kombu import Queue
+from celery.signals import (
+    task_failure,
+    task_retry,
+    task_success,
+    worker_init,
+    worker_process_init,
+    worker_process_shutdown,
+    worker_shutdown,
+)
 
 REDIS_URL = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0")
 REDIS_RESULT_URL = os.getenv("CELERY_RESULT_BACKEND", REDIS_URL)
@@ -17,7 +40,7 @@ celery_app = Celery(
     "campusmind_worker",
     broker=REDIS_URL,
     backend=REDIS_RESULT_URL,
-    include=["api.services.ingestion"],
+    include=["api.services.ingestion", "api.services.ingestion_canvas", "api.services.corpus_migration"],
 )
 
 celery_app.conf.update(
@@ -36,6 +59,31 @@ celery_app.conf.update(
     worker_concurrency=1,
     worker_prefetch_multiplier=1,       # Don't grab next task until current is done
 
+    # ── Queues (see api/services/ingestion_canvas.py) ─────────────
+    # Declared explicitly so a worker without -Q still consumes all of them.
+    task_default_queue="ingestion",
+    task_queues=[
+        Queue("ingestion"),             # Dispatch, chunking, finalize
+        Queue("ingest_extract"),        # Gemini / PyMuPDF / image / video extraction
+        Queue("ingest_docling"),        # Docling extraction — keep concurrency at 1
+        Queue("ingest_embed"),          # Gemini embeddings — I/O bound
+        Queue("ingest_index"),          # ChromaDB upserts, corpus migration slices — single writer process
+    ],
+    task_routes={
+        "ingestion.extract_task": {"queue": "ingest_extract"},  # Docling files are re-routed at dispatch
+        "ingestion.embed_task": {"queue": "ingest_embed"},
+        "ingestion.index_task": {"queue": "ingest_index"},
+        "ingestion.migrate_corpus_task": {"queue": "ingest_index"},
+    },
+
+    # ── Message priority (see api/services/ingestion_queue.py) ────
+    # Redis emulates priorities with one list per step; 0 is consumed first.
+    broker_transport_options={
+        "queue_order_strategy": "priority",
+        "priority_steps": [0, 3, 6, 9],
+    },
+    task_default_priority=0,
+
     # ── Task time limits ──────────────────────────────────────────
     # These are defaults; individual tasks can override with their own limits.
     task_soft_time_limit=840,           # 14 min SIGTERM warning
@@ -85,3 +133,83 @@ def on_task_retry(request, reason, einfo, **kw):
 @task_success.connect
 def on_task_success(result, **kw):
     logger.info("[Celery] Task SUCCESS result=%s", result)
+
+
+# ── Worker event loop ────────────────────────────────────────────────
+# Each worker process keeps one asyncio loop plus Motor/Redis/Chroma handles
+# for its whole life (core/worker_loop.py) instead of reconnecting per task.
+# Started in the process that runs tasks: prefork children, or the main
+# process for solo/threads pools (see _runs_tasks_in_main_process).
+
+
+def _runs_tasks_in_main_process(sender) -> bool:
+    pool = str(getattr(sender, "pool_cls", "")).lower()
+    return "solo" in pool or "thread" in pool
+
+
+def _start_worker_loop() -> None:
+    from core import worker_loop
+    try:
+        worker_loop.start()
+    except Exception as e:
+        logger.warning("[Celery] Worker loop start failed (will retry on first task): %s", e)
+
+
+def _stop_worker_loop() -> None:
+    from core import worker_loop
+    worker_loop.stop()
+
+
+# ── Model pre-warm ───────────────────────────────────────────────────
+# Docling loads its layout/table/OCR models once per worker process instead
+# of once per file. Prefork children warm in worker_process_init; the solo
+# pool (used on Windows, see RUN_GUIDE) and the threads pool never fork, so
+# they warm in worker_init.
+# Loading takes far longer than worker_proc_alive_timeout, so it runs in a
+# background thread; a task that needs a converter meanwhile waits for it
+# (get_docling_converter holds its lock while building).
+# Only the profiles in DOCLING_PREWARM_PROFILES are loaded — each one is a
+# full model set in RAM. Others still load on first use.
+# Set DOCLING_PREWARM=0 to skip (e.g. for embed-only workers).
+
+DOCLING_PREWARM = os.getenv("DOCLING_PREWARM", "1") != "0"
+DOCLING_PREWARM_PROFILES = [  # "text" is what triage sends to the Docling tier
+    p.strip() for p in os.getenv("DOCLING_PREWARM_PROFILES", "text").split(",") if p.strip()
+]
+
+
+def _prewarm_docling() -> None:
+    if not DOCLING_PREWARM:
+        return
+
+    def _warm() -> None:
+        from api.services.ingestion import warm_docling
+        try:
+            warm_docling(DOCLING_PREWARM_PROFILES)
+        except Exception as e:
+            logger.warning("[Celery] Docling pre-warm failed (will load lazily): %s", e)
+
+    threading.Thread(target=_warm, name="docling-prewarm", daemon=True).start()
+
+
+@worker_process_init.connect
+def on_worker_process_init(**kw):
+    _start_worker_loop()
+    _prewarm_docling()
+
+
+@worker_process_shutdown.connect
+def on_worker_process_shutdown(**kw):
+    _stop_worker_loop()
+
+
+@worker_init.connect
+def on_worker_init(sender=None, **kw):
+    if _runs_tasks_in_main_process(sender):
+        _start_worker_loop()
+        _prewarm_docling()
+
+
+@worker_shutdown.connect
+def on_worker_shutdown(**kw):
+    _stop_worker_loop()
@@ -0,0 +1,181 @@
+"""
+embedding_cache.py — Content-addressed embedding cache (Redis)
+==============================================================
+
+Maps sha256(model, task_type, normalized text) → embedding vector so that
+retries, re-uploads and the same material in several classrooms never pay
+for the same embed_content call twice.
+
+Storage layout (all keys share the EMBED_CACHE_PREFIX):
+  emb_cache:v:<digest>   base64 float32 vector
+  emb_cache:lru          sorted set, member=digest, score=last access time
+  emb_cache:bytes        running total of stored vector bytes
+  emb_cache:stats        hash of hits / misses / writes / evictions
+
+When emb_cache:bytes exceeds EMBED_CACHE_MAX_BYTES the least recently used
+entries are evicted. Redis errors never fail the caller — they count as misses.
+"""
+
+from __future__ import annotations
+
+import array
+import base64
+import hashlib
+import logging
+import os
+import re
+import time
+import unicodedata
+from typing import Optional
+
+from database.redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+EMBED_CACHE_PREFIX = "emb_cache"
+EMBED_CACHE_MAX_BYTES = int(os.getenv("EMBED_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))  # 512 MB
+EMBED_CACHE_EVICT_BATCH = 256
+
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """NFC-normalise and collapse whitespace so trivially different chunks share an entry."""
+    return _WS_RE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+def cache_key(model: str, task_type: str, text: str) -> str:
+    payload = f"{model}\x00{task_type}\x00{normalize_text(text)}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _encode(vector: list[float]) -> str:
+    return base64.b64encode(array.array("f", vector).tobytes()).decode("ascii")
+
+
+def _decode(raw: str) -> list[float]:
+    return array.array("f", base64.b64decode(raw)).tolist()
+
+
+class EmbeddingCache:
+    """Redis-backed vector cache with LRU eviction by total stored bytes."""
+
+    def __init__(self, prefix: str = EMBED_CACHE_PREFIX, max_bytes: int = EMBED_CACHE_MAX_BYTES):
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        # In-process counters (the Redis stats hash aggregates across workers)
+        self.hits = 0
+        self.misses = 0
+
+    def _vkey(self, digest: str) -> str:
+        return f"{self.prefix}:v:{digest}"
+
+    # ── Public API ──────────────────────────────────────────────────
+
+    async def get_many(self, model: str, task_type: str, texts: list[str]) -> list[Optional[list[float]]]:
+        """Return one cached vector (or None) per input text, in order."""
+        if not texts:
+            return []
+        digests = [cache_key(model, task_type, t) for t in texts]
+        try:
+            redis = await get_redis()
+            raws = await redis.mget([self._vkey(d) for d in digests])
+        except Exception as e:
+            logger.warning("[embedding_cache] Lookup failed: %s", e)
+            self.misses += len(texts)
+            return [None] * len(texts)
+
+        results = [_decode(raw) if raw else None for raw in raws]
+        hit_digests = [d for d, r in zip(digests, results) if r is not None]
+        hits, misses = len(hit_digests), len(texts) - len(hit_digests)
+        self.hits += hits
+        self.misses += misses
+
+        try:
+            pipe = redis.pipeline(transaction=False)
+            if hit_digests:
+                now = time.time()
+                pipe.zadd(f"{self.prefix}:lru", {d: now for d in hit_digests})
+                pipe.hincrby(f"{self.prefix}:stats", "hits", hits)
+            if misses:
+                pipe.hincrby(f"{self.prefix}:stats", "misses", misses)
+            await pipe.execute()
+        except Exception as e:
+            logger.warning("[embedding_cache] Stats update failed: %s", e)
+
+        return results
+
+    async def put_many(self, model: str, task_type: str, texts: list[str], vectors: list[list[float]]) -> None:
+        """Store vectors for texts, then evict LRU entries if over the byte budget."""
+        if not texts:
+            return
+        try:
+            redis = await get_redis()
+            now = time.time()
+            encoded = {cache_key(model, task_type, t): _encode(v) for t, v in zip(texts, vectors)}
+
+            # SET NX: a text another batch already stored is not rewritten or counted twice
+            pipe = redis.pipeline(transaction=False)
+            for d, e in encoded.items():
+                pipe.set(self._vkey(d), e, nx=True)
+            pipe.zadd(f"{self.prefix}:lru", {d: now for d in encoded})
+            created = (await pipe.execute())[:len(encoded)]
+            new_entries = [e for e, ok in zip(encoded.values(), created) if ok]
+            if not new_entries:
+                return
+
+            pipe = redis.pipeline(transaction=False)
+            pipe.incrby(f"{self.prefix}:bytes", sum(len(e) for e in new_entries))
+            pipe.hincrby(f"{self.prefix}:stats", "writes", len(new_entries))
+            results = await pipe.execute()
+
+            if int(results[0]) > self.max_bytes:
+                await self._evict(redis)
+        except Exception as e:
+            logger.warning("[embedding_cache] Write failed: %s", e)
+
+    async def stats(self) -> dict:
+        """Aggregate counters across all processes, plus current size."""
+        redis = await get_redis()
+        raw = await redis.hgetall(f"{self.prefix}:stats")
+        entries = await redis.zcard(f"{self.prefix}:lru")
+        size = int(await redis.get(f"{self.prefix}:bytes") or 0)
+        hits, misses = int(raw.get("hits", 0)), int(raw.get("misses", 0))
+        lookups = hits + misses
+        return {
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "writes": int(raw.get("writes", 0)),
+            "evictions": int(raw.get("evictions", 0)),
+            # Every hit is one embedding Gemini did not have to compute
+            "embeddings_saved": hits,
+        }
+
+    # ── Eviction ────────────────────────────────────────────────────
+
+    async def _evict(self, redis) -> None:
+        evicted = 0
+        while int(await redis.get(f"{self.prefix}:bytes") or 0) > self.max_bytes:
+            oldest = await redis.zpopmin(f"{self.prefix}:lru", EMBED_CACHE_EVICT_BATCH)
+            if not oldest:
+                break
+            vkeys = [self._vkey(d) for d, _ in oldest]
+            pipe = redis.pipeline(transaction=False)
+            for k in vkeys:
+                pipe.strlen(k)
+            sizes = await pipe.execute()
+            pipe = redis.pipeline(transaction=False)
+            pipe.delete(*vkeys)
+            pipe.decrby(f"{self.prefix}:bytes", sum(int(s) for s in sizes))
+            pipe.hincrby(f"{self.prefix}:stats", "evictions", len(vkeys))
+            await pipe.execute()
+            evicted += len(vkeys)
+        if evicted:
+            logger.info("[embedding_cache] Evicted %d LRU entries", evicted)
+
+
+embedding_cache = EmbeddingCache()
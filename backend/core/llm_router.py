@@ -16,6 +16,10 @@ Each pool reads from its own env var, then falls back to the shared pool:
 This means you can run with a single key (all pools fall back to it),
 or distribute load across multiple keys per pool.
 
+CLIENTS: each key's genai.Client is built once (per event loop — the async
+transport belongs to the loop it first ran on) and shared by every caller,
+so TLS sessions and keep-alive connections are reused across requests.
+
 MODEL CHAINS (ordered: best first, most stable last):
   ROUTER_CHAIN     : [gemini-2.0-flash-lite, gemini-1.5-flash-8b, gemini-1.5-flash]
   CHAT_CHAIN       : [gemini-1.5-flash, gemini-1.5-pro, gemini-2.0-flash]
@@ -30,8 +34,10 @@ import asyncio
 import logging
 import os
 import time
+import weakref
 from typing import Any, List, Optional
 
+import httpx
 from dotenv import load_dotenv
 from google import genai
 from google.genai import types
@@ -43,6 +49,19 @@ load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+GEMINI_KEEPALIVE_S = float(os.getenv("GEMINI_KEEPALIVE_S", "60"))  # Idle connections kept open per key
+GEMINI_MAX_CONNECTIONS = 32     # Per key and transport (sync / async)
+
+
+def _http_options() -> types.HttpOptions:
+    """Transport settings for pooled clients: keep idle connections warm between requests."""
+    limits = httpx.Limits(
+        max_connections=GEMINI_MAX_CONNECTIONS,
+        max_keepalive_connections=GEMINI_MAX_CONNECTIONS,
+        keepalive_expiry=GEMINI_KEEPALIVE_S,
+    )
+    return types.HttpOptions(client_args={"limits": limits}, async_client_args={"limits": limits})
+
 
 # ══════════════════════════════════════════════════════════════════════
 # Key Manager
@@ -81,6 +100,11 @@ class GeminiKeyManager:
         self._unhealthy: dict[int, float] = {}  # {key_index: expiry_timestamp}
         self._idx = 0
 
+        # One client per key: per running event loop, plus one for callers outside a loop
+        self._loop_clients: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[str, genai.Client]] = \
+            weakref.WeakKeyDictionary()
+        self._sync_clients: dict[str, genai.Client] = {}
+
     # ── Public API ──────────────────────────────────────────────────
 
     def get_client(self) -> tuple[genai.Client, str]:
@@ -97,7 +121,7 @@ class GeminiKeyManager:
             self._idx += 1
             if idx not in self._unhealthy:
                 key = self.keys[idx]
-                return genai.Client(api_key=key), key
+                return self.client_for_key(key), key
 
         # All keys in penalty box — back off and retry
         wait = 5
@@ -116,6 +140,23 @@ class GeminiKeyManager:
         except ValueError:
             pass
 
+    def healthy_keys(self) -> List[str]:
+        """Return keys that are not currently in the penalty box, in pool order."""
+        now = time.time()
+        return [k for i, k in enumerate(self.keys) if self._unhealthy.get(i, 0) <= now]
+
+    def client_for_key(self, key: str) -> genai.Client:
+        """Return the shared client bound to a specific key (for callers that schedule keys themselves)."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        clients = self._sync_clients if loop is None else self._loop_clients.setdefault(loop, {})
+        client = clients.get(key)
+        if client is None:
+            client = clients[key] = genai.Client(api_key=key, http_options=_http_options())
+        return client
+
     @property
     def has_keys(self) -> bool:
         return bool(self.keys)
@@ -0,0 +1,112 @@
+"""
+worker_loop.py — One long-lived asyncio loop per Celery worker process
+=====================================================================
+
+Celery tasks are synchronous; ingestion is async. Instead of asyncio.run()
+per task (new loop, new Motor client, reopened Chroma PersistentClient,
+new Redis connection), each worker process keeps:
+
+  - one event loop, running forever in a daemon thread
+  - Motor, Redis and Chroma handles opened once on that loop at startup
+
+run(coro_fn) submits a task's coroutine to the loop and blocks until it
+finishes, so prefork, solo and threads pools all share one loop per process.
+start()/stop() are wired to the worker signals in core/celery_app.py; run()
+also starts the loop lazily (e.g. when a task is called outside a worker).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+from typing import Awaitable, Callable, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+CANCEL_GRACE_S = 10  # How long an interrupted task's coroutine may spend cleaning up
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_thread: Optional[threading.Thread] = None
+_lock = threading.Lock()
+
+
+async def _open_handles() -> None:
+    from database.chroma import connect_chroma
+    from database.mongo import connect_db
+    from database.redis import get_redis
+    await connect_db()
+    connect_chroma()
+    await get_redis()  # Bind the Redis client to this loop before any task uses it
+
+
+async def _close_handles() -> None:
+    from database.mongo import close_db
+    from database.redis import RedisManager
+    await close_db()
+    await RedisManager.close()
+
+
+def start() -> asyncio.AbstractEventLoop:
+    """Start the loop thread and open the shared handles (idempotent)."""
+    global _loop, _thread
+    with _lock:
+        if _loop is not None:
+            return _loop
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever, name="worker-loop", daemon=True)
+        thread.start()
+        try:
+            asyncio.run_coroutine_threadsafe(_open_handles(), loop).result()
+        except BaseException:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+            raise
+        _loop, _thread = loop, thread
+        logger.info("[worker_loop] Event loop started; MongoDB/ChromaDB/Redis handles open")
+        return loop
+
+
+def run(coro_fn: Callable[[], Awaitable[T]]) -> T:
+    """
+    Run one task's coroutine on the worker loop and return its result.
+    If the calling thread is interrupted (e.g. Celery's SoftTimeLimitExceeded),
+    the coroutine is cancelled and given CANCEL_GRACE_S to handle it before
+    the exception propagates.
+    """
+    loop = start()
+    finished = threading.Event()
+
+    async def _runner() -> T:
+        try:
+            return await coro_fn()
+        finally:
+            finished.set()
+
+    future = asyncio.run_coroutine_threadsafe(_runner(), loop)
+    try:
+        return future.result()
+    except BaseException:
+        future.cancel()
+        finished.wait(CANCEL_GRACE_S)  # Let the coroutine record the failure before we unwind
+        raise
+
+
+def stop() -> None:
+    """Close the shared handles and stop the loop (worker shutdown)."""
+    global _loop, _thread
+    with _lock:
+        if _loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(_close_handles(), _loop).result(timeout=10)
+        except Exception as e:
+            logger.warning("[worker_loop] Error closing handles: %s", e)
+        _loop.call_soon_threadsafe(_loop.stop)
+        _thread.join(timeout=10)
+        _loop.close()
+        _loop, _thread = None, None
+        logger.info("[worker_loop] Event loop stopped")
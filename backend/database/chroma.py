@@ -1,25 +1,121 @@
-"""ChromaDB persistent client singleton."""
+"""
+ChromaDB persistent client singleton + versioned vector collections.
+
+Vectors are only comparable within the embedding model and chunking that
+produced them, so a collection is one index version:
+
+  {"collection": "campus_vectors", "embed_model": "...", "chunk_tokens": 256}
+
+chunk_tokens is None for the legacy index (DEFAULT_INDEX), which was chunked
+by character count rather than a token budget.
+
+Which version serves queries is recorded in CHROMA_PATH/active_index.json
+({"active": {...}, "building": {...} | null}), replaced atomically by a
+corpus migration (api/services/corpus_migration.py). Every process sharing
+the Chroma directory notices the switch on its next get_chroma_collection().
+"""
+
+import json
+import os
+from typing import Optional
 
 import chromadb
 from chromadb.api.models.Collection import Collection
 
 CHROMA_PATH = "./chroma_data"
 COLLECTION_NAME = "campus_vectors"
+INDEX_POINTER_PATH = os.path.join(CHROMA_PATH, "active_index.json")
+
+# What campus_vectors was built with before index versions were recorded.
+# Its chunks came from the 800-char RecursiveCharacterTextSplitter (overlap 100),
+# which no token budget reproduces: chunk_tokens=None marks it, and files still
+# ingested into it are chunked with the default budget (chunker.CHUNK_TOKENS).
+DEFAULT_INDEX = {
+    "collection": COLLECTION_NAME,
+    "embed_model": "models/gemini-embedding-001",
+    "chunk_tokens": None,
+}
 
 chroma_client: chromadb.ClientAPI = None  # type: ignore[assignment]
 campus_collection: Collection = None  # type: ignore[assignment]
 
+_collections: dict[str, Collection] = {}
+_pointer: dict = {"active": DEFAULT_INDEX, "building": None}
+_pointer_stamp: Optional[tuple[int, int]] = None
+
 
 def connect_chroma() -> None:
-    """Initialise the PersistentClient and get or create the collection."""
+    """Initialise the PersistentClient and get or create the active collection."""
     global chroma_client, campus_collection
     chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
-    campus_collection = chroma_client.get_or_create_collection(
-        name=COLLECTION_NAME,
-        metadata={"hnsw:space": "cosine"},
-    )
+    _collections.clear()
+    campus_collection = get_chroma_collection()
+
+
+def _read_pointer() -> dict:
+    """The pointer file, re-read only when it was replaced (one stat per call)."""
+    global _pointer, _pointer_stamp
+    try:
+        st = os.stat(INDEX_POINTER_PATH)
+    except FileNotFoundError:
+        _pointer, _pointer_stamp = {"active": DEFAULT_INDEX, "building": None}, None
+        return _pointer
+    stamp = (st.st_ino, st.st_mtime_ns)
+    if stamp != _pointer_stamp:
+        with open(INDEX_POINTER_PATH, encoding="utf-8") as fh:
+            _pointer = json.load(fh)
+        _pointer_stamp = stamp
+    return _pointer
+
+
+def active_index() -> dict:
+    """The index version queries and new ingestion runs use."""
+    return _read_pointer()["active"]
+
+
+def building_index() -> Optional[dict]:
+    """The index version a running migration is filling, if any."""
+    return _read_pointer().get("building")
+
+
+def write_index_pointer(active: dict, building: Optional[dict]) -> None:
+    """Replace the pointer file atomically — the switch is a single rename."""
+    os.makedirs(CHROMA_PATH, exist_ok=True)
+    tmp = INDEX_POINTER_PATH + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump({"active": active, "building": building}, fh)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, INDEX_POINTER_PATH)
+
+
+def get_collection(name: str) -> Collection:
+    """A collection handle by name, created on first use."""
+    if name not in _collections:
+        _collections[name] = chroma_client.get_or_create_collection(
+            name=name,
+            metadata={"hnsw:space": "cosine"},
+        )
+    return _collections[name]
+
+
+def drop_collection(name: str) -> None:
+    _collections.pop(name, None)
+    chroma_client.delete_collection(name)
 
 
 def get_chroma_collection() -> Collection:
-    """Return the current campus_vectors collection handle."""
-    return campus_collection
+    """Return the handle of the collection currently serving queries."""
+    return get_collection(active_index()["collection"])
+
+
+def index_of(processing: dict) -> dict:
+    """The index version a file's vectors were written to (processing.index)."""
+    return processing.get("index") or DEFAULT_INDEX
+
+
+def delete_vectors(where: dict) -> None:
+    """Delete matching vectors from the active collection and from one being built."""
+    get_chroma_collection().delete(where=where)
+    if building := building_index():
+        get_collection(building["collection"]).delete(where=where)
@@ -12,9 +12,11 @@ from fastapi.staticfiles import StaticFiles
 from core.config import settings
 from core.security import hash_password
 from database.mongo import connect_db, close_db, get_db
-from database.chroma import connect_chroma
+from database.chroma import active_index, connect_chroma
 from database.redis import get_redis
 from core.websocket import manager
+from api.services.ingestion_queue import fair_dispatcher
+from api.services.leases import lease_sweeper
 import asyncio
 
 logger = logging.getLogger(__name__)
@@ -75,10 +77,25 @@ async def lifespan(app: FastAPI):
     await db.classrooms.create_index("members.user_id")          # For classroom listing by user
 
     # Files
-    await db.file_metadata.create_index("sha256_hash", unique=True)
+    # One record per file per classroom; classrooms share content (api/services/content_refs.py)
+    sha_index = (await db.file_metadata.index_information()).get("sha256_hash_1", {})
+    if sha_index.get("unique"):
+        await db.file_metadata.drop_index("sha256_hash_1")
+    await db.file_metadata.create_index("sha256_hash")
+    await db.file_metadata.create_index([("sha256_hash", 1), ("classroom_id", 1)], unique=True)
+    await db.file_metadata.create_index("content_id", sparse=True)
     await db.file_metadata.create_index("file_id", unique=True)
     await db.file_metadata.create_index([("classroom_id", 1), ("uploaded_at", -1)])
     await db.file_metadata.create_index("processing.status")
+    await db.upload_sessions.create_index("upload_id", unique=True)
+    await db.upload_sessions.create_index([("sha256", 1), ("uploaded_by", 1)])
+    await db.upload_sessions.create_index("expires_at")
+    await db.chunk_fingerprints.create_index("file_id", unique=True)
+    await db.chunk_fingerprints.create_index("classroom_id")
+    await db.ingestion_usage.create_index([("classroom_id", 1), ("day", 1)], unique=True)
+    await db.corpus_migrations.create_index("migration_id", unique=True)
+    await db.corpus_migrations.create_index("status")
+    await db.corpus_migration_files.create_index([("migration_id", 1), ("file_id", 1)], unique=True)
 
     # Chat
     await db.chat_sessions.create_index("session_id", unique=True)
@@ -100,11 +117,17 @@ async def lifespan(app: FastAPI):
 
     # ── 3. Connect ChromaDB ────────────────────────────────────────
     connect_chroma()
-    print("[OK] ChromaDB connected (campus_vectors collection ready)")
+    print(f"[OK] ChromaDB connected ({active_index()['collection']} collection ready)")
 
     # ── 4. Start WebSocket Redis listener ─────────────────────────
     asyncio.create_task(manager.listen_to_redis())
 
+    # ── 4b. Requeue ingestion jobs whose worker died (expired leases)
+    asyncio.create_task(lease_sweeper())
+
+    # ── 4c. Admit queued ingestion jobs into Celery (priority + fair share)
+    asyncio.create_task(fair_dispatcher())
+
     # ── 5. Seed superadmin ─────────────────────────────────────────
     await _seed_superadmin()
 
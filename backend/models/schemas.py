@@ -54,6 +54,18 @@ class ProvisionTeacherBody(BaseModel):
     }}
 
 
+class IngestionBudgetBody(BaseModel):
+    """Superadmin overrides a classroom's daily ingestion budget (omitted = server default, 0 = unlimited)."""
+    api_calls: Optional[int] = Field(None, ge=0)
+    worker_minutes: Optional[float] = Field(None, ge=0)
+
+
+class CorpusMigrationBody(BaseModel):
+    """Superadmin re-embeds / re-chunks the corpus into a new collection (omitted = keep the active value)."""
+    embed_model: Optional[str] = Field(None, min_length=1, max_length=100)
+    chunk_tokens: Optional[int] = Field(None, ge=64, le=2048)
+
+
 class ClassroomCreate(BaseModel):
     """Teacher creates a new classroom."""
     name: str = Field(..., min_length=1, max_length=200, strip_whitespace=True)
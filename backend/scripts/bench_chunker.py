@@ -0,0 +1,153 @@
+"""
+bench_chunker.py — Structure-aware chunker vs RecursiveCharacterTextSplitter
+
+Chunks a corpus of extractions both ways and reports throughput, chunk count
+(= embedding calls and stored vectors), chunk size and how many chunks cut
+through a code fence or a $$ block:
+
+  recursive   what ingestion did before: langchain RecursiveCharacterTextSplitter
+              (800 chars, 100 overlap) run on every page/section separately
+  markdown    services/chunker.py: markdown blocks packed to CHUNK_TOKENS
+              across pages
+
+The corpus defaults to the stored extraction artifacts (storage/artifacts/
+*/*.md.gz, i.e. real Gemini / Docling / PyMuPDF output); without any, a
+synthetic corpus of lecture slides and textbook pages is generated.
+
+Usage:
+    cd backend
+    uv run python scripts/bench_chunker.py
+    uv run python scripts/bench_chunker.py path/to/extractions/ --runs 5
+    uv run python scripts/bench_chunker.py --synthetic 200
+"""
+
+from __future__ import annotations
+
+import argparse
+import gzip
+import os
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.services.artifacts import ARTIFACT_DIR  # noqa: E402
+from api.services.chunker import approx_tokens, chunk_sections  # noqa: E402
+from api.services.ingestion import _iter_sections  # noqa: E402
+
+SENTENCES = [
+    "Paging divides physical memory into fixed-size frames and logical memory into pages.",
+    "The TLB caches recent page-table entries, so most translations avoid a memory access.",
+    "LRU evicts the page that has not been used for the longest time.",
+    "Belady's anomaly shows FIFO can fault more often with more frames.",
+    "A working set is the set of pages referenced in the last Δ references.",
+    "Thrashing occurs when the sum of working sets exceeds the available frames.",
+]
+
+
+def _synthetic_textbook(rng: random.Random, pages: int) -> str:
+    """PyMuPDF-style output: a page marker, then plain paragraphs."""
+    return "\n\n".join(
+        f"[Page {n}]\n" + "\n\n".join(
+            " ".join(rng.choice(SENTENCES) for _ in range(rng.randint(3, 10)))
+            for _ in range(rng.randint(2, 6))
+        )
+        for n in range(1, pages + 1)
+    )
+
+
+def _synthetic_slides(rng: random.Random, pages: int) -> str:
+    """Gemini / Docling-style markdown: headed slides with bullets, tables, LaTeX and code."""
+    out = []
+    for n in range(1, pages + 1):
+        parts = [f"[Page {n}]", f"## Slide {n}: {rng.choice(['Paging', 'TLB', 'Replacement', 'Thrashing'])}"]
+        parts += [f"- {rng.choice(SENTENCES)}" for _ in range(rng.randint(2, 6))]
+        roll = rng.random()
+        if roll < 0.15:
+            rows = "\n".join(f"| {i} | {rng.randint(1, 99)} | {rng.randint(1, 99)} |" for i in range(rng.randint(3, 30)))
+            parts.append(f"| Frames | FIFO | LRU |\n|---|---|---|\n{rows}")
+        elif roll < 0.25:
+            parts.append("$$\nEAT = (1 - p) \\times t_{mem} + p \\times t_{fault}\n$$")
+        elif roll < 0.35:
+            body = "\n".join(f"    frames[{i}] = load(page_table[{i}])" for i in range(rng.randint(3, 40)))
+            parts.append(f"```python\ndef fill(frames, page_table):\n{body}\n```")
+        elif roll < 0.6:
+            parts.append(" ".join(rng.choice(SENTENCES) for _ in range(rng.randint(5, 25))))
+        out.append("\n\n".join(parts))
+    return "\n\n".join(out)
+
+
+def load_corpus(paths: list[str], synthetic: int) -> list[str]:
+    files: list[Path] = []
+    for p in map(Path, paths or [str(ARTIFACT_DIR)]):
+        if p.is_dir():
+            files += sorted(f for f in p.rglob("*") if f.suffix in (".md", ".txt") or f.name.endswith(".md.gz"))
+        elif p.exists():
+            files.append(p)
+    docs = []
+    for f in files:
+        opener = gzip.open if f.suffix == ".gz" else open
+        with opener(f, "rt", encoding="utf-8") as fh:
+            docs.append(fh.read())
+    if docs and not synthetic:
+        return docs
+    rng = random.Random(42)
+    return docs + [
+        (_synthetic_slides if i % 2 else _synthetic_textbook)(rng, rng.randint(10, 120))
+        for i in range(synthetic or 100)
+    ]
+
+
+def recursive_chunks(doc: str, splitter) -> list[str]:
+    return [text for _, section in _iter_sections(doc) for text in splitter.split_text(section)]
+
+
+def markdown_chunks(doc: str) -> list[str]:
+    return [chunk.text for chunk in chunk_sections(_iter_sections(doc))]
+
+
+def _broken(text: str) -> bool:
+    """Chunk that opens or closes a code fence / $$ block without the other half."""
+    fences = sum(1 for line in text.split("\n") if line.strip().startswith(("```", "~~~")))
+    return fences % 2 == 1 or text.count("$$") % 2 == 1
+
+
+def _bench(label: str, fn, corpus: list[str], runs: int) -> list[str]:
+    times = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        chunks = [text for doc in corpus for text in fn(doc)]
+        times.append(time.perf_counter() - t0)
+    elapsed = statistics.median(times)
+    sizes = sorted(approx_tokens(c) for c in chunks)
+    mb = sum(len(d) for d in corpus) / 1e6
+    print(f"{label:<12} {len(chunks):>8} chunks  {len(chunks) / elapsed:>10.0f} chunks/s  "
+          f"{mb / elapsed:6.1f} MB/s  tokens/chunk mean {statistics.mean(sizes):5.0f} "
+          f"p95 {sizes[int(len(sizes) * 0.95)]:4d}  broken {sum(map(_broken, chunks)):>5}")
+    return chunks
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="*", help="Extraction files or directories (.md, .txt, .md.gz)")
+    parser.add_argument("--runs", type=int, default=3, help="Timed passes per chunker (median reported)")
+    parser.add_argument("--synthetic", type=int, default=0, help="Add this many synthetic lecture docs")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.paths, args.synthetic)
+    print(f"Corpus: {len(corpus)} documents, {sum(len(d) for d in corpus) / 1e6:.1f} MB\n")
+
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    splitter = RecursiveCharacterTextSplitter(chunk_size=800, chunk_overlap=100)
+
+    baseline = _bench("recursive", lambda doc: recursive_chunks(doc, splitter), corpus, args.runs)
+    native = _bench("markdown", markdown_chunks, corpus, args.runs)
+    print(f"\nChunk count (embedding calls / stored vectors): "
+          f"{100 * (1 - len(native) / len(baseline)):.1f}% fewer")
+
+
+if __name__ == "__main__":
+    main()
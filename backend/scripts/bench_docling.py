@@ -0,0 +1,71 @@
+"""
+bench_docling.py — Cold vs warm Docling cost (Tier 2 extraction)
+
+Compares the old per-file behaviour (build a fresh DocumentConverter for every
+document) with the worker's pre-warmed, per-profile converters.
+
+Usage:
+    cd backend
+    uv run python scripts/bench_docling.py path/to/lecture.pdf
+    uv run python scripts/bench_docling.py path/to/lecture.pdf --runs 3 --profiles fast text
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.services.ingestion import (  # noqa: E402
+    DOCLING_PROFILES,
+    _choose_docling_profile,
+    get_docling_converter,
+)
+
+
+def _timed(fn) -> tuple[float, object]:
+    t0 = time.perf_counter()
+    out = fn()
+    return time.perf_counter() - t0, out
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdf", help="PDF to convert")
+    parser.add_argument("--runs", type=int, default=2, help="Warm conversions per profile")
+    parser.add_argument("--profiles", nargs="+", default=list(DOCLING_PROFILES), choices=list(DOCLING_PROFILES))
+    args = parser.parse_args()
+
+    print(f"Document: {args.pdf}")
+    t_pick, picked = _timed(lambda: _choose_docling_profile(args.pdf))
+    print(f"Auto-selected profile: {picked} (detection {t_pick:.2f}s)\n")
+
+    # ── Cold: what every file paid before (new converter + first convert) ──
+    from docling.document_converter import DocumentConverter
+
+    def _cold():
+        return DocumentConverter().convert(args.pdf).document.export_to_markdown()
+
+    t_cold, text = _timed(_cold)
+    print(f"{'cold (new converter per file)':<34} {t_cold:8.2f}s  {len(text):>8} chars")
+
+    # ── Warm: converter built once at worker start, reused per document ──
+    for profile in args.profiles:
+        t_build, converter = _timed(lambda: get_docling_converter(profile))
+        print(f"{'startup build [' + profile + ']':<34} {t_build:8.2f}s")
+        for run in range(1, args.runs + 1):
+            t_warm, text = _timed(
+                lambda: converter.convert(args.pdf).document.export_to_markdown()
+            )
+            print(f"{'  warm convert [' + profile + '] #' + str(run):<34} {t_warm:8.2f}s  {len(text):>8} chars")
+
+
+if __name__ == "__main__":
+    main()
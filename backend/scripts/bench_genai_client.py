@@ -0,0 +1,204 @@
+"""
+bench_genai_client.py — Per-call overhead: a new genai.Client per call vs the pooled client
+
+Simulates concurrent chat load: --users sessions each send --requests chat
+requests, and every request makes --calls sequential Gemini calls (router,
+query embedding, synthesis), with --think seconds between requests.
+
+  fresh    what GeminiKeyManager.get_client() did before: genai.Client(api_key=key)
+           on every call — a new SSL context, connection pool and TLS handshake
+  pooled   core.llm_router: one client per key (and event loop) with keep-alive
+
+By default calls go to a local HTTP stand-in for the Gemini API (plain HTTP,
+--server-latency per response) that also counts the TCP connections it
+accepts. --live uses the CHAT pool keys against the real API instead; it
+calls models.get, which costs no generation quota.
+
+Usage:
+    cd backend
+    uv run python scripts/bench_genai_client.py
+    uv run python scripts/bench_genai_client.py --users 50 --requests 20 --think 2
+    uv run python scripts/bench_genai_client.py --live --users 10
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google import genai  # noqa: E402
+from google.genai import types  # noqa: E402
+
+from core import llm_router  # noqa: E402
+from core.llm_router import GeminiKeyManager  # noqa: E402
+
+MODEL = "gemini-2.5-flash"
+
+
+# ══════════════════════════════════════════════════════════════════════
+# Local Gemini API stand-in
+# ══════════════════════════════════════════════════════════════════════
+
+class _StandIn(ThreadingHTTPServer):
+    daemon_threads = True
+    latency = 0.0
+    connections = 0
+
+    def get_request(self):
+        request = super().get_request()
+        self.connections += 1
+        return request
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # Keep-alive
+
+    def _reply(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        time.sleep(self.server.latency)
+        body = json.dumps({"name": f"models/{MODEL}", "displayName": "bench"}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = _reply
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+def _start_stand_in(latency: float) -> _StandIn:
+    server = _StandIn(("127.0.0.1", 0), _Handler)
+    server.latency = latency
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# ══════════════════════════════════════════════════════════════════════
+# Load
+# ══════════════════════════════════════════════════════════════════════
+
+def _fresh_factory(keys: list[str], base_url: str | None):
+    i = 0
+
+    def _get() -> genai.Client:
+        nonlocal i
+        key = keys[i % len(keys)]
+        i += 1
+        http_options = types.HttpOptions(base_url=base_url) if base_url else None
+        return genai.Client(api_key=key, http_options=http_options)
+    return _get
+
+
+def _pooled_factory(pool: GeminiKeyManager):
+    def _get() -> genai.Client:
+        client, _ = pool.get_client()
+        return client
+    return _get
+
+
+async def _run_load(get_client, args: argparse.Namespace) -> dict:
+    acquire: list[float] = []
+    total: list[float] = []
+    errors = 0
+
+    async def _session() -> None:
+        nonlocal errors
+        for _ in range(args.requests):
+            for _ in range(args.calls):
+                t0 = time.perf_counter()
+                client = get_client()
+                t1 = time.perf_counter()
+                try:
+                    await client.aio.models.get(model=MODEL)
+                except Exception as e:
+                    errors += 1
+                    if errors == 1:
+                        print(f"  first error: {str(e)[:200]}")
+                acquire.append(t1 - t0)
+                total.append(time.perf_counter() - t0)
+            await asyncio.sleep(args.think)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(_session() for _ in range(args.users)))
+    elapsed = time.perf_counter() - t0
+
+    def _ms(values: list[float], q: float) -> float:
+        return round(statistics.quantiles(values, n=100)[int(q) - 1] * 1000, 2) if len(values) > 1 else 0.0
+
+    return {
+        "calls": len(total),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 2),
+        "calls_per_s": round(len(total) / elapsed, 1),
+        "acquire_mean_ms": round(statistics.mean(acquire) * 1000, 3),
+        "call_p50_ms": _ms(total, 50),
+        "call_p95_ms": _ms(total, 95),
+        "call_mean_ms": round(statistics.mean(total) * 1000, 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20, help="Concurrent chat sessions")
+    parser.add_argument("--requests", type=int, default=10, help="Chat requests per session")
+    parser.add_argument("--calls", type=int, default=3, help="Gemini calls per chat request")
+    parser.add_argument("--think", type=float, default=0.5, help="Seconds between a session's requests")
+    parser.add_argument("--keys", type=int, default=3, help="Fake keys (local stand-in only)")
+    parser.add_argument("--server-latency", type=float, default=0.02, help="Stand-in response time (s)")
+    parser.add_argument("--live", action="store_true", help="Call the real API with the CHAT pool keys")
+    args = parser.parse_args()
+
+    server = None
+    if args.live:
+        pool = GeminiKeyManager("BENCH", ["GEMINI_CHAT_KEYS", "GEMINI_API_KEYS", "GEMINI_API_KEY"])
+        if not pool.has_keys:
+            sys.exit("--live needs GEMINI_CHAT_KEYS / GEMINI_API_KEYS / GEMINI_API_KEY")
+        base_url = None
+    else:
+        server = _start_stand_in(args.server_latency)
+        base_url = f"http://127.0.0.1:{server.server_address[1]}/"
+        os.environ["BENCH_GEMINI_KEYS"] = ",".join(f"bench-key-{i:04d}" for i in range(args.keys))
+        pool = GeminiKeyManager("BENCH", ["BENCH_GEMINI_KEYS"])
+        pooled_options = llm_router._http_options
+
+        def _local_options() -> types.HttpOptions:
+            return pooled_options().model_copy(update={"base_url": base_url})
+        llm_router._http_options = _local_options
+
+    print(f"{args.users} sessions × {args.requests} requests × {args.calls} calls, "
+          f"{len(pool.keys)} key(s), {'live API' if args.live else base_url}\n")
+
+    for mode, factory in (("fresh", _fresh_factory(pool.keys, base_url)), ("pooled", _pooled_factory(pool))):
+        if server:
+            server.connections = 0
+        result = asyncio.run(_run_load(factory, args))
+        connections = f"  {server.connections:>5} connections" if server else ""
+        print(f"{mode:<7} {result['calls']:>6} calls  {result['calls_per_s']:>8}/s  "
+              f"client {result['acquire_mean_ms']:>8} ms  "
+              f"call p50 {result['call_p50_ms']:>7} ms  p95 {result['call_p95_ms']:>7} ms"
+              f"{connections}  {result['errors']} errors")
+
+    if server:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,459 @@
+"""
+bench_ingestion.py — Ingestion throughput against a fake Gemini
+
+Runs the real _process_file_async pipeline (services/ingestion.py) over a
+synthetic PDF corpus, with google.genai.Client replaced by a local fake, so
+throughput can be measured and tracked without API keys or quota:
+
+  files.upload / get / delete      returns an ACTIVE handle for the local path
+  aio.models.generate_content      returns the PDF's own text with [Page N] markers,
+                                   numbered from the page the prompt asks for
+  aio.models.embed_content         deterministic unit vectors (blake2b of the text)
+
+Every fake call sleeps for its configured latency (± jitter) and fails with
+"429 RESOURCE_EXHAUSTED" with probability --rate-429, so key rotation, the
+penalty box and AIMD back-off run as they would against the real API.
+
+Reports, per run:
+  stages      mean seconds from run start until each pipeline stage drained,
+              time to first searchable vectors, and extraction tier timings
+  api         calls, injected 429s and busy seconds per fake endpoint
+  throughput  docs/min, chunks/s and peak RSS
+
+--baseline PATH compares against a saved result (same options only) and exits
+with status 1 if docs/min or chunks/s drop, or peak RSS grows, by more than
+--max-regression; --update-baseline writes this run there instead.
+
+Needs the MongoDB from docker-compose (a throwaway <MONGO_DB>_bench database
+is created and dropped). ChromaDB and artifacts go to a temporary directory.
+The embedding cache is bypassed unless --with-cache (then Redis is used).
+
+Usage:
+    cd backend
+    uv run python scripts/bench_ingestion.py
+    uv run python scripts/bench_ingestion.py --tier gemini --docs 20 --pages 40 --keys 4
+    uv run python scripts/bench_ingestion.py --tier gemini --rate-429 0.05 --generate-latency 3
+    uv run python scripts/bench_ingestion.py --baseline scripts/bench_ingestion_baseline.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from types import SimpleNamespace
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+EMBED_DIM = 3072    # gemini-embedding-001
+BENCH_CLASSROOM = "bench_ingestion"
+STAGES = ["extract", "chunk", "embed", "upsert"]
+
+_WORDS = (
+    "matrix vector gradient entropy protocol kernel lattice tensor theorem proof "
+    "circuit voltage enzyme protein market demand supply inflation syntax grammar "
+    "algorithm recursion graph node edge cache memory thread process signal filter "
+    "integral derivative limit series proton electron orbital bond reaction catalyst"
+).split()
+
+_PAGE_FROM_RE = re.compile(r"numbering pages from (\d+)")
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20
+
+
+def build_corpus_pdf(path: str, pages: int, seed: int) -> None:
+    """A text-native PDF whose wording differs per seed (identical docs would be deduplicated)."""
+    import fitz  # PyMuPDF
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for n in range(1, pages + 1):
+        page = doc.new_page()
+        lines = [f"Section {n}: {' '.join(rng.choices(_WORDS, k=4))}", ""]
+        for _ in range(36):
+            lines.append(" ".join(rng.choices(_WORDS, k=12)))
+        page.insert_text((36, 40), "\n".join(lines), fontsize=8)
+    doc.save(path)
+    doc.close()
+
+
+# ══════════════════════════════════════════════════════════════════════
+# Fake google.genai.Client
+# ══════════════════════════════════════════════════════════════════════
+
+class FakeGemini:
+    """Shared behaviour and counters of every FakeGeminiClient in a run."""
+
+    def __init__(self, latency: dict[str, float], jitter: float, rate_429: float, seed: int):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.rng = random.Random(seed)
+        self.calls: dict[str, int] = defaultdict(int)
+        self.rejected: dict[str, int] = defaultdict(int)
+        self.busy_s: dict[str, float] = defaultdict(float)
+
+    def _delay(self, endpoint: str) -> float:
+        base = self.latency.get(endpoint, 0.0)
+        return max(0.0, base * (1 + self.rng.uniform(-self.jitter, self.jitter)))
+
+    def _maybe_429(self, endpoint: str) -> None:
+        if self.rng.random() < self.rate_429:
+            self.rejected[endpoint] += 1
+            raise RuntimeError("429 RESOURCE_EXHAUSTED (injected by bench_ingestion)")
+
+    def call(self, endpoint: str) -> None:
+        delay = self._delay(endpoint)
+        self.calls[endpoint] += 1
+        self.busy_s[endpoint] += delay
+        time.sleep(delay)
+        self._maybe_429(endpoint)
+
+    async def acall(self, endpoint: str) -> None:
+        delay = self._delay(endpoint)
+        self.calls[endpoint] += 1
+        self.busy_s[endpoint] += delay
+        await asyncio.sleep(delay)
+        self._maybe_429(endpoint)
+
+    def report(self) -> dict:
+        return {
+            endpoint: {
+                "calls": self.calls[endpoint],
+                "rejected_429": self.rejected[endpoint],
+                "busy_s": round(self.busy_s[endpoint], 2),
+            }
+            for endpoint in sorted(self.calls)
+        }
+
+
+class _FakeFiles:
+    def __init__(self, fake: FakeGemini):
+        self._fake = fake
+        self._uploads: dict[str, str] = {}
+
+    def upload(self, file: str):
+        self._fake.call("files.upload")
+        name = f"files/{hashlib.blake2b(f'{file}{time.time_ns()}'.encode(), digest_size=8).hexdigest()}"
+        self._uploads[name] = file
+        return SimpleNamespace(name=name, state=SimpleNamespace(name="ACTIVE"), path=file)
+
+    def get(self, name: str):
+        return SimpleNamespace(name=name, state=SimpleNamespace(name="ACTIVE"), path=self._uploads[name])
+
+    def delete(self, name: str) -> None:
+        self._fake.call("files.delete")
+        self._uploads.pop(name, None)
+
+
+class _FakeModels:
+    def __init__(self, fake: FakeGemini):
+        self._fake = fake
+
+    async def generate_content(self, model: str, contents, config=None):
+        await self._fake.acall("generate_content")
+        uploaded, prompt = contents[0], contents[-1]
+        match = _PAGE_FROM_RE.search(prompt)
+        first = int(match.group(1)) if match else 1
+        text = await asyncio.to_thread(_fake_extract, uploaded.path, first)
+        return SimpleNamespace(text=text)
+
+    async def embed_content(self, model: str, contents: list[str], config=None):
+        await self._fake.acall("embed_content")
+        return SimpleNamespace(embeddings=[SimpleNamespace(values=_fake_vector(t)) for t in contents])
+
+
+class FakeGeminiClient:
+    """Drop-in for genai.Client(api_key=...) covering what ingestion calls."""
+
+    fake: FakeGemini  # Installed by install_fake_gemini()
+
+    def __init__(self, api_key: str = "", **kwargs):
+        self.api_key = api_key
+        self.files = _FakeFiles(self.fake)
+        self.aio = SimpleNamespace(models=_FakeModels(self.fake))
+
+
+def _fake_extract(path: str, first: int) -> str:
+    import fitz  # PyMuPDF
+    with fitz.open(path) as doc:
+        return "\n\n".join(f"[Page {first + i}]\n{page.get_text()}" for i, page in enumerate(doc))
+
+
+def _fake_vector(text: str) -> list[float]:
+    import numpy as np
+    seed = int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "little")
+    vec = np.random.default_rng(seed).standard_normal(EMBED_DIM)
+    return (vec / np.linalg.norm(vec)).tolist()
+
+
+def install_fake_gemini(fake: FakeGemini, keys: int) -> None:
+    """Point core.llm_router at the fake client and give the INGESTION pool `keys` fake keys."""
+    from core import llm_router
+    FakeGeminiClient.fake = fake
+    llm_router.genai = SimpleNamespace(Client=FakeGeminiClient)
+    pool = llm_router.ingestion_key_manager
+    pool.keys = [f"bench-key-{i:04d}" for i in range(keys)]
+    pool._unhealthy.clear()
+    pool._idx = 0
+
+
+# ══════════════════════════════════════════════════════════════════════
+# Run
+# ══════════════════════════════════════════════════════════════════════
+
+_stage_done: dict[str, dict[str, float]] = defaultdict(dict)
+
+
+def _timed_stage(name: str, stage_fn):
+    """Record when a pipeline stage drained, relative to the run's start."""
+    async def _wrapper(run, *args, **kwargs):
+        try:
+            return await stage_fn(run, *args, **kwargs)
+        finally:
+            _stage_done[run.file_id][name] = time.time() - run.t_start
+            if name == "upsert" and run.t_first_upsert is not None:
+                _stage_done[run.file_id]["first_upsert"] = run.t_first_upsert
+    return _wrapper
+
+
+async def _ingest_corpus(args: argparse.Namespace, pdfs: list[Path]) -> dict:
+    from api.services import ingestion
+    from database.mongo import get_db
+
+    for name in STAGES:
+        attr = f"_{name}_stage"
+        setattr(ingestion, attr, _timed_stage(name, getattr(ingestion, attr)))
+    if args.tier == "gemini":
+        ingestion.TRIAGE_ENABLED = False     # Tier 1 first for every file
+
+    db = get_db()
+    file_ids = []
+    for i, pdf in enumerate(pdfs):
+        file_id = f"bench_{i:04d}"
+        await db.file_metadata.insert_one({
+            "file_id": file_id,
+            "original_name": pdf.name,
+            "storage_path": str(pdf),
+            "file_type": "pdf",
+            "classroom_id": BENCH_CLASSROOM,
+            "doc_type": "notes",
+            "uploaded_by": "bench",
+            "processing": {"status": "pending"},
+        })
+        file_ids.append(file_id)
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    failed = 0
+
+    async def _one(file_id: str) -> None:
+        nonlocal failed
+        async with semaphore:
+            try:
+                await ingestion._process_file_async(file_id)
+            except Exception as e:
+                failed += 1
+                print(f"  {file_id} failed: {e}")
+
+    rss_before = _peak_rss_mb()
+    t0 = time.perf_counter()
+    await asyncio.gather(*(_one(f) for f in file_ids))
+    elapsed = time.perf_counter() - t0
+
+    docs = await db.file_metadata.find(
+        {"file_id": {"$in": file_ids}, "processing.status": "completed"},
+    ).to_list(length=None)
+    chunks = sum(d["processing"].get("chunk_count", 0) for d in docs)
+    tiers: dict[str, list[float]] = defaultdict(list)
+    methods: dict[str, int] = defaultdict(int)
+    for d in docs:
+        methods[d["processing"].get("extraction_method")] += 1
+        for tier, seconds in (d["processing"].get("extraction_timings") or {}).items():
+            tiers[tier].append(seconds)
+
+    def _mean(values: list[float]) -> float:
+        return round(statistics.mean(values), 2) if values else 0.0
+
+    stage_names = STAGES + ["first_upsert"]
+    return {
+        "docs": len(docs),
+        "failed": failed,
+        "chunks": chunks,
+        "elapsed_s": round(elapsed, 2),
+        "docs_per_min": round(len(docs) / elapsed * 60, 2) if elapsed else 0.0,
+        "chunks_per_s": round(chunks / elapsed, 2) if elapsed else 0.0,
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "rss_before_mb": round(rss_before, 1),
+        "stages_s": {name: _mean([s[name] for s in _stage_done.values() if name in s]) for name in stage_names},
+        "extraction_s": {tier: _mean(v) for tier, v in sorted(tiers.items())},
+        "extraction_methods": dict(methods),
+    }
+
+
+async def _main_async(args: argparse.Namespace, pdfs: list[Path], workdir: Path) -> dict:
+    from api.services import artifacts
+    from core.config import settings
+    from core.embedding_cache import embedding_cache
+    from database import chroma
+    from database.mongo import close_db, connect_db, get_db
+
+    fake = FakeGemini(
+        latency={
+            "files.upload": args.upload_latency,
+            "files.delete": args.upload_latency / 4,
+            "generate_content": args.generate_latency,
+            "embed_content": args.embed_latency,
+        },
+        jitter=args.jitter,
+        rate_429=args.rate_429,
+        seed=args.seed,
+    )
+    install_fake_gemini(fake, args.keys)
+
+    if not args.with_cache:
+        async def _miss(model, task_type, texts):
+            return [None] * len(texts)
+
+        async def _skip(*a, **kw) -> None:
+            return None
+
+        embedding_cache.get_many = _miss
+        embedding_cache.put_many = _skip
+
+    chroma.CHROMA_PATH = str(workdir / "chroma")
+    chroma.INDEX_POINTER_PATH = os.path.join(chroma.CHROMA_PATH, "active_index.json")
+    chroma.connect_chroma()
+    artifacts.ARTIFACT_DIR = workdir / "artifacts"
+
+    settings.MONGO_DB = f"{settings.MONGO_DB}_bench"
+    await connect_db()
+    db = get_db()
+    await db.client.drop_database(settings.MONGO_DB)
+    try:
+        result = await _ingest_corpus(args, pdfs)
+    finally:
+        await db.client.drop_database(settings.MONGO_DB)
+        await close_db()
+    result["api"] = fake.report()
+    return result
+
+
+# ══════════════════════════════════════════════════════════════════════
+# Baseline
+# ══════════════════════════════════════════════════════════════════════
+
+def _compare(result: dict, baseline: dict, max_regression: float) -> list[str]:
+    """Regressions beyond max_regression (fraction) on the tracked metrics."""
+    failures = []
+    for metric, higher_is_better in (("docs_per_min", True), ("chunks_per_s", True), ("peak_rss_mb", False)):
+        old, new = baseline["result"].get(metric), result.get(metric)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        print(f"  {metric:<14} {old:>10} → {new:<10} ({change:+.1%})")
+        if (-change if higher_is_better else change) > max_regression:
+            failures.append(f"{metric} {old} → {new} ({change:+.1%})")
+    return failures
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=10, help="Synthetic corpus size")
+    parser.add_argument("--pages", type=int, default=25, help="Pages per synthetic PDF")
+    parser.add_argument("--pdf-dir", help="Ingest the PDFs in this directory instead")
+    parser.add_argument("--tier", choices=["auto", "gemini"], default="auto",
+                        help="auto: triage decides (text-native → PyMuPDF); gemini: Tier 1 for every file")
+    parser.add_argument("--concurrency", type=int, default=2, help="Files ingested at once")
+    parser.add_argument("--keys", type=int, default=4, help="Fake INGESTION keys")
+    parser.add_argument("--upload-latency", type=float, default=0.3, help="Seconds per files.upload")
+    parser.add_argument("--generate-latency", type=float, default=2.0, help="Seconds per generate_content")
+    parser.add_argument("--embed-latency", type=float, default=0.4, help="Seconds per embed_content batch")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Latency jitter (± fraction)")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Probability a fake call fails with 429")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--with-cache", action="store_true", help="Keep the Redis embedding cache")
+    parser.add_argument("--baseline", help="Baseline JSON to compare against (or to write)")
+    parser.add_argument("--update-baseline", action="store_true", help="Write this run to --baseline")
+    parser.add_argument("--max-regression", type=float, default=0.15,
+                        help="Allowed regression vs the baseline before exiting 1")
+    args = parser.parse_args()
+
+    config = {k: v for k, v in vars(args).items() if k not in ("baseline", "update_baseline", "max_regression")}
+
+    with tempfile.TemporaryDirectory(prefix="bench_ingestion_") as tmp:
+        workdir = Path(tmp)
+        if args.pdf_dir:
+            pdfs = sorted(Path(args.pdf_dir).glob("*.pdf"))
+        else:
+            corpus = workdir / "corpus"
+            corpus.mkdir()
+            t0 = time.perf_counter()
+            pdfs = []
+            for i in range(args.docs):
+                path = corpus / f"doc_{i:04d}.pdf"
+                build_corpus_pdf(str(path), args.pages, seed=args.seed * 100_003 + i)
+                pdfs.append(path)
+            print(f"Built {len(pdfs)} × {args.pages}-page PDFs in {time.perf_counter() - t0:.1f}s")
+        if not pdfs:
+            sys.exit("No PDFs to ingest")
+
+        result = asyncio.run(_main_async(args, pdfs, workdir))
+
+    print(f"\n{result['docs']} docs ({result['failed']} failed), {result['chunks']} chunks "
+          f"in {result['elapsed_s']}s")
+    print(f"  docs/min       {result['docs_per_min']}")
+    print(f"  chunks/s       {result['chunks_per_s']}")
+    print(f"  peak RSS       {result['peak_rss_mb']} MB (before run: {result['rss_before_mb']} MB)")
+    print(f"  methods        {result['extraction_methods']}")
+    print("  stage drained at (mean s from run start):")
+    for name, seconds in result["stages_s"].items():
+        print(f"    {name:<14} {seconds}")
+    if result["extraction_s"]:
+        print("  extraction tiers (mean s):")
+        for tier, seconds in result["extraction_s"].items():
+            print(f"    {tier:<14} {seconds}")
+    print("  fake API:")
+    for endpoint, stats in result["api"].items():
+        print(f"    {endpoint:<18} {stats['calls']:>6} calls  {stats['rejected_429']:>4} × 429  "
+              f"{stats['busy_s']:>8}s busy")
+
+    if not args.baseline:
+        return
+    if args.update_baseline:
+        Path(args.baseline).write_text(json.dumps({"config": config, "result": result}, indent=2) + "\n")
+        print(f"\nBaseline written to {args.baseline}")
+        return
+
+    baseline = json.loads(Path(args.baseline).read_text())
+    if baseline.get("config") != config:
+        print(f"\nBaseline {args.baseline} was recorded with different options — not compared")
+        print(f"  baseline: {baseline.get('config')}")
+        return
+    print(f"\nvs baseline {args.baseline}:")
+    failures = _compare(result, baseline, args.max_regression)
+    if failures:
+        print(f"FAIL: regressed more than {args.max_regression:.0%}: " + "; ".join(failures))
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
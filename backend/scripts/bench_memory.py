@@ -0,0 +1,223 @@
+"""
+bench_memory.py — Peak memory of the streaming pipeline on a very large PDF
+
+Builds a synthetic text-native PDF (2000 pages by default; triage sends it to
+Tier 3) and runs the real extract → chunk → embed stages on it, each mode in a
+fresh process so ru_maxrss is that run's own peak:
+
+  whole    INGESTION_STREAM_PAGES=0: the PyMuPDF pool returns every page, the
+           full text is joined, saved as the artifact and split into sections
+  stream   pages flow from pdf_text.iter_pages() into the chunk stage and the
+           artifact writer one range at a time
+  canvas   the Celery canvas stage bodies (services/ingestion_canvas.py) back to
+           back: pages streamed into the artifact, the artifact read back into
+           the per-batch chunk manifest, then each batch embedded to a vector file
+
+Embeddings come from a fake embedder (random 3072-dim vectors as Python float
+lists, like a decoded API response) and the upsert stage is replaced by a sink,
+so neither Gemini nor ChromaDB/MongoDB is needed. Process-pool workers are
+separate processes and are not counted.
+
+It also reports what one queued embedding batch costs as Python float lists
+vs the float32 array the pipeline now carries.
+
+--max-rss-mb turns the stream and canvas runs into a regression check: exit
+status 1 if either peak RSS grows past the limit.
+
+Usage:
+    cd backend
+    uv run python scripts/bench_memory.py
+    uv run python scripts/bench_memory.py --pages 5000
+    uv run python scripts/bench_memory.py --pdf path/to/textbook.pdf --max-rss-mb 400
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+EMBED_DIM = 3072    # gemini-embedding-001
+BATCH_SIZE = 50     # EMBED_BATCH_SIZE
+CONCURRENCY = 4
+_MODES = ("whole", "stream", "canvas")
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20
+
+
+class _FakeEmbedder:
+    """AdaptiveEmbedder stand-in: fixed batch size and concurrency, random vectors."""
+
+    batch_size = BATCH_SIZE
+    concurrency = CONCURRENCY
+
+    def __init__(self) -> None:
+        self.rng = random.Random(0)
+
+    async def embed(self, texts: list[str]) -> list[list[float]]:
+        await asyncio.sleep(0)
+        return [[self.rng.random() for _ in range(EMBED_DIM)] for _ in texts]
+
+
+async def _sink_stage(run, in_q: asyncio.Queue) -> None:
+    """Upsert stand-in: drop each batch, move the watermark like _upsert_stage."""
+    from api.services import ingestion
+    while (item := await in_q.get()) is not ingestion._DONE:
+        records, kept, _ = item
+        run.upserted_count += len(kept)
+        ingestion._advance_watermark(run, records)
+
+
+async def _run_pipeline(pdf: str) -> dict:
+    from api.services import ingestion
+
+    async def _no_db(*args, **kwargs) -> None:
+        return None
+
+    ingestion._record_artifact = _no_db  # Artifacts are still written; MongoDB is not needed
+    run = ingestion._IngestionRun(file_id="bench", base_metadata={})
+    sections_q: asyncio.Queue = asyncio.Queue(maxsize=ingestion.PIPELINE_QUEUE_SIZE)
+    chunks_q: asyncio.Queue = asyncio.Queue(maxsize=BATCH_SIZE * ingestion.PIPELINE_QUEUE_SIZE)
+    vectors_q: asyncio.Queue = asyncio.Queue(maxsize=ingestion.PIPELINE_QUEUE_SIZE)
+    await ingestion._run_stages(
+        ingestion._extract_stage(run, pdf, "pdf", sections_q),
+        ingestion._chunk_stage(run, sections_q, chunks_q),
+        ingestion._embed_stage(run, _FakeEmbedder(), chunks_q, vectors_q),
+        _sink_stage(run, vectors_q),
+    )
+    return {"chunks": run.chunk_count, "upserted": run.upserted_count, "pages": run.indexed_pages}
+
+
+async def _run_canvas(pdf: str) -> dict:
+    """The extract, chunk and embed stage bodies of the canvas, minus MongoDB and ChromaDB."""
+    import numpy as np
+    from api.services import artifacts
+    from api.services import ingestion_canvas as canvas
+    from api.services.chunker import CHUNK_TOKENS
+    from api.services.near_dup import ChunkDeduper
+
+    pointer = await asyncio.to_thread(canvas._write_pdf_pages, "bench", pdf)
+    with artifacts.open_extraction(pointer) as fh:
+        sections = canvas._iter_artifact_sections(fh)
+        chunk_count = await asyncio.to_thread(
+            artifacts.save_chunks, "bench",
+            canvas._chunk_text("bench", sections, ChunkDeduper(), CHUNK_TOKENS),
+            canvas.CANVAS_BATCH_CHUNKS,
+        )
+
+    embedder = _FakeEmbedder()
+    pages = 0
+    for batch_no in range(-(-chunk_count // canvas.CANVAS_BATCH_CHUNKS)):
+        records = artifacts.load_chunks("bench", *canvas._batch_bounds(batch_no))
+        texts = [r["text"] for r in records if not r.get("alias_of")]
+        vectors = [vec for i in range(0, len(texts), BATCH_SIZE)
+                   for vec in await embedder.embed(texts[i:i + BATCH_SIZE])]
+        artifacts.save_vectors("bench", batch_no, np.asarray(vectors, dtype=np.float32))
+        del vectors
+        artifacts.delete_vectors("bench", batch_no)
+        pages = records[-1].get("page_end", records[-1]["page_number"]) or pages
+    return {"chunks": chunk_count, "upserted": chunk_count, "pages": pages}
+
+
+def _child(mode: str, pdf: str, artifact_dir: str) -> None:
+    """One measured run; prints a JSON line for the parent."""
+    os.environ["INGESTION_STREAM_PAGES"] = "0" if mode == "whole" else "1"
+    from api.services import artifacts, ingestion
+    artifacts.ARTIFACT_DIR = Path(artifact_dir)
+    ingestion.PDF_STREAM_PAGES = mode != "whole"
+    if mode == "canvas":
+        from api.services import ingestion_canvas  # noqa: F401  (imports count toward the baseline)
+
+    baseline = _peak_rss_mb()
+    t0 = time.perf_counter()
+    result = asyncio.run(_run_canvas(pdf) if mode == "canvas" else _run_pipeline(pdf))
+    result.update(mode=mode, baseline_mb=baseline, peak_mb=_peak_rss_mb(),
+                  elapsed_s=time.perf_counter() - t0)
+    print(json.dumps(result))
+
+
+def _measure(mode: str, pdf: str, artifact_dir: str) -> dict:
+    out = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", mode, "--pdf", pdf,
+         "--artifact-dir", artifact_dir],
+        check=True, capture_output=True, text=True, cwd=BACKEND_DIR,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def _batch_footprint() -> tuple[float, float]:
+    """MB held by one embedding batch as decoded float lists vs a float32 array."""
+    import numpy as np
+    rng = random.Random(0)
+    tracemalloc.start()
+    lists = [[rng.random() for _ in range(EMBED_DIM)] for _ in range(BATCH_SIZE)]
+    as_lists = tracemalloc.get_traced_memory()[0]
+    array = np.asarray(lists, dtype=np.float32)
+    del lists
+    as_array = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert array.nbytes == BATCH_SIZE * EMBED_DIM * 4
+    return as_lists / 2**20, as_array / 2**20
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=2000, help="Synthetic PDF length")
+    parser.add_argument("--pdf", help="Benchmark an existing (text-native) PDF instead")
+    parser.add_argument("--modes", nargs="+", default=list(_MODES), choices=_MODES)
+    parser.add_argument("--max-rss-mb", type=float, help="Fail if a streaming run's peak RSS exceeds this")
+    parser.add_argument("--child", choices=_MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--artifact-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _child(args.child, args.pdf, args.artifact_dir)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf = args.pdf
+        if not pdf:
+            from scripts.bench_pymupdf import build_synthetic_pdf
+            pdf = os.path.join(tmp, "synthetic.pdf")
+            t0 = time.perf_counter()
+            build_synthetic_pdf(pdf, args.pages)
+            print(f"Built {args.pages}-page synthetic PDF in {time.perf_counter() - t0:.1f}s "
+                  f"({os.path.getsize(pdf) / 2**20:.1f} MB)")
+        print(f"Document: {pdf}\n")
+
+        results = {}
+        for mode in args.modes:
+            r = results[mode] = _measure(mode, pdf, os.path.join(tmp, f"artifacts-{mode}"))
+            print(f"{mode:<8} peak RSS {r['peak_mb']:7.1f} MB  (+{r['peak_mb'] - r['baseline_mb']:6.1f} MB "
+                  f"over imports)  {r['elapsed_s']:6.1f}s  {r['chunks']} chunks, {r['pages']} pages")
+
+    lists_mb, array_mb = _batch_footprint()
+    print(f"\nOne queued batch ({BATCH_SIZE} x {EMBED_DIM}): {lists_mb:.1f} MB as float lists, "
+          f"{array_mb:.1f} MB as float32")
+
+    over = [mode for mode in ("stream", "canvas")
+            if args.max_rss_mb and mode in results and results[mode]["peak_mb"] > args.max_rss_mb]
+    for mode in over:
+        print(f"\nFAIL: {mode} peak RSS {results[mode]['peak_mb']:.1f} MB > {args.max_rss_mb:.0f} MB")
+    if over:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
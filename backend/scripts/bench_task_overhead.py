@@ -0,0 +1,103 @@
+"""
+bench_task_overhead.py — Per-task overhead: asyncio.run() per task vs the worker loop
+
+Simulates a queue of many small files. Each "task" does the bookkeeping a
+small file costs outside extraction/embedding: a file_metadata lookup, a
+status update, a ChromaDB count and a Redis publish.
+
+  per-task   what process_file_task did before: asyncio.run() → connect_db() →
+             connect_chroma() → work → close_db() / RedisManager.close()
+  persistent core.worker_loop: one loop and shared handles for the whole run
+
+Needs the MongoDB / Redis from docker-compose and the local chroma_data/.
+
+Usage:
+    cd backend
+    uv run python scripts/bench_task_overhead.py
+    uv run python scripts/bench_task_overhead.py --tasks 500
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core import worker_loop  # noqa: E402
+from database.chroma import connect_chroma, get_chroma_collection  # noqa: E402
+from database.mongo import close_db, connect_db, get_db  # noqa: E402
+from database.redis import RedisManager, get_redis  # noqa: E402
+
+BENCH_FILE_ID = "bench_task_overhead"
+
+
+async def _small_file_work(n: int) -> None:
+    db = get_db()
+    await db.file_metadata.find_one({"file_id": BENCH_FILE_ID})
+    await db.bench_task_overhead.update_one(
+        {"_id": BENCH_FILE_ID}, {"$set": {"n": n}}, upsert=True,
+    )
+    await asyncio.to_thread(get_chroma_collection().count)
+    redis = await get_redis()
+    await redis.publish("bench_task_overhead", str(n))
+
+
+def _per_task(n: int) -> None:
+    async def _run():
+        await connect_db()
+        connect_chroma()
+        try:
+            await _small_file_work(n)
+        finally:
+            await close_db()
+            await RedisManager.close()
+
+    asyncio.run(_run())
+
+
+def _persistent(n: int) -> None:
+    worker_loop.run(lambda: _small_file_work(n))
+
+
+def _bench(label: str, fn, tasks: int) -> None:
+    fn(-1)  # Warm-up: imports, first connections
+    samples = []
+    t0 = time.perf_counter()
+    for n in range(tasks):
+        t = time.perf_counter()
+        fn(n)
+        samples.append((time.perf_counter() - t) * 1000)
+    total = time.perf_counter() - t0
+    samples.sort()
+    p95 = samples[max(0, int(len(samples) * 0.95) - 1)]
+    print(f"{label:<12} {total:8.2f}s  {tasks / total:8.1f} tasks/s  "
+          f"median {statistics.median(samples):7.1f}ms  p95 {p95:7.1f}ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=200, help="Small-file tasks per mode")
+    args = parser.parse_args()
+
+    print(f"{args.tasks} small-file tasks per mode\n")
+    _bench("per-task", _per_task, args.tasks)
+    _bench("persistent", _persistent, args.tasks)
+
+    async def _cleanup():
+        await get_db().bench_task_overhead.drop()
+
+    worker_loop.run(_cleanup)
+    worker_loop.stop()
+
+
+if __name__ == "__main__":
+    main()
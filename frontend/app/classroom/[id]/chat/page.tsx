@@ -323,7 +323,7 @@ export default function ClassroomChatPage({ params }: { params: Promise<{ id: st
                                                         >
                                                             <BookOpen size={14} className="text-amber-600" />
                                                             <span>{s.file_name}</span>
-                                                            <span className="bg-amber-50 px-2 py-0.5 rounded-lg text-[10px] text-amber-600">PG {s.page_number}</span>
+                                                            <span className="bg-amber-50 px-2 py-0.5 rounded-lg text-[10px] text-amber-600">PG {s.page_number}{s.page_end && s.page_end > s.page_number ? `–${s.page_end}` : ''}</span>
                                                         </motion.div>
                                                     ))}
                                                 </div>
@@ -84,7 +84,7 @@ export default function ClassroomPage({ params }: { params: Promise<{ id: string
             return;
         }
 
-        if (msg.type === "announcement_updated" || msg.type === "file_processed") {
+        if (msg.type === "announcement_updated" || msg.type === "file_processed" || msg.type === "file_progress") {
             console.log(`[useClassroomSocket] 🔔 Event Received: ${msg.type}`);
             refreshAnnouncements();
             if (msg.type === "file_processed" && msg.status === "ready") {
@@ -500,10 +500,20 @@ export default function ClassroomPage({ params }: { params: Promise<{ id: string
                                                                             <span className="text-[9px] font-black uppercase tracking-widest italic">Ready for AI Chat</span>
                                                                         </div>
                                                                     )}
+                                                                    {ann.file.processing?.status === "partially_ready" && (
+                                                                        <div className="px-3 py-1 rounded-full bg-sky-50 text-sky-600 border border-sky-100 flex items-center gap-2">
+                                                                            {!ann.file.processing?.error && <Loader2 size={12} className="animate-spin" />}
+                                                                            <span className="text-[9px] font-black uppercase tracking-widest">
+                                                                                Chat Ready{ann.file.processing?.indexed_pages ? ` · Pages 1–${ann.file.processing.indexed_pages}` : ""}
+                                                                            </span>
+                                                                        </div>
+                                                                    )}
                                                                     {(ann.file.processing?.status === "pending" || ann.file.processing?.status === "processing") && (
                                                                         <div className="px-3 py-1 rounded-full bg-amber-50 text-amber-600 border border-amber-100 flex items-center gap-2">
                                                                             <Loader2 size={12} className="animate-spin" />
-                                                                            <span className="text-[9px] font-black uppercase tracking-widest animate-pulse">AI is Reading File...</span>
+                                                                            <span className="text-[9px] font-black uppercase tracking-widest animate-pulse">
+                                                                                AI is Reading File...{ann.file.processing?.estimate?.eta_s ? ` · ~${Math.max(1, Math.round(ann.file.processing.estimate.eta_s / 60))} min` : ""}
+                                                                            </span>
                                                                         </div>
                                                                     )}
                                                                     {ann.file.processing?.status === "failed" && (
@@ -66,7 +66,7 @@ export default function DeepLearnPage() {
 
     // ── Processed files only ────────────────────────────────────
     const processedFiles = files.filter(
-        (f) => f.processing.status === "completed"
+        (f) => f.processing.status === "completed" || f.processing.status === "partially_ready"
     );
 
     // ── Handlers ────────────────────────────────────────────────
@@ -27,6 +27,7 @@ export interface ChatMessage {
 export interface SourceRef {
     file_name: string;
     page_number: number;
+    page_end?: number | null;
     relevance_score: number;
     chunk_preview?: string;
 }
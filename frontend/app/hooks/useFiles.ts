@@ -28,7 +28,14 @@ export interface FileMetadata {
         status: string;
         chunk_count: number;
         page_count: number | null;
+        indexed_pages?: number;
         error: string | null;
+        estimate?: {
+            api_calls: number;
+            worker_minutes: number;
+            wall_time_s: number;
+            eta_s: number;
+        };
     };
     visibility: string;
     uploaded_by: string;
@@ -96,52 +103,83 @@ export function useFiles(classroomId?: string) {
         fetchFiles();
     }, [fetchFiles]);
 
+    /**
+     * Hash-first, resumable upload: the server is asked about the file's sha256
+     * before any bytes are sent, so duplicates cost one request. New files go up
+     * in chunks; a dropped connection resumes from the server's byte count.
+     */
     const uploadFile = async (
-        file: File, 
+        file: File,
         docType: string = "academic_material",
         onProgress?: (percent: number) => void
     ): Promise<{ file_id: string } | any> => {
         if (!user || !user.token) return;
 
-        return new Promise((resolve, reject) => {
-            const xhr = new XMLHttpRequest();
-            const formData = new FormData();
-            formData.append("file", file);
-            formData.append("classroom_id", classroomId || "");
-            formData.append("doc_type", docType);
-
-            xhr.upload.addEventListener("progress", (event) => {
-                if (event.lengthComputable && onProgress) {
-                    const percent = Math.round((event.loaded / event.total) * 100);
-                    onProgress(percent);
-                }
+        const headers = { "Authorization": `Bearer ${user.token}` };
+        const request = async (path: string, init: RequestInit = {}) => {
+            const res = await fetch(`${API_BASE_URL}${path}`, {
+                ...init,
+                headers: { ...headers, ...(init.headers || {}) },
             });
+            const body = await res.json().catch(() => ({}));
+            if (!res.ok) {
+                const detail = typeof body.detail === "string" ? body.detail : body.detail?.message;
+                throw Object.assign(new Error(detail || "Upload failed"), { status: res.status, body });
+            }
+            return body;
+        };
+
+        const digest = await crypto.subtle.digest("SHA-256", await file.arrayBuffer());
+        const sha256 = Array.from(new Uint8Array(digest))
+            .map((b) => b.toString(16).padStart(2, "0"))
+            .join("");
+
+        const init = await request("/api/upload/init", {
+            method: "POST",
+            headers: { "Content-Type": "application/json" },
+            body: JSON.stringify({
+                classroom_id: classroomId || "",
+                sha256,
+                size: file.size,
+                filename: file.name,
+                mime_type: file.type,
+                doc_type: docType,
+            }),
+        });
+        if (init.result !== "upload") {
+            onProgress?.(100);
+            fetchFiles();
+            return init;
+        }
 
-            xhr.onreadystatechange = () => {
-                if (xhr.readyState === XMLHttpRequest.DONE) {
-                    if (xhr.status >= 200 && xhr.status < 300) {
-                        try {
-                            const result = JSON.parse(xhr.responseText);
-                            fetchFiles(); // Refresh list
-                            resolve(result);
-                        } catch {
-                            resolve({ success: true });
-                        }
-                    } else {
-                        try {
-                            const error = JSON.parse(xhr.responseText);
-                            reject(new Error(error.detail || "Upload failed"));
-                        } catch {
-                            reject(new Error("Upload failed"));
-                        }
-                    }
-                }
-            };
+        let received: number = init.received;
+        let failures = 0;
+        while (received < file.size) {
+            onProgress?.(Math.round((received / file.size) * 100));
+            const chunk = file.slice(received, received + init.chunk_size);
+            try {
+                const res = await request(`/api/upload/${init.upload_id}?offset=${received}`, {
+                    method: "PUT",
+                    headers: { "Content-Type": "application/octet-stream" },
+                    body: chunk,
+                });
+                received = res.received;
+                failures = 0;
+            } catch (err) {
+                const status = (err as { status?: number }).status;
+                if (status && status !== 409 && status < 500) throw err;
+                if (++failures > 5) throw err;
+                // Resume from whatever the server actually stored
+                await new Promise((r) => setTimeout(r, 1000 * failures));
+                const state = await request(`/api/upload/${init.upload_id}`);
+                received = state.received;
+            }
+        }
 
-            xhr.open("POST", `${API_BASE_URL}/api/upload/file`);
-            xhr.setRequestHeader("Authorization", `Bearer ${user.token}`);
-            xhr.send(formData);
-        });
+        const result = await request(`/api/upload/${init.upload_id}/complete`, { method: "POST" });
+        onProgress?.(100);
+        fetchFiles(); // Refresh list
+        return result;
     };
 
     return { files, loading, error, refetch: fetchFiles, uploadFile };